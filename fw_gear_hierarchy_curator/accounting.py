@@ -0,0 +1,159 @@
+"""Accounting of SDK requests per curator method.
+
+With `config.api_accounting` set, each worker counts the SDK requests it makes
+by verb and endpoint, with the bytes sent and received and the time spent,
+attributed to the `validate_<container>` or `curate_<container>` method that
+made them.  Requests made by the engine itself, e.g. to walk the hierarchy,
+are attributed to `(engine)`.  The counts of the workers are combined into a
+table logged at the end of the run, which also shows the number of requests
+per call of each method so that N+1 request patterns stand out.
+"""
+import collections
+import contextlib
+import logging
+import typing as t
+
+from flywheel_gear_toolkit.utils import curator as c
+
+from .utils import Request, add_request_hook, get_config_option
+
+log = logging.getLogger(__name__)
+
+# Method requests made outside of curator methods are attributed to.
+ENGINE = "(engine)"
+
+# Accounts of the current process, if enabled.
+_accounts: t.Optional["Accounts"] = None
+
+
+class Accounts:
+    """Requests made by one process, per curator method, verb and endpoint."""
+
+    def __init__(self) -> None:
+        self.method = ENGINE
+        # (method, verb, path): [calls, sent, received, seconds]
+        self.requests: t.Dict[t.Tuple[str, str, str], t.List] = collections.defaultdict(
+            lambda: [0, 0, 0, 0.0]
+        )
+        self.invocations: t.Counter[str] = collections.Counter()
+
+    def record(self, request: Request) -> None:
+        """Record a request made by the current method."""
+        row = self.requests[(self.method, request.method, request.path)]
+        row[0] += 1
+        row[1] += request.sent
+        row[2] += request.received
+        row[3] += request.duration
+
+    @contextlib.contextmanager
+    def attribute(self, method: str):
+        """Attribute the requests made in the block to a method."""
+        previous = self.method
+        self.method = method
+        self.invocations[method] += 1
+        try:
+            yield
+        finally:
+            self.method = previous
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        """Pickleable copy of the accounts."""
+        return {
+            "requests": [[*key, *row] for key, row in self.requests.items()],
+            "invocations": dict(self.invocations),
+        }
+
+
+def attribute(method: str) -> t.ContextManager:
+    """Attribute requests to a curator method, if accounting is enabled."""
+    if _accounts is None:
+        return contextlib.nullcontext()
+    return _accounts.attribute(method)
+
+
+def start_worker_accounting(
+    local_curator: c.HierarchyCurator, shared: t.Optional[t.MutableSequence]
+) -> None:
+    """Start accounting the requests of a worker if enabled."""
+    global _accounts  # pylint: disable=global-statement
+    _accounts = None
+    if shared is None:
+        return
+    _accounts = Accounts()
+    add_request_hook(local_curator.context._client, _accounts.record)
+
+
+def stop_worker_accounting(shared: t.Optional[t.MutableSequence]) -> None:
+    """Add the accounts of a worker to `shared` and stop accounting."""
+    global _accounts  # pylint: disable=global-statement
+    if _accounts is not None and shared is not None:
+        shared.append(_accounts.to_dict())
+    _accounts = None
+
+
+def start_accounting(
+    curator: c.HierarchyCurator, manager: t.Any
+) -> t.Optional[t.MutableSequence]:
+    """Create the list workers add their accounts to if enabled."""
+    if not get_config_option(curator, "api_accounting"):
+        return None
+    return manager.list()
+
+
+def _format_bytes(size: float) -> str:
+    for unit in ["B", "KB", "MB", "GB"]:
+        if size < 1024:
+            return f"{size:.0f}{unit}"
+        size /= 1024
+    return f"{size:.0f}TB"
+
+
+def format_table(accounts: t.Iterable[t.Dict[str, t.Any]]) -> str:
+    """Combine the accounts of the workers into a table.
+
+    Rows are sorted by number of requests.  `Per call` is the number of
+    requests per call of the method.
+    """
+    totals: t.Dict[t.Tuple[str, str, str], t.List] = collections.defaultdict(
+        lambda: [0, 0, 0, 0.0]
+    )
+    invocations: t.Counter[str] = collections.Counter()
+    for account in accounts:
+        for method, verb, path, *row in account["requests"]:
+            totals[(method, verb, path)] = [
+                a + b for a, b in zip(totals[(method, verb, path)], row)
+            ]
+        invocations.update(account["invocations"])
+    header = ["Method", "Request", "Calls", "Per call", "Sent", "Received", "Time"]
+    rows = []
+    for (method, verb, path), (calls, sent, received, seconds) in sorted(
+        totals.items(), key=lambda item: -item[1][0]
+    ):
+        per_call = (
+            f"{calls / invocations[method]:.1f}" if method in invocations else "-"
+        )
+        rows.append(
+            [
+                method,
+                f"{verb} {path}",
+                str(calls),
+                per_call,
+                _format_bytes(sent),
+                _format_bytes(received),
+                f"{seconds:.1f}s",
+            ]
+        )
+    widths = [max(len(row[i]) for row in [header, *rows]) for i in range(len(header))]
+    lines = [
+        "  ".join(cell.ljust(width) for cell, width in zip(row, widths)).rstrip()
+        for row in [header, *rows]
+    ]
+    lines.insert(1, "  ".join("-" * width for width in widths))
+    return "\n".join(lines)
+
+
+def log_accounting(shared: t.Optional[t.MutableSequence]) -> None:
+    """Log the table of requests made by the workers."""
+    if shared is None:
+        return
+    log.info("SDK requests per curator method:\n" + format_table(list(shared)))
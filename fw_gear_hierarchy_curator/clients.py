@@ -0,0 +1,107 @@
+"""SDK clients of the workers, created from settings resolved once.
+
+Each worker used to create its client with the gear toolkit `get_client()`,
+looking up the API key in the gear config (or the CLI config) again, with a
+cold connection pool sized for 10 threads.  The main process now resolves the
+endpoint, API key, headers and timeouts of its own client once into a
+`ClientFactory`, which the workers call to create their client without any
+lookup or request.
+
+The client of each worker keeps a persistent session whose connection pool
+holds `client_threads` connections, the number of threads the curator makes
+SDK requests from in a worker (1 by default), so that connections are reused
+rather than opened and dropped.
+"""
+import dataclasses
+import logging
+import typing as t
+import urllib.parse
+
+import flywheel
+import requests
+from flywheel_gear_toolkit.utils import curator as c
+
+from .utils import get_config_option
+
+log = logging.getLogger(__name__)
+
+
+@dataclasses.dataclass(frozen=True)
+class ClientFactory:
+    """Creates SDK clients like the client of the main process.
+
+    Attributes:
+        api_key: API key, with the host and port of the endpoint.
+        headers: Default headers, e.g. the features enabled on the client.
+        pool_size: Connections kept open to each host.
+        request_timeout: Request timeout of the client, if the SDK has one.
+        connect_timeout: Connect timeout of the client, if the SDK has one.
+    """
+
+    api_key: str
+    headers: t.Dict[str, str]
+    pool_size: int = 1
+    request_timeout: t.Optional[float] = None
+    connect_timeout: t.Optional[float] = None
+
+    @classmethod
+    def from_client(
+        cls, client: flywheel.Client, pool_size: int = 1
+    ) -> "ClientFactory":
+        """Resolve the settings of a client."""
+        api_client = client.api_client
+        config = api_client.configuration
+        url = urllib.parse.urlsplit(config.host)
+        parts = [url.hostname, str(url.port or 443)]
+        if url.scheme == "http":
+            parts.append("__force_insecure")
+        parts.append(config.api_key["Authorization"])
+        return cls(
+            api_key=":".join(parts),
+            headers=dict(api_client.default_headers),
+            pool_size=pool_size,
+            # Only set by SDK versions with configurable timeouts.
+            request_timeout=getattr(api_client.rest_client, "request_timeout", None),
+            connect_timeout=getattr(api_client.rest_client, "connect_timeout", None),
+        )
+
+    def __call__(self) -> flywheel.Client:
+        """Create a client with a session pooling `pool_size` connections."""
+        timeouts = {
+            name: getattr(self, name)
+            for name in ("request_timeout", "connect_timeout")
+            if getattr(self, name) is not None
+        }
+        client = flywheel.Client(self.api_key, **timeouts)
+        client.api_client.default_headers.update(self.headers)
+        session = client.api_client.rest_client.session
+        for prefix in ("http://", "https://"):
+            # Keep the retries of the SDK adapter.
+            adapter = requests.adapters.HTTPAdapter(
+                pool_maxsize=self.pool_size,
+                max_retries=session.get_adapter(prefix).max_retries,
+            )
+            session.mount(prefix, adapter)
+        return client
+
+
+def make_client_factory(curator: c.HierarchyCurator) -> t.Optional[ClientFactory]:
+    """Resolve the client of the main process for the workers.
+
+    Returns None if the context has no SDK client, in which case the workers
+    fall back to `get_client()`.
+    """
+    client = getattr(curator.context, "_client", None)
+    if not isinstance(client, flywheel.Client):
+        return None
+    pool_size = get_config_option(curator, "client_threads", 1)
+    return ClientFactory.from_client(client, pool_size)
+
+
+def get_worker_client(
+    local_curator: c.HierarchyCurator, factory: t.Optional[ClientFactory]
+) -> t.Optional[flywheel.Client]:
+    """Create the SDK client of a worker."""
+    if factory is None:
+        return local_curator.context.get_client()
+    return factory()
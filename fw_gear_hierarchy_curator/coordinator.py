@@ -0,0 +1,498 @@
+"""Coordinator and worker mode for curating across several machines.
+
+One coordinator process curates the root container and owns the queue of work
+units (the children of the root container).  It serves these units over a TCP
+socket to any number of worker processes, which may run on other machines.
+Workers pull one unit at a time, curate it, and send back its completion along
+with any report rows, which the coordinator writes to the report.
+
+See docs/multiprocessing.md for details.
+"""
+import functools
+import logging
+import os
+import secrets
+import sys
+import threading
+import time
+import typing as t
+from collections import deque
+from multiprocessing import Lock, Manager, Process
+from multiprocessing.connection import AuthenticationError, Client, Listener
+
+from flywheel_gear_toolkit.utils import curator as c
+from flywheel_gear_toolkit.utils import reporters, walker
+
+from . import (
+    accounting,
+    clients,
+    curate,
+    inputs,
+    logs,
+    metrics,
+    profiling,
+    schedule,
+    startup,
+    tracing,
+    watchdog,
+)
+from .reports import StreamingReporter, make_reporter
+from .utils import container_to_pickleable_dict, get_config_option, handle_work
+
+log = logging.getLogger(__name__)
+
+AUTHKEY_ENV = "CURATOR_COORDINATOR_AUTHKEY"
+
+Address = t.Tuple[str, int]
+
+
+def parse_address(address: t.Union[str, Address]) -> Address:
+    """Parse a `host:port` string into an address tuple."""
+    if isinstance(address, tuple):
+        return address
+    host, _, port = address.rpartition(":")
+    if not host or not port.isdigit():
+        raise ValueError(f"Expected address of the form host:port, found {address}")
+    return host, int(port)
+
+
+def get_authkey(
+    curator: c.HierarchyCurator, generate: bool = False
+) -> t.Optional[bytes]:
+    """Get the key shared between coordinator and workers.
+
+    Taken from `config.coordinator_authkey` or the environment variable
+    `CURATOR_COORDINATOR_AUTHKEY`.  If neither is set and `generate` is True, a
+    random key is generated, which only workers started by the coordinator
+    itself will know.
+    """
+    authkey = get_config_option(curator, "coordinator_authkey") or os.environ.get(
+        AUTHKEY_ENV
+    )
+    if authkey:
+        return authkey.encode("utf-8") if isinstance(authkey, str) else authkey
+    if generate:
+        log.warning(
+            f"No coordinator authkey set, only local workers will be able to connect."
+            f" Set config.coordinator_authkey or {AUTHKEY_ENV} to allow remote workers."
+        )
+        return secrets.token_bytes(32)
+    return None
+
+
+class RemoteReporter(reporters.AggregatedReporter):
+    """Reporter that hands records to a callback instead of writing them.
+
+    Used by workers in coordinator mode, the records are sent to the
+    coordinator which owns the report file.
+
+    Args:
+        format (class): Dataclass representing log entry fields.
+        send (callable): Called with the dictionary of each record.
+    """
+
+    def __init__(
+        self,
+        format: t.Type[reporters.BaseLogRecord],
+        send: t.Callable[[t.Dict[str, t.Any]], None],
+    ) -> None:
+        # Don't call super().__init__, there's no output file on this end.
+        self.output_path = None
+        self.output_type = None
+        self.first_record = True
+        self.queue = None
+        self.format = format
+        self.keys = list(self.format.keys())
+        self._send = send
+
+    def __del__(self):
+        pass
+
+    def write_log(self, rec: t.Any) -> None:
+        """Send a record to the coordinator."""
+        if not rec:
+            raise ValueError(f"Record must contain a dictionary to write, got '{rec}'")
+        self._send(rec.to_dict())
+
+
+class Coordinator:
+    """Serve work units to workers over a TCP socket.
+
+    Args:
+        units: Pickleable work units, in the order they should be handed out.
+        data: Ancestor data sent to each worker to set as its curator `data`.
+        reporter: Reporter to write the rows sent by workers to.
+        address: (host, port) to listen on, port 0 picks a free port.
+        authkey: Key workers must authenticate with.
+        deadline: Stop handing out units when the next one is projected to
+            not finish before this deadline.
+    """
+
+    def __init__(
+        self,
+        units: t.Iterable[t.Dict[str, str]],
+        data: t.Any = None,
+        reporter: t.Optional[reporters.AggregatedReporter] = None,
+        address: Address = ("127.0.0.1", 0),
+        authkey: t.Optional[bytes] = None,
+        deadline: t.Optional[schedule.Deadline] = None,
+    ) -> None:
+        self.units = deque(units)
+        self.deadline = deadline
+        self.stopped = False
+        self.data = data
+        self.reporter = reporter
+        self.listener = Listener(address, authkey=authkey)
+        self.outstanding = 0
+        self.completed = 0
+        self.failed: t.List[t.Dict[str, str]] = []
+        self._lock = threading.Lock()
+        self._finished = threading.Event()
+        if not self.units:
+            self._finished.set()
+
+    @property
+    def address(self) -> Address:
+        """Address the coordinator is listening on."""
+        return self.listener.address
+
+    def serve(self) -> None:
+        """Serve units until every unit has been handed out and completed."""
+        accept_thread = threading.Thread(target=self._accept, daemon=True)
+        accept_thread.start()
+        self._finished.wait()
+        self.listener.close()
+        log.info(
+            f"Coordinator finished, {self.completed} units completed, "
+            f"{len(self.failed)} failed, {len(self.units)} not started"
+        )
+
+    def _accept(self) -> None:
+        while not self._finished.is_set():
+            try:
+                conn = self.listener.accept()
+            except AuthenticationError:
+                log.warning("Worker failed to authenticate, dropping connection")
+                continue
+            except OSError:
+                # Listener was closed
+                return
+            threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _next_unit(self) -> t.Optional[t.Dict[str, str]]:
+        with self._lock:
+            if self.failed or self.stopped or not self.units:
+                return None
+            if self.deadline and self.deadline.should_stop():
+                log.warning(
+                    f"{self.deadline.remaining():.0f}s left before deadline, "
+                    f"projected {self.deadline.projected():.0f}s for next unit. "
+                    f"Stopping with {len(self.units)} units left."
+                )
+                self.stopped = True
+                if self.outstanding == 0:
+                    self._finished.set()
+                return None
+            self.outstanding += 1
+            return self.units.popleft()
+
+    def _complete(self, payload: t.Dict[str, t.Any], failed: bool = False) -> None:
+        with self._lock:
+            if self.reporter:
+                for row in payload.get("rows", []):
+                    self.reporter.write_log(self.reporter.format(**row))
+            self.outstanding -= 1
+            if failed:
+                log.error(f"Unit failed: {payload['unit']}")
+                self.failed.append(payload["unit"])
+            else:
+                self.completed += 1
+                if self.deadline and "elapsed" in payload:
+                    self.deadline.record(payload["elapsed"])
+            if self.outstanding == 0 and (
+                self.failed or self.stopped or not self.units
+            ):
+                self._finished.set()
+
+    def _handle(self, conn) -> None:
+        unit = None
+        try:
+            while True:
+                kind, payload = conn.recv()
+                if kind == "hello":
+                    log.info(f"Worker {payload} connected")
+                    conn.send(("data", self.data))
+                elif kind == "get":
+                    unit = self._next_unit()
+                    conn.send(("unit", unit) if unit else ("stop", None))
+                elif kind in ["done", "failed"]:
+                    self._complete(payload, failed=kind == "failed")
+                    unit = None
+        except (EOFError, OSError):
+            pass
+        finally:
+            conn.close()
+            if unit is not None:
+                log.error("Lost connection to worker with unit in progress")
+                self._complete({"unit": unit}, failed=True)
+
+
+def run_worker(
+    curator: c.HierarchyCurator,
+    address: Address,
+    authkey: bytes,
+    worker_id: t.Any,
+    lock: t.Optional[Lock] = None,
+    shared_metrics: t.Optional[t.MutableMapping] = None,
+    accounts: t.Optional[t.MutableSequence] = None,
+    log_queue: t.Optional[t.Any] = None,
+    slow_containers: t.Optional[t.MutableSequence] = None,
+    shared_inputs: t.Optional[t.Dict[str, inputs.SharedInput]] = None,
+    client_factory: t.Optional[clients.ClientFactory] = None,
+    launched: t.Optional[float] = None,
+) -> int:
+    """Pull units from a coordinator and curate them until told to stop.
+
+    The worker is set up like the workers of `curate.start_multiproc` (see
+    `curate.setup_worker`), with the curator `data` sent by the coordinator.
+
+    Args:
+        curator: Curator object
+        address: Address of the coordinator.
+        authkey: Key to authenticate with the coordinator.
+        worker_id: id of worker on this machine.
+        lock: multiprocessing lock to pass into container.
+        shared_metrics: Dictionary to publish metrics to, if enabled.
+        accounts: List to add the SDK request accounts to, if enabled.
+        log_queue: Queue to send log records to the main process over.
+        slow_containers: List to add slow containers to, if enabled.
+        shared_inputs: Input files published by the main process.
+        client_factory: Creates the SDK client of the worker.
+        launched: Time the main process launched the worker.
+
+    Returns:
+        int: 0 if every unit was curated, 1 otherwise.
+    """
+    startup.start_worker_clock(launched)
+    log = logging.getLogger(f"{__name__} - Worker {worker_id}")
+    try:
+        conn = Client(address, authkey=authkey)
+    except (OSError, AuthenticationError):
+        log.critical(f"Could not connect to coordinator at {address}", exc_info=True)
+        return 1
+    local_curator = None
+    with conn:
+        try:
+            local_curator = curate.setup_worker(
+                curator,
+                worker_id,
+                lock,
+                log,
+                shared_metrics,
+                accounts,
+                log_queue,
+                slow_containers,
+                shared_inputs,
+                client_factory=client_factory,
+            )
+            return _serve_units(conn, local_curator, worker_id, log)
+        except Exception:  # pylint: disable=broad-except
+            log.critical(
+                "Could not finish curation, worker errored early.", exc_info=True
+            )
+            return 1
+        finally:
+            curate.teardown_worker(local_curator, accounts)
+
+
+def _serve_units(
+    conn: t.Any,
+    local_curator: c.HierarchyCurator,
+    worker_id: t.Any,
+    log: logging.Logger,
+) -> int:
+    """Curate the units sent over a connection to the coordinator."""
+    conn.send(("hello", f"{os.uname().nodename}-{worker_id}"))
+    _, local_curator.data = conn.recv()
+    rows: t.List[t.Dict[str, t.Any]] = []
+    if local_curator.config.report:
+        local_curator.reporter = RemoteReporter(
+            local_curator.config.format, rows.append
+        )
+    if local_curator.config.depth_first:
+        handle = functools.partial(curate.handle_depth_first, log)
+    else:
+        handle = functools.partial(curate.handle_breadth_first, log)
+    while True:
+        try:
+            conn.send(("get", None))
+            kind, unit = conn.recv()
+        except (EOFError, OSError):
+            log.info("Coordinator closed the connection")
+            break
+        if kind == "stop":
+            break
+        start = time.monotonic()
+        try:
+            handle_work([unit], local_curator, handle)
+        except Exception:  # pylint: disable=broad-except
+            log.critical(
+                "Could not finish curation, worker errored early.", exc_info=True
+            )
+            conn.send(("failed", {"unit": unit, "rows": rows[:]}))
+            return 1
+        elapsed = time.monotonic() - start
+        conn.send(("done", {"unit": unit, "rows": rows[:], "elapsed": elapsed}))
+        rows.clear()
+    return 0
+
+
+def _worker_process(*args) -> None:
+    """Process target for `run_worker`, exiting with its return code."""
+    sys.exit(run_worker(*args))
+
+
+class LocalWorkers:
+    """Worker processes pulling from a coordinator, on this machine.
+
+    Like `curate.start_multiproc`, the main process collects the logs,
+    metrics, traces, request accounts, slow containers and profiles of the
+    workers, and publishes the additional inputs to them.  These are started
+    on creation, so that the root container curated by the coordinator is
+    traced too; only the workers are profiled.
+
+    Args:
+        curator: Curator object
+        count: Number of worker processes.
+    """
+
+    def __init__(self, curator: c.HierarchyCurator, count: int) -> None:
+        self.curator = curator
+        self.count = count
+        self.processes: t.List[Process] = []
+        self.manager = Manager()
+        self.metrics_writer = metrics.start_metrics(curator, self.manager)
+        self.trace_path = tracing.start_tracing(curator)
+        self.accounts = accounting.start_accounting(curator, self.manager)
+        self.profile_dir = profiling.start_profiling(curator)
+        self.log_queue, self.log_listener = logs.start_logging(curator)
+        self.slow_containers = watchdog.start_watchdog(curator, self.manager)
+
+    def start(self, address: Address, authkey: bytes) -> None:
+        """Start the worker processes connected to the coordinator."""
+        lock = Lock()
+        shared_inputs = inputs.publish_inputs(self.curator)
+        client_factory = clients.make_client_factory(self.curator)
+        for i in range(self.count):
+            log.info(f"Initializing Worker {i}")
+            proc = Process(
+                target=_worker_process,
+                args=(
+                    self.curator,
+                    address,
+                    authkey,
+                    i,
+                    lock,
+                    self.metrics_writer and self.metrics_writer.shared,
+                    self.accounts,
+                    self.log_queue,
+                    self.slow_containers,
+                    shared_inputs,
+                    client_factory,
+                    time.time(),
+                ),
+                name=str(i),
+            )
+            with startup.detached_client(self.curator):
+                proc.start()
+            self.processes.append(proc)
+
+    def join(self) -> int:
+        """Wait for the worker processes, returning 1 if any of them failed."""
+        r_code = 0
+        for worker_p in self.processes:
+            worker_p.join()
+            log.info(
+                f"Worker {worker_p.name} finished with exit code: {worker_p.exitcode}"
+            )
+            if worker_p.exitcode:
+                r_code = 1
+        started = len(self.processes)
+        logs.stop_logging(self.log_listener)
+        metrics.stop_metrics(self.metrics_writer)
+        tracing.stop_tracing(self.trace_path, started)
+        accounting.log_accounting(self.accounts)
+        watchdog.stop_watchdog(self.curator, self.slow_containers)
+        profiling.stop_profiling(self.profile_dir, started)
+        self.manager.shutdown()
+        return r_code
+
+
+def start_coordinator(
+    curator: c.HierarchyCurator,
+    root_walker: walker.Walker,
+    address: t.Union[str, Address],
+) -> int:
+    """Curate the root container and serve its children to workers.
+
+    `config.workers` local worker processes are started as well, set it to 0
+    to only serve remote workers.
+    """
+    host, port = parse_address(address)
+    authkey = get_authkey(curator, generate=True)
+    if curator.config.report:
+        curator.reporter = make_reporter(
+            curator.config.path, format=curator.config.format
+        )
+    local_workers = LocalWorkers(curator, curator.config.workers)
+    log.debug("Curating root container")
+    parent_cont = root_walker.next(callback=curator.config.callback)
+    curate.curate_one(log, curator, parent_cont)
+    resume_journal = get_config_option(curator, "resume_journal")
+    if resume_journal:
+        units = schedule.read_journal(resume_journal)
+    else:
+        units = [
+            container_to_pickleable_dict(child)
+            for child in schedule.order_by_priority(curator, root_walker.deque)
+        ]
+    coordinator = Coordinator(
+        units,
+        curator.data,
+        curator.reporter,
+        (host, port),
+        authkey,
+        schedule.Deadline.from_curator(curator),
+    )
+    log.info(f"Serving {len(units)} units on {coordinator.address}")
+    # Workers send their rows here rather than sharing the reporter.
+    curator.reporter = None
+    # Connect local workers over loopback if listening on all interfaces
+    local_host = "127.0.0.1" if host in ["", "0.0.0.0"] else host
+    local_workers.start((local_host, coordinator.address[1]), authkey)
+    coordinator.serve()
+    r_code = local_workers.join()
+    if isinstance(coordinator.reporter, StreamingReporter):
+        coordinator.reporter.close()
+    if coordinator.failed:
+        r_code = 1
+    if coordinator.units:
+        schedule.write_journal(
+            schedule.get_journal_path(curator), list(coordinator.units)
+        )
+    return r_code
+
+
+def start_workers(curator: c.HierarchyCurator, address: t.Union[str, Address]) -> int:
+    """Start `config.workers` worker processes pulling from a coordinator."""
+    authkey = get_authkey(curator)
+    if authkey is None:
+        raise ValueError(
+            f"Workers need the coordinator authkey, set config.coordinator_authkey"
+            f" or {AUTHKEY_ENV}"
+        )
+    address = parse_address(address)
+    log.info(f"Running {curator.config.workers} workers for coordinator at {address}")
+    local_workers = LocalWorkers(curator, curator.config.workers)
+    local_workers.start(address, authkey)
+    return local_workers.join()
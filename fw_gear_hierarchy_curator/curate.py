@@ -1,69 +1,219 @@
 """Hierarchy curator main interface."""
 import argparse
-import copy
 import functools
 import logging
 import sys
+import time
 import typing as t
-from multiprocessing import Lock, Manager, Process, managers
+from multiprocessing import Lock, Manager, Process, Queue, managers
 from pathlib import Path
+from queue import Full
 
 import flywheel
 import flywheel_gear_toolkit
-
-# import multiprocessing_logging
 from flywheel_gear_toolkit import GearToolkitContext
 from flywheel_gear_toolkit.utils import curator as c
-from flywheel_gear_toolkit.utils import datatypes, reporters, walker
+from flywheel_gear_toolkit.utils import datatypes, walker
 
+from . import (
+    accounting,
+    clients,
+    coordinator,
+    fanout,
+    frontier,
+    inputs,
+    lazy,
+    logs,
+    metrics,
+    packages,
+    profiling,
+    recycling,
+    schedule,
+    startup,
+    state,
+    tracing,
+    watchdog,
+)
+from .reports import (
+    BatchedReporter,
+    is_streaming_report,
+    make_reporter,
+    merge_reports,
+    report_type,
+    shard_report_path,
+    worker_report_path,
+)
 from .utils import (
     container_to_pickleable_dict,
+    get_config_option,
     handle_work,
+    iter_query_work,
     make_walker,
     reload_file_parent,
+    set_config_options,
+    shard_of,
 )
 
 sys.path.insert(0, str(Path(__file__).parents[1]))
-# multiprocessing_logging.install_mp_handler()
 log = logging.getLogger(__name__)
 
+# Number of queued query results per worker.
+QUERY_QUEUE_SIZE = 100
 
-def handle_depth_first(
+
+def curate_one(
     log: logging.Logger,
     local_curator: c.HierarchyCurator,
-    containers: t.List[datatypes.Container],
+    container: datatypes.Container,
+    queue_depth: int = 0,
 ) -> None:
-    """For each container create a walker and walk if it has children.
-    Otherwise, just curate.
+    """Validate and curate a container, recording it in the metrics.
+
+    Args:
+        log: Logger of the worker.
+        local_curator: Curator object
+        container: Container to curate.
+        queue_depth: Number of containers still queued by the worker.
     """
-    for container in containers:
-        if container.container_type in ["analysis", "file"]:
+    if container.container_type == "file":
+        with tracing.span("reload_file_parent", container):
             container = reload_file_parent(container, local_curator)
-            if local_curator.validate_container(container):
+    log.debug(f"Found {container.container_type}, ID: {container.id}")
+    c_type = container.container_type
+    with watchdog.watch(container):
+        with tracing.span("validate", container), accounting.attribute(
+            f"validate_{c_type}"
+        ):
+            curated = local_curator.validate_container(container)
+        if curated:
+            with tracing.span("curate", container), accounting.attribute(
+                f"curate_{c_type}"
+            ):
                 local_curator.curate_container(container)
+    metrics.record_container(container.container_type, curated, queue_depth)
+    recycling.record_container()
+    startup.record_first_container(log)
+
+
+def handle_depth_first(
+    log: logging.Logger,
+    local_curator: c.HierarchyCurator,
+    entries: t.List[frontier.Entry],
+) -> None:
+    """For each entry create a walker and walk if it has children.
+    Otherwise, just fetch and curate.
+    """
+    client = local_curator.context.client
+    for i, entry in enumerate(entries):
+        left = len(entries) - i - 1
+        if entry.container_type in ["analysis", "file"]:
+            container = frontier.hydrate(entry, client)
+            if container is not None:
+                curate_one(log, local_curator, container, left)
         else:
-            w = make_walker(container, local_curator)
+            w = make_walker(entry, local_curator)
             for cont in w.walk(callback=local_curator.config.callback):
-                cont = reload_file_parent(cont, local_curator)
-                log.debug(f"Found {cont.container_type}, ID: {cont.id}")
-                if local_curator.validate_container(cont):
-                    local_curator.curate_container(cont)
+                curate_one(log, local_curator, cont, len(w.deque) + left)
 
 
 def handle_breadth_first(
     log: logging.Logger,
     local_curator: c.HierarchyCurator,
-    containers: t.List[datatypes.Container],
+    entries: t.List[frontier.Entry],
 ) -> None:
-    """Add all containers to one walker and walk in breadth-first."""
-    w = make_walker(containers.pop(0), local_curator)
-    if containers:
-        w.add(containers)
+    """Add all entries to one walker and walk in breadth-first."""
+    if not entries:
+        return
+    w = make_walker(entries[0], local_curator)
+    w.add(entries[1:])
     for cont in w.walk(callback=local_curator.config.callback):
-        cont = reload_file_parent(cont, local_curator)
-        log.debug(f"Found {cont.container_type}, ID: {cont.id}")
-        if local_curator.validate_container(cont):
-            local_curator.curate_container(cont)
+        curate_one(log, local_curator, cont, len(w.deque))
+
+
+def handle_query(
+    log: logging.Logger,
+    local_curator: c.HierarchyCurator,
+    entries: t.List[frontier.Entry],
+    curated: t.Optional[t.MutableMapping[str, t.Any]] = None,
+) -> None:
+    """Curate each container matched by a query, without walking.
+
+    If `curated` is given, each container is fetched again once curated, and
+    its modified time added to `curated` by ID.
+    """
+    for entry in entries:
+        container = frontier.hydrate(entry, local_curator.context.client)
+        if container is None:
+            continue
+        curate_one(log, local_curator, container)
+        if curated is not None:
+            container = frontier.hydrate(entry, local_curator.context.client)
+            if container is not None:
+                curated[entry.id] = container.modified
+
+
+def setup_worker(
+    curator: c.HierarchyCurator,
+    worker_id: t.Any,
+    lock: t.Optional[Lock],
+    log: logging.Logger,
+    shared_metrics: t.Optional[managers.DictProxy] = None,
+    accounts: t.Optional[managers.ListProxy] = None,
+    log_queue: t.Optional[Queue] = None,
+    slow_containers: t.Optional[managers.ListProxy] = None,
+    shared_inputs: t.Optional[t.Dict[str, inputs.SharedInput]] = None,
+    shared_data: t.Optional[state.SharedData] = None,
+    client_factory: t.Optional[clients.ClientFactory] = None,
+) -> c.HierarchyCurator:
+    """Set up a worker process and return its copy of the curator.
+
+    The worker gets its own SDK client and reporter, and starts its logging,
+    metrics, tracing, accounting, watchdog and profiling, as enabled.  Call
+    `teardown_worker` once it is done, even if this raised.
+
+    Args:
+        curator: Curator object
+        worker_id: id of worker.
+        lock: multiprocessing lock to pass into container.
+        log: Logger of the worker.
+        shared_metrics: Dictionary to publish metrics to, if enabled.
+        accounts: List to add the SDK request accounts to, if enabled.
+        log_queue: Queue to send log records to the main process over.
+        slow_containers: List to add slow containers to, if enabled.
+        shared_inputs: Input files published by the main process.
+        shared_data: Curator data, if the worker isn't forked.
+        client_factory: Creates the SDK client of the worker.
+    """
+    logs.start_worker_logging(curator, log_queue)
+    # Share the data of the curator rather than copying it.
+    local_curator = state.make_local_curator(curator, shared_data)
+    local_curator.context._client = clients.get_worker_client(
+        local_curator, client_factory
+    )
+    local_curator.lock = lock
+    inputs.attach_inputs(local_curator, shared_inputs)
+    start_worker_reporter(local_curator, worker_id)
+    metrics.start_worker_metrics(local_curator, worker_id, shared_metrics)
+    tracing.start_worker_tracing(local_curator, worker_id)
+    accounting.start_worker_accounting(local_curator, accounts)
+    watchdog.start_worker_watchdog(local_curator, worker_id, slow_containers)
+    profiling.start_worker_profiling(local_curator, worker_id)
+    state.log_worker_ready(log, startup.since_launch())
+    return local_curator
+
+
+def teardown_worker(
+    local_curator: t.Optional[c.HierarchyCurator],
+    accounts: t.Optional[managers.ListProxy] = None,
+) -> None:
+    """Write out what a worker buffered and stop what `setup_worker` started."""
+    profiling.stop_worker_profiling()
+    watchdog.stop_worker_watchdog()
+    close_worker_reporter(local_curator)
+    metrics.stop_worker_metrics()
+    tracing.stop_worker_tracing()
+    accounting.stop_worker_accounting(accounts)
+    logs.stop_worker_logging()
 
 
 def worker(
@@ -72,6 +222,17 @@ def worker(
     lock: Lock,
     worker_id: int,
     fail: managers.EventProxy,
+    remaining: t.Optional[managers.ListProxy] = None,
+    shared_metrics: t.Optional[managers.DictProxy] = None,
+    accounts: t.Optional[managers.ListProxy] = None,
+    log_queue: t.Optional[Queue] = None,
+    slow_containers: t.Optional[managers.ListProxy] = None,
+    shared_inputs: t.Optional[t.Dict[str, inputs.SharedInput]] = None,
+    shared_data: t.Optional[state.SharedData] = None,
+    launched: t.Optional[float] = None,
+    client_factory: t.Optional[clients.ClientFactory] = None,
+    recycled: t.Optional[managers.DictProxy] = None,
+    shared_snapshots: t.Optional[t.Union[t.List[t.Any], state.SharedData]] = None,
 ) -> None:
     """Target function for Process.
 
@@ -80,32 +241,111 @@ def worker(
         work: List of dictionaries representing containers to process.
         lock: multiprocessing lock to pass into container.
         worker_id: id of worker.
+        fail: Event to set if the worker errors.
+        remaining: List to add units that weren't started before the deadline to.
+        shared_metrics: Dictionary to publish metrics to, if enabled.
+        accounts: List to add the SDK request accounts to, if enabled.
+        log_queue: Queue to send log records to the main process over.
+        slow_containers: List to add slow containers to, if enabled.
+        shared_inputs: Input files published by the main process.
+        shared_data: Curator data, if the worker isn't forked.
+        launched: Time the main process launched the worker.
+        client_factory: Creates the SDK client of the worker.
+        recycled: Dictionary to hand the units that weren't started to, by
+            worker id, when the worker reaches its limits (see `recycling`).
+        shared_snapshots: Snapshots of the curator data to curate the units
+            from, with `config.parallel_level` (see `fanout`).
+
+    Raises:
+        SystemExit: With `recycling.EXIT_CODE` if the worker handed off units.
     """
+    startup.start_worker_clock(launched)
     log = logging.getLogger(f"{__name__} - Worker {worker_id}")
+    local_curator = None
+    handed_off = False
     try:
-        # Use custom __deepcopy__ hook to copy relevant data, remove
-        # unpickleable attributes, and re-populate.
-        local_curator = copy.deepcopy(curator)
-        local_curator.context._client = local_curator.context.get_client()
-        local_curator.lock = lock
+        local_curator = setup_worker(
+            curator,
+            worker_id,
+            lock,
+            log,
+            shared_metrics,
+            accounts,
+            log_queue,
+            slow_containers,
+            shared_inputs,
+            shared_data,
+            client_factory,
+        )
         if local_curator.config.depth_first:
-            # Pass work, curator, and handle_depth_first into handle_work
-            handle_work(work, local_curator, functools.partial(handle_depth_first, log))
+            handle = functools.partial(handle_depth_first, log)
         else:
-            # Pass work, curator, and handle_breadth_first into handle_work
-            handle_work(
-                work, local_curator, functools.partial(handle_breadth_first, log)
+            handle = functools.partial(handle_breadth_first, log)
+        snapshots = fanout.read_snapshots(shared_snapshots)
+        if snapshots is not None:
+            handle = fanout.with_snapshots(handle, work, snapshots)
+        deadline = schedule.Deadline.from_curator(local_curator)
+        limits = recycling.Limits.from_curator(local_curator)
+        if deadline or limits:
+            # Handle units one at a time to be able to stop between them.
+            left = schedule.handle_work_until_deadline(
+                work, local_curator, handle, deadline, limits and limits.reached
             )
+            recycle = recycled is not None and limits
+            if left and recycle and not (deadline and deadline.should_stop()):
+                log.info(
+                    f"{limits.reached()}, handing {len(left)} units to a new worker"
+                )
+                recycled[worker_id] = left
+                handed_off = True
+            elif remaining is not None:
+                remaining.extend(left)
+        else:
+            # Pass work, curator, and handle_depth/breadth_first into handle_work
+            handle_work(work, local_curator, handle)
     except Exception as e:  # pylint: disable=broad-except
         log.critical("Could not finish curation, worker errored early.", exc_info=True)
+        # Other workers are killed once fail is set, send the logs first.
+        logs.stop_worker_logging(wait=True)
         # Raise SystemExit(99) to "return" value of 99 (special error)
         fail.set()
+    finally:
+        teardown_worker(local_curator, accounts)
+    if handed_off:
+        raise SystemExit(recycling.EXIT_CODE)
+
+
+def load_curator(
+    context: GearToolkitContext,
+    curator_path: datatypes.PathLike,
+    options: t.Optional[t.Dict[str, t.Any]] = None,
+    **kwargs,
+) -> c.HierarchyCurator:
+    """Load a curator and set engine options on its config.
+
+    The curator's `extra_packages` are installed (see `packages`), and the
+    heavy modules imported by the curator module are only executed on first
+    use (see `lazy`).
+
+    Args:
+        context (GearToolkitContext): The flywheel gear toolkit context.
+        curator_path (Path-like): A path to a curator module.
+        options (dict): Engine options to set on the curator config.
+        kwargs (dict): Dictionary of attributes/value to set on curator.
+    """
+    log.info(f"Getting curator from {curator_path}")
+    with packages.cached_installs(options), lazy.lazy_imports():
+        curator = c.get_curator(context, curator_path, **kwargs)
+    set_config_options(curator, options)
+    check_report_batching(curator)
+    return curator
 
 
 def main(
     context: GearToolkitContext,
     parent: datatypes.Container,
     curator_path: datatypes.PathLike,
+    options: t.Optional[t.Dict[str, t.Any]] = None,
     **kwargs,
 ) -> int:
     """Curates a flywheel project using a curator.
@@ -114,11 +354,13 @@ def main(
         context (GearToolkitContext): The flywheel gear toolkit context.
         project (flywheel.Project): The project to curate.
         curator_path (Path-like): A path to a curator module.
+        options (dict): Engine options to set on the curator config.
         kwargs (dict): Dictionary of attributes/value to set on curator.
     """
+    start = time.time()
     # Initialize curator
-    log.info(f"Getting curator from {curator_path}")
-    curator = c.get_curator(context, curator_path, **kwargs)
+    curator = load_curator(context, curator_path, options, **kwargs)
+    schedule.resolve_deadline(curator, start)
     log.info("Curator config: " + str(curator.config))
     # Initialize walker from root container
     log.info(
@@ -129,86 +371,515 @@ def main(
         log.info("Running legacy (single-threaded)")
         res = run_legacy(context, curator, parent)
         return res
-    root_walker = walker.Walker(
-        parent,
-        depth_first=curator.config.depth_first,
-        reload=curator.config.reload,
-        stop_level=curator.config.stop_level,
+    address = get_config_option(curator, "coordinator_address")
+    role = get_config_option(curator, "coordinator_role", "coordinator")
+    if address and role == "worker":
+        log.info("Running as worker for coordinator")
+        return coordinator.start_workers(curator, address)
+    # The children of the root container are only sent to the workers, unless
+    # they are ordered by priority, which needs their metadata.
+    root_walker = make_walker(
+        parent, curator, compact=get_config_option(curator, "priority") is None
     )
+    if address:
+        log.info("Running as coordinator")
+        return coordinator.start_coordinator(curator, root_walker, address)
     return start_multiproc(curator, root_walker)
 
 
+def start_reporter(
+    curator: c.HierarchyCurator, manager: managers.SyncManager
+) -> t.Optional[Process]:
+    """Initialize the curator reporter and its writer process if requested.
+
+    With `config.report_batch_size`, each process instead buffers its records
+    and writes them to its own file (see `reports.BatchedReporter`), and no
+    writer process is started.
+    """
+    if not curator.config.report:
+        return None
+    batch_size = get_config_option(curator, "report_batch_size")
+    if batch_size:
+        curator.reporter = BatchedReporter(
+            worker_report_path(curator.config.path, "main"),
+            format=curator.config.format,
+            batch_size=batch_size,
+        )
+        log.info(f"Initialized batched reporting ({batch_size} records per write)")
+        return None
+    curator.reporter = make_reporter(
+        curator.config.path, format=curator.config.format, queue=manager.Queue()
+    )
+    # Logger process
+    reporter_proc = Process(
+        target=curator.reporter.worker,
+    )
+    reporter_proc.start()
+    log.info("Initialized reporting process")
+    return reporter_proc
+
+
+def stop_reporter(
+    curator: c.HierarchyCurator,
+    reporter_proc: t.Optional[Process],
+    workers: t.Optional[int] = None,
+) -> None:
+    """Send the termination signal to the reporter process if there is one.
+
+    Batched reports written by the main process and the workers are merged
+    into `config.path`.
+
+    Args:
+        workers: Number of workers started (default `config.workers`).
+    """
+    if reporter_proc:
+        curator.reporter.write("END")
+        reporter_proc.join()
+    if isinstance(curator.reporter, BatchedReporter):
+        curator.reporter.close()
+        path = curator.config.path
+        if workers is None:
+            workers = curator.config.workers
+        paths = [worker_report_path(path, "main")] + [
+            worker_report_path(path, i) for i in range(workers)
+        ]
+        paths = [path for path in paths if path.exists()]
+        merge_reports(paths, path)
+        for path in paths:
+            path.unlink()
+
+
+def check_report_batching(curator: c.HierarchyCurator) -> None:
+    """Check reports are CSV or JSON if `config.report_batch_size` is set.
+
+    Batched reports are merged with `merge_reports`, which only reads CSV and
+    JSON.  Streaming reports (`.csv.gz`, `.csv.zst`, `.parquet`) already write
+    their rows in row groups.
+
+    Raises:
+        ValueError: If batching a streaming report.
+    """
+    if not curator.config.report or not get_config_option(
+        curator, "report_batch_size"
+    ):
+        return
+    if is_streaming_report(curator.config.path):
+        raise ValueError(
+            f"report_batch_size only applies to CSV and JSON reports, unset it "
+            f"to write {report_type(curator.config.path)} reports"
+        )
+
+
+def start_worker_reporter(local_curator: c.HierarchyCurator, worker_id: int) -> None:
+    """Give a worker its own batched reporter if reports are batched.
+
+    Rows buffered by the reporter inherited from the main process are dropped
+    rather than written again by the worker.
+    """
+    if isinstance(local_curator.reporter, BatchedReporter):
+        local_curator.reporter.discard()
+        local_curator.reporter = BatchedReporter(
+            worker_report_path(local_curator.config.path, worker_id),
+            format=local_curator.config.format,
+            batch_size=local_curator.reporter.batch_size,
+        )
+
+
+def close_worker_reporter(local_curator: t.Optional[c.HierarchyCurator]) -> None:
+    """Write out the records buffered by a worker's batched reporter."""
+    if isinstance(getattr(local_curator, "reporter", None), BatchedReporter):
+        local_curator.reporter.close()
+
+
+def wait_for_workers(
+    worker_ps: t.List[Process],
+    fail: managers.EventProxy,
+    replace: t.Optional[t.Callable[[Process], t.Optional[Process]]] = None,
+) -> int:
+    """Block until each worker has completed, killing all workers if one fails.
+
+    Args:
+        worker_ps: Worker processes, replacements are appended to it.
+        fail: Event set by a worker that fails.
+        replace: Called with each worker that exited with
+            `recycling.EXIT_CODE`, returns the worker replacing it, if any.
+
+    Returns:
+        int: 1 if a worker failed early, 0 otherwise.
+    """
+    r_code = 0
+    finished = False
+    replaced: t.Set[str] = set()
+    while not finished:
+        if fail.is_set():
+            log.error(f"Worker failed early, killing other workers...")
+            r_code = 1
+            for worker_p in worker_ps:
+                if worker_p.is_alive():
+                    worker_p.terminate()
+            finished = True
+        else:
+            for worker_p in list(worker_ps):
+                if (
+                    replace
+                    and worker_p.name not in replaced
+                    and worker_p.exitcode == recycling.EXIT_CODE
+                ):
+                    replaced.add(worker_p.name)
+                    replacement = replace(worker_p)
+                    if replacement:
+                        worker_ps.append(replacement)
+            if not any([worker_p.is_alive() for worker_p in worker_ps]):
+                finished = True
+    for worker_p in worker_ps:
+        worker_p.join()
+        e_code = worker_p.exitcode
+        log.info(f"Worker {worker_p.name} finished with exit code: {e_code}")
+    return r_code
+
+
 # See docs/multiprocessing.md for details on why this implementation was chosen
 def start_multiproc(curator, root_walker) -> int:
     """Run hierarchy curator in parallel.
 
     1. Set up
     2. Curate root container
-    3. Divide children of root container evenly among workers
+    3. Divide children of root container (in this shard) evenly among workers
     4. Run each worker process
     5. Clean up
     """
-    r_code = 0
     # Main multiprocessing entrypoint
     log.info(f"Running in multi-process mode with {curator.config.workers} workers")
+    shard_index = get_config_option(curator, "shard_index", 0)
+    shard_count = get_config_option(curator, "shard_count", 1)
+    if not 0 <= shard_index < shard_count:
+        raise ValueError(
+            f"Expected shard_index to be in [0, {shard_count}), found {shard_index}"
+        )
+    parallel_level = fanout.get_parallel_level(curator)
+    if shard_count > 1:
+        log.info(f"Running shard {shard_index} of {shard_count}")
+        if curator.config.report:
+            curator.config.path = shard_report_path(
+                curator.config.path, shard_index, shard_count
+            )
+    startup.set_start_method(curator)
     lock = Lock()
     manager = Manager()
     fail = manager.Event()
     workers = curator.config.workers
-    reporter_proc = None
     # Initialize reporter if in config
-    if curator.config.report:
-        curator.reporter = reporters.AggregatedReporter(
-            curator.config.path, format=curator.config.format, queue=manager.Queue()
-        )
-        # Logger process
-        reporter_proc = Process(
-            target=curator.reporter.worker,
-        )
-        reporter_proc.start()
-        log.info("Initialized reporting process")
+    reporter_proc = start_reporter(curator, manager)
+    metrics_writer = metrics.start_metrics(curator, manager)
+    trace_path = tracing.start_tracing(curator)
+    accounts = accounting.start_accounting(curator, manager)
+    profile_dir = profiling.start_profiling(curator)
+    log_queue, log_listener = logs.start_logging(curator)
+    slow_containers = watchdog.start_watchdog(curator, manager)
+    shared_inputs = inputs.publish_inputs(curator)
     distributions = [[] for _ in range(workers)]
     # Curate first container
     log.debug("Curating root container")
     parent_cont = root_walker.next(callback=curator.config.callback)
-    # Shouldn't need this, but doesn't hurt
-    parent_cont = reload_file_parent(parent_cont, curator)
-    if curator.validate_container(parent_cont):
-        curator.curate_container(parent_cont)
+    curate_one(log, curator, parent_cont)
     log.info(f"Assigning work to each worker process.")
     # Populate assignments
-    for i, child_cont in enumerate(root_walker.deque):
-        distributions[i % workers].append(container_to_pickleable_dict(child_cont))
+    resume_journal = get_config_option(curator, "resume_journal")
+    if resume_journal:
+        children = schedule.read_journal(resume_journal)
+    else:
+        children = [
+            container_to_pickleable_dict(child)
+            for child in schedule.order_by_priority(curator, root_walker.deque)
+        ]
+    if shard_count > 1:
+        n_children = len(children)
+        children = [
+            child
+            for child in children
+            if shard_of(child["id"], shard_count) == shard_index
+        ]
+        log.info(f"Kept {len(children)} of {n_children} in this shard")
+    shared_snapshots = None
+    if parallel_level:
+        log.info(f"Curating down to {parallel_level} level in the main process")
+        curate = functools.partial(curate_one, log, curator)
+        children, snapshots = fanout.fan_out(curator, children, parallel_level, curate)
+        shared_snapshots = fanout.share_snapshots(snapshots)
+    for i, child in enumerate(children):
+        distributions[i % workers].append(child)
+    remaining = manager.list()
+    recycled = manager.dict()
+    # After curating the root container, which may add to the curator data.
+    shared_data = state.share_data(curator)
+    client_factory = clients.make_client_factory(curator)
+    worker_ps: t.List[Process] = []
+
+    def start_worker(units: t.List[t.Dict[str, str]]) -> Process:
+        # Replacements get a new id, so they don't overwrite per-worker files.
+        i = len(worker_ps)
+        log.info(f"Initializing Worker {i}")
+        proc = Process(
+            target=worker,
+            args=(
+                curator,
+                units,
+                lock,
+                i,
+                fail,
+                remaining,
+                metrics_writer and metrics_writer.shared,
+                accounts,
+                log_queue,
+                slow_containers,
+                shared_inputs,
+                shared_data,
+                time.time(),
+                client_factory,
+                recycled,
+                shared_snapshots,
+            ),
+            name=str(i),
+        )
+        with state.detached_data(curator, shared_data), startup.detached_client(
+            curator
+        ):
+            proc.start()
+        return proc
+
+    def replace_worker(worker_p: Process) -> t.Optional[Process]:
+        units = recycled.pop(int(worker_p.name), None)
+        if not units:
+            return None
+        log.info(f"Replacing Worker {worker_p.name} for its {len(units)} units left")
+        return start_worker(units)
+
+    for units in distributions:
+        # Give each worker its assignments
+        worker_ps.append(start_worker(units))
+    # Block until each process has completed
+    r_code = wait_for_workers(worker_ps, fail, replace_worker)
+    started = len(worker_ps)
+    logs.stop_logging(log_listener)
+    if shared_data:
+        shared_data.remove()
+    if isinstance(shared_snapshots, state.SharedData):
+        shared_snapshots.remove()
+    metrics.stop_metrics(metrics_writer)
+    tracing.stop_tracing(trace_path, started)
+    accounting.log_accounting(accounts)
+    watchdog.stop_watchdog(curator, slow_containers)
+    profiling.stop_profiling(profile_dir, started)
+    # If a reporter was instantiated, send it the termination signal.
+    stop_reporter(curator, reporter_proc, started)
+    if len(remaining):
+        schedule.write_journal(schedule.get_journal_path(curator), list(remaining))
+    return r_code
+
+
+def query_worker(
+    curator: c.HierarchyCurator,
+    queue: Queue,
+    lock: Lock,
+    worker_id: int,
+    fail: managers.EventProxy,
+    shared_metrics: t.Optional[managers.DictProxy] = None,
+    accounts: t.Optional[managers.ListProxy] = None,
+    log_queue: t.Optional[Queue] = None,
+    slow_containers: t.Optional[managers.ListProxy] = None,
+    shared_inputs: t.Optional[t.Dict[str, inputs.SharedInput]] = None,
+    shared_data: t.Optional[state.SharedData] = None,
+    launched: t.Optional[float] = None,
+    client_factory: t.Optional[clients.ClientFactory] = None,
+    curated: t.Optional[managers.DictProxy] = None,
+) -> None:
+    """Target function for Process in query mode.
+
+    Pulls work entries off the queue until a `None` sentinel is received and
+    curates each container without walking its children.
+
+    Args:
+        curator: Curator object
+        queue: Queue of dictionaries representing containers to process.
+        lock: multiprocessing lock to pass into container.
+        worker_id: id of worker.
+        fail: Event to set if the worker errors.
+        shared_metrics: Dictionary to publish metrics to, if enabled.
+        accounts: List to add the SDK request accounts to, if enabled.
+        log_queue: Queue to send log records to the main process over.
+        slow_containers: List to add slow containers to, if enabled.
+        shared_inputs: Input files published by the main process.
+        shared_data: Curator data, if the worker isn't forked.
+        launched: Time the main process launched the worker.
+        client_factory: Creates the SDK client of the worker.
+        curated: Dictionary to add the modified times of the curated
+            containers to, if given.
+    """
+    startup.start_worker_clock(launched)
+    log = logging.getLogger(f"{__name__} - Worker {worker_id}")
+    local_curator = None
+    try:
+        local_curator = setup_worker(
+            curator,
+            worker_id,
+            lock,
+            log,
+            shared_metrics,
+            accounts,
+            log_queue,
+            slow_containers,
+            shared_inputs,
+            shared_data,
+            client_factory,
+        )
+        while True:
+            entry = queue.get()
+            if entry is None:
+                break
+            handle_work(
+                [entry],
+                local_curator,
+                functools.partial(handle_query, log, curated=curated),
+            )
+    except Exception as e:  # pylint: disable=broad-except
+        log.critical("Could not finish curation, worker errored early.", exc_info=True)
+        logs.stop_worker_logging(wait=True)
+        fail.set()
+    finally:
+        teardown_worker(local_curator, accounts)
+
+
+def query_main(
+    context: GearToolkitContext,
+    parent: datatypes.Container,
+    curator_path: datatypes.PathLike,
+    container_type: str,
+    query: t.Optional[str] = None,
+    file_query: t.Optional[str] = None,
+    options: t.Optional[t.Dict[str, t.Any]] = None,
+    **kwargs,
+) -> int:
+    """Curates the containers matched by a find query instead of walking.
+
+    Args:
+        context (GearToolkitContext): The flywheel gear toolkit context.
+        parent (Container): Container the query is restricted to.
+        curator_path (Path-like): A path to a curator module.
+        container_type (str): Type of container to query for.
+        query (str): Finder filter string.
+        file_query (str): Local filter for files when querying for files.
+        options (dict): Engine options to set on the curator config.
+        kwargs (dict): Dictionary of attributes/value to set on curator.
+    """
+    curator = load_curator(context, curator_path, options, **kwargs)
+    log.info("Curator config: " + str(curator.config))
+    log.info(
+        f"Querying {container_type} containers under {parent.container_type} "
+        f"{parent.label or parent.code} with filter '{query or ''}'"
+    )
+    work = iter_query_work(
+        context.client, parent, container_type, query=query, file_query=file_query
+    )
+    return start_query_multiproc(curator, work)
+
+
+def start_query_multiproc(
+    curator: c.HierarchyCurator,
+    work: t.Iterable[t.Dict[str, str]],
+    curated: t.Optional[t.Dict[str, t.Any]] = None,
+) -> int:
+    """Run hierarchy curator in parallel over a stream of work entries.
+
+    Entries are put on a bounded queue as they are paged from the server, so
+    workers start curating before the query has been exhausted.
+
+    Args:
+        curator: Curator object
+        work: Work entries to curate.
+        curated: Dictionary to add the modified time of each container to,
+            by ID, as fetched right after it is curated.
+    """
+    workers = curator.config.workers
+    log.info(f"Running in query mode with {workers} workers")
+    startup.set_start_method(curator)
+    lock = Lock()
+    manager = Manager()
+    fail = manager.Event()
+    queue = manager.Queue(maxsize=QUERY_QUEUE_SIZE * workers)
+    reporter_proc = start_reporter(curator, manager)
+    metrics_writer = metrics.start_metrics(curator, manager)
+    trace_path = tracing.start_tracing(curator)
+    accounts = accounting.start_accounting(curator, manager)
+    profile_dir = profiling.start_profiling(curator)
+    log_queue, log_listener = logs.start_logging(curator)
+    slow_containers = watchdog.start_watchdog(curator, manager)
+    shared_inputs = inputs.publish_inputs(curator)
+    shared_data = state.share_data(curator)
+    client_factory = clients.make_client_factory(curator)
+    shared_curated = manager.dict() if curated is not None else None
     worker_ps = []
     for i in range(workers):
-        # Give each worker its assignments
         log.info(f"Initializing Worker {i}")
         proc = Process(
-            target=worker, args=(curator, distributions[i], lock, i, fail), name=str(i)
+            target=query_worker,
+            args=(
+                curator,
+                queue,
+                lock,
+                i,
+                fail,
+                metrics_writer and metrics_writer.shared,
+                accounts,
+                log_queue,
+                slow_containers,
+                shared_inputs,
+                shared_data,
+                time.time(),
+                client_factory,
+                shared_curated,
+            ),
+            name=str(i),
         )
-        proc.start()
+        with state.detached_data(curator, shared_data), startup.detached_client(
+            curator
+        ):
+            proc.start()
         worker_ps.append(proc)
-    # Block until each process has completed
-    finished = False
-    while not finished:
-        if fail.is_set():
-            log.error(f"Worker failed early, killing other workers...")
-            r_code = 1
-            for worker_p in worker_ps:
-                if worker_p.is_alive():
-                    worker_p.terminate()
-            finished = True
-        else:
-            if not any([worker_p.is_alive() for worker_p in worker_ps]):
-                finished = True
-    for worker_p in worker_ps:
-        worker_p.join()
-        e_code = worker_p.exitcode
-        log.info(f"Worker {worker_p.name} finished with exit code: {e_code}")
-    # If a reporter was instantiated, send it the termination signal.
-    if reporter_proc:
-        curator.reporter.write("END")
-        reporter_proc.join()
+    count = 0
+    query_failed = False
+    try:
+        for entry in work:
+            # Don't block forever on a full queue if every worker has died.
+            while not fail.is_set():
+                try:
+                    queue.put(entry, timeout=1)
+                    break
+                except Full:
+                    continue
+            if fail.is_set():
+                break
+            count += 1
+    except Exception:  # pylint: disable=broad-except
+        # Let the workers finish the containers already queued.
+        log.critical("Could not finish the query, stopping.", exc_info=True)
+        query_failed = True
+    finally:
+        log.info(f"Queued {count} containers from query")
+        if not fail.is_set():
+            for _ in range(workers):
+                queue.put(None)
+    r_code = wait_for_workers(worker_ps, fail) or int(query_failed)
+    if shared_curated is not None:
+        curated.update(shared_curated)
+    logs.stop_logging(log_listener)
+    if shared_data:
+        shared_data.remove()
+    metrics.stop_metrics(metrics_writer)
+    tracing.stop_tracing(trace_path, workers)
+    accounting.log_accounting(accounts)
+    watchdog.stop_watchdog(curator, slow_containers)
+    profiling.stop_profiling(profile_dir, workers)
+    stop_reporter(curator, reporter_proc)
     return r_code
 
 
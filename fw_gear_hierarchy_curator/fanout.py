@@ -0,0 +1,148 @@
+"""Parallel curation of the containers at a level of the hierarchy.
+
+Depth-first, each child of the run container is a unit of work walked by a
+single worker, so that containers are curated after their ancestors and see
+the `data` stored while curating them.  When a project has few subjects with
+many sessions each, most of the workers are idle.
+
+With `config.parallel_level` set, e.g. to `session`, the main process walks
+each child depth-first itself and curates the containers above that level, in
+order, along with their files and analyses.  The containers at the level
+become the units of work, each with a snapshot of the curator `data` taken
+when it was reached, i.e. after its ancestors were curated.  Workers restore
+a copy of the snapshot of each unit before walking it.
+
+Snapshots are deep copies, taken only when a container was curated since the
+last one, so values changed in place in `data` after a snapshot was taken
+aren't seen by the units of that snapshot.
+"""
+import copy
+import logging
+import multiprocessing
+import typing as t
+
+from flywheel_gear_toolkit.utils import curator as c
+from flywheel_gear_toolkit.utils import datatypes, walker
+
+from . import frontier
+from .state import SharedData
+from .utils import container_to_pickleable_dict, get_config_option, make_walker
+
+log = logging.getLogger(__name__)
+
+# Levels the work can be distributed at, the children of the run container
+# already are.
+LEVELS = walker.hierarchy[1:]
+
+
+def get_parallel_level(curator: c.HierarchyCurator) -> t.Optional[str]:
+    """Level to distribute the work at, from `config.parallel_level`.
+
+    Returns None if it isn't set, or when walking breadth-first, where the
+    children of the run container are already walked level by level.
+
+    Raises:
+        ValueError: If the level isn't valid, or when resuming from or writing
+            a journal, which doesn't hold the snapshots of the curator data.
+    """
+    level = get_config_option(curator, "parallel_level")
+    if not level:
+        return None
+    if level not in LEVELS:
+        raise ValueError(
+            f"Expected parallel_level to be one of {LEVELS}, found {level}"
+        )
+    if get_config_option(curator, "resume_journal"):
+        raise ValueError("parallel_level can't be used with resume_journal")
+    for option in ["deadline", "time_budget"]:
+        if get_config_option(curator, option):
+            raise ValueError(f"parallel_level can't be used with {option}")
+    if not curator.config.depth_first:
+        log.warning("parallel_level only applies depth-first, ignoring it")
+        return None
+    return level
+
+
+def fan_out(
+    curator: c.HierarchyCurator,
+    units: t.List[t.Dict[str, str]],
+    level: str,
+    curate: t.Callable[[datatypes.Container], None],
+) -> t.Tuple[t.List[t.Dict[str, t.Any]], t.List[t.Any]]:
+    """Curate the containers of units above a level, in depth-first order.
+
+    Args:
+        curator: Curator of the main process.
+        units: Units of work, as returned by `container_to_pickleable_dict`.
+        level: Level of the containers to return as units.
+        curate: Validates and curates a container.
+
+    Returns:
+        tuple: The units at `level`, and units that aren't above it, in order,
+            each with the index of its snapshot under `snapshot`, and the
+            snapshots of the curator `data`.
+    """
+    above = walker.hierarchy[: walker.hierarchy.index(level)]
+    snapshots = [copy.deepcopy(curator.data)]
+    fanned = []
+    curated = False
+    for unit in units:
+        if unit["container_type"] not in above:
+            fanned.append({**unit, "snapshot": 0})
+            continue
+        w = make_walker(frontier.Entry.from_dict(unit), curator)
+        for element in w.walk_to(level, callback=curator.config.callback):
+            if element.container_type != level:
+                curate(element)
+                curated = True
+                continue
+            if curated:
+                snapshots.append(copy.deepcopy(curator.data))
+                curated = False
+            child = container_to_pickleable_dict(element)
+            fanned.append({**child, "snapshot": len(snapshots) - 1})
+    log.info(
+        f"Curated above {level} level, {len(fanned)} units with "
+        f"{len(snapshots)} snapshots of the curator data"
+    )
+    return fanned, snapshots
+
+
+def share_snapshots(snapshots: t.List[t.Any]) -> t.Union[t.List[t.Any], SharedData]:
+    """Snapshots to pass to the workers.
+
+    Forked workers share them copy-on-write with the main process, they are
+    written to a file for the others (see `state.SharedData`).
+    """
+    if multiprocessing.get_start_method() == "fork":
+        return snapshots
+    return SharedData.write(snapshots)
+
+
+def read_snapshots(
+    shared: t.Optional[t.Union[t.List[t.Any], SharedData]]
+) -> t.Optional[t.List[t.Any]]:
+    """Snapshots passed to a worker by `share_snapshots`."""
+    if isinstance(shared, SharedData):
+        return shared.read()
+    return shared
+
+
+def with_snapshots(
+    handle: t.Callable[[c.HierarchyCurator, t.List[frontier.Entry]], None],
+    work: t.List[t.Dict[str, t.Any]],
+    snapshots: t.List[t.Any],
+) -> t.Callable[[c.HierarchyCurator, t.List[frontier.Entry]], None]:
+    """Wrap a handle to handle each unit from a copy of its snapshot."""
+    snapshot_of = {unit["id"]: unit.get("snapshot") for unit in work}
+
+    def handle_units(
+        local_curator: c.HierarchyCurator, entries: t.List[frontier.Entry]
+    ) -> None:
+        for entry in entries:
+            snapshot = snapshot_of.get(entry.id)
+            if snapshot is not None:
+                local_curator.data = copy.deepcopy(snapshots[snapshot])
+            handle(local_curator, [entry])
+
+    return handle_units
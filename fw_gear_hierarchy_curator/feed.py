@@ -0,0 +1,278 @@
+"""Change-feed mode, curating only containers modified since the last poll.
+
+Instead of walking the whole hierarchy, the containers modified since a stored
+high-water mark are queried and curated through the query mode worker pool (see
+`curate.start_query_multiproc`).  The mark is the latest modified time of the
+containers returned by a poll, as set by the server, and is only advanced once
+the poll has been curated successfully.
+
+Updates made by the curator modify the containers it curates, so they are
+returned again by the next poll.  The modified time of each container is
+recorded right after it is curated and stored with the mark, and the next poll
+leaves out the containers whose modified time still matches exactly: their
+only change is their curation.
+"""
+import datetime
+import json
+import logging
+import threading
+import typing as t
+from pathlib import Path
+
+from flywheel_gear_toolkit import GearToolkitContext
+from flywheel_gear_toolkit.utils import curator as c
+from flywheel_gear_toolkit.utils import datatypes
+
+from . import curate
+from .reports import tag_report_path
+from .utils import container_to_pickleable_dict, get_config_option, iter_query_work
+
+log = logging.getLogger(__name__)
+
+MARK_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# Format of the modified times of the curated containers, compared exactly.
+CURATED_FORMAT = "%Y-%m-%dT%H:%M:%S.%f"
+
+
+def get_state_path(curator: c.HierarchyCurator) -> Path:
+    """Path of the file storing the high-water mark.
+
+    `config.feed_state`, defaulting to `feed_state.json` next to the report
+    path.  Point it to persistent storage when running as a daemon.
+    """
+    path = get_config_option(curator, "feed_state")
+    if path:
+        return Path(path)
+    return Path(curator.config.path).parent / "feed_state.json"
+
+
+def read_mark(path: datatypes.PathLike) -> t.Optional[datetime.datetime]:
+    """Read the high-water mark, or None if it hasn't been stored yet."""
+    path = Path(path)
+    if not path.exists():
+        return None
+    with open(path, encoding="utf-8") as fp:
+        mark = json.load(fp)["high_water_mark"]
+    return datetime.datetime.strptime(mark, MARK_FORMAT).replace(
+        tzinfo=datetime.timezone.utc
+    )
+
+
+def read_curated(path: datatypes.PathLike) -> t.Dict[str, datetime.datetime]:
+    """Read the modified times of the containers curated by the last poll, by
+    ID, or an empty dictionary if they weren't stored.
+    """
+    path = Path(path)
+    if not path.exists():
+        return {}
+    with open(path, encoding="utf-8") as fp:
+        state = json.load(fp)
+    return {
+        container_id: datetime.datetime.strptime(
+            modified, CURATED_FORMAT
+        ).replace(tzinfo=datetime.timezone.utc)
+        for container_id, modified in state.get("curated", {}).items()
+    }
+
+
+def write_mark(
+    path: datatypes.PathLike,
+    mark: datetime.datetime,
+    curated: t.Optional[t.Mapping[str, datetime.datetime]] = None,
+) -> None:
+    """Store the high-water mark, and the containers curated by the poll.
+
+    Args:
+        path: Path of the state file.
+        mark: High-water mark.
+        curated: Modified times of the containers curated by the poll, by ID.
+    """
+    state: t.Dict[str, t.Any] = {"high_water_mark": mark.strftime(MARK_FORMAT)}
+    if curated:
+        state["curated"] = {
+            container_id: modified.astimezone(datetime.timezone.utc).strftime(
+                CURATED_FORMAT
+            )
+            for container_id, modified in sorted(curated.items())
+        }
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump(state, fp)
+
+
+def own_writes(
+    curated: t.Mapping[str, datetime.datetime],
+    listed: t.Dict[str, datetime.datetime],
+) -> t.Callable[[datatypes.Container], bool]:
+    """Whether a container was curated by the last poll and not modified since.
+
+    Args:
+        curated: Modified times of the containers curated by the last poll.
+        listed: Dictionary to add the modified time of each container checked
+            to, by ID.
+
+    Returns:
+        callable: Returns True for a container whose modified time is the
+            one recorded when it was curated.
+    """
+
+    def is_own_write(container: datatypes.Container) -> bool:
+        modified = getattr(container, "modified", None)
+        if modified is None:
+            return False
+        container_id = container_to_pickleable_dict(container)["id"]
+        listed[container_id] = modified
+        return curated.get(container_id) == modified
+
+    return is_own_write
+
+
+def modified_since(
+    query: t.Optional[str], mark: t.Optional[datetime.datetime]
+) -> t.Optional[str]:
+    """Add a `modified>mark` term to a filter string."""
+    if mark is None:
+        return query
+    term = f"modified>{mark.strftime(MARK_FORMAT)}"
+    return f"{query},{term}" if query else term
+
+
+def report_path(path: datatypes.PathLike, when: datetime.datetime) -> Path:
+    """Report path for one poll, e.g. `output.20230601T120000.csv`."""
+    return tag_report_path(path, when.strftime("%Y%m%dT%H%M%S"))
+
+
+def poll(
+    curator: c.HierarchyCurator,
+    client: t.Any,
+    parent: datatypes.Container,
+    container_type: str,
+    query: t.Optional[str] = None,
+    file_query: t.Optional[str] = None,
+    report_base: t.Optional[datatypes.PathLike] = None,
+) -> int:
+    """Curate the containers modified since the stored mark, then advance it.
+
+    If `report_base` is given, the poll is reported to a timestamped path
+    derived from it so that polls don't overwrite each other.
+
+    Returns:
+        int: Return code of the curation.
+    """
+    state_path = get_state_path(curator)
+    mark = read_mark(state_path)
+    curated = read_curated(state_path)
+    listed: t.Dict[str, datetime.datetime] = {}
+    log.info(f"Polling for {container_type} containers modified since {mark}")
+    if report_base:
+        now = datetime.datetime.now(datetime.timezone.utc)
+        curator.config.path = report_path(report_base, now)
+    if container_type == "file":
+        file_query = modified_since(file_query, mark)
+    work = iter_query_work(
+        client,
+        parent,
+        container_type,
+        query=modified_since(query, mark),
+        file_query=file_query,
+        exclude=own_writes(curated, listed),
+    )
+    newly_curated: t.Dict[str, datetime.datetime] = {}
+    r_code = curate.start_query_multiproc(curator, work, newly_curated)
+    if r_code == 0:
+        if not listed:
+            log.info("No containers modified, high-water mark not advanced")
+            return r_code
+        new_mark = max(listed.values())
+        # The mark has a resolution of a second, containers skipped may be
+        # returned by the next poll again.
+        skipped = {
+            container_id: modified
+            for container_id, modified in listed.items()
+            if curated.get(container_id) == modified
+        }
+        write_mark(state_path, new_mark, {**skipped, **newly_curated})
+        log.info(f"Advanced high-water mark to {new_mark}")
+    else:
+        log.error("Curation failed, high-water mark not advanced")
+    return r_code
+
+
+def run_feed(
+    curator: c.HierarchyCurator,
+    client: t.Any,
+    parent: datatypes.Container,
+    container_type: str,
+    interval: float,
+    query: t.Optional[str] = None,
+    file_query: t.Optional[str] = None,
+    stop: t.Optional[threading.Event] = None,
+) -> int:
+    """Poll every `interval` seconds until stopped.
+
+    Args:
+        curator: Curator object
+        client: Flywheel client.
+        parent: Container the polls are restricted to.
+        container_type: Type of container to poll for.
+        interval: Seconds between the start of each poll.
+        query: Additional finder filter.
+        file_query: Additional local filter for files.
+        stop: Event to stop polling, if not given polls until interrupted.
+
+    Returns:
+        int: Return code of the last poll.
+    """
+    stop = stop or threading.Event()
+    report_base = curator.config.path if curator.config.report else None
+    r_code = 0
+    while not stop.is_set():
+        try:
+            r_code = poll(
+                curator,
+                client,
+                parent,
+                container_type,
+                query,
+                file_query,
+                report_base=report_base,
+            )
+        except KeyboardInterrupt:
+            log.info("Interrupted, stopping")
+            break
+        try:
+            stop.wait(interval)
+        except KeyboardInterrupt:
+            log.info("Interrupted, stopping")
+            break
+    return r_code
+
+
+def feed_main(
+    context: GearToolkitContext,
+    parent: datatypes.Container,
+    curator_path: datatypes.PathLike,
+    interval: float,
+    container_type: str = "acquisition",
+    query: t.Optional[str] = None,
+    file_query: t.Optional[str] = None,
+    options: t.Optional[t.Dict[str, t.Any]] = None,
+    **kwargs,
+) -> int:
+    """Curates containers as they are modified, polling every `interval` seconds.
+
+    Args:
+        context (GearToolkitContext): The flywheel gear toolkit context.
+        parent (Container): Container the polls are restricted to.
+        curator_path (Path-like): A path to a curator module.
+        interval (float): Seconds between polls.
+        container_type (str): Type of container to poll for.
+        query (str): Additional finder filter.
+        file_query (str): Additional local filter for files.
+        options (dict): Engine options to set on the curator config.
+        kwargs (dict): Dictionary of attributes/value to set on curator.
+    """
+    curator = curate.load_curator(context, curator_path, options, **kwargs)
+    log.info("Curator config: " + str(curator.config))
+    return run_feed(
+        curator, context.client, parent, container_type, interval, query, file_query
+    )
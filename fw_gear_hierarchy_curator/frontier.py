@@ -0,0 +1,364 @@
+"""Compact walker frontier, hydrating containers when they are popped.
+
+The toolkit walker queues the children of each container it visits as SDK
+model objects, reloaded when `config.reload` is true, so the frontier of a
+breadth-first walk, or of a depth-first walk through a large acquisition,
+holds the full metadata of every queued container.  `Frontier` instead queues
+an `Entry` holding the type, ID and parent of each child, and only gets the
+container from the API when it is popped.  With `config.reload` true this
+makes as many requests as the toolkit walker, which reloads every child when
+it is queued, and only the containers being curated are held in memory.
+
+With `config.reload` false, the children are queued as listed, as getting them
+one by one would add a request per container.
+
+A breadth-first walk of a project queues every file of the project before
+curating the first one.  With `config.frontier_size` set, a breadth-first
+`Frontier` holds at most that many entries in memory and spills the rest, in
+order, to a `SpillingQueue` backed by a temporary sqlite database.
+"""
+import collections
+import itertools
+import logging
+import os
+import sqlite3
+import sys
+import tempfile
+import typing as t
+import weakref
+
+import flywheel
+from flywheel_gear_toolkit.utils import datatypes, walker
+
+from . import tracing
+
+log = logging.getLogger(__name__)
+
+
+class Entry:
+    """A container queued in a frontier, by type, ID and parent.
+
+    Attributes:
+        container_type: Type of the container, e.g. `session`.
+        id: ID of the container (`file_id` of files).
+        parent_type: Type of the parent of a file.
+        parent_id: ID of the parent of a file.
+    """
+
+    __slots__ = ("container_type", "id", "parent_type", "parent_id")
+
+    def __init__(
+        self,
+        container_type: str,
+        id: str,  # pylint: disable=redefined-builtin
+        parent_type: t.Optional[str] = None,
+        parent_id: t.Optional[str] = None,
+    ) -> None:
+        self.container_type = sys.intern(container_type)
+        self.id = id
+        self.parent_type = parent_type and sys.intern(parent_type)
+        self.parent_id = parent_id
+
+    @classmethod
+    def from_container(
+        cls,
+        container: datatypes.Container,
+        parent: t.Optional[datatypes.Container] = None,
+    ) -> "Entry":
+        """Entry of a container, or of a file listed on its `parent`."""
+        if isinstance(container, cls):
+            return container
+        if container.container_type != "file":
+            return cls(container.container_type, container.id)
+        if parent is not None:
+            parent_type, parent_id = parent.container_type, parent.id
+        else:
+            parent_type = container.parent_ref.get("type")
+            parent_id = container.parent_ref.get("id")
+        return cls(
+            "file", getattr(container, "file_id", container.id), parent_type, parent_id
+        )
+
+    @classmethod
+    def from_dict(cls, val: t.Dict[str, str]) -> "Entry":
+        """Entry of a work unit, see `utils.container_to_pickleable_dict`."""
+        return cls(
+            val["container_type"],
+            val["id"],
+            val.get("parent_type"),
+            val.get("parent_id"),
+        )
+
+    def to_dict(self) -> t.Dict[str, str]:
+        """Work unit of the entry, see `utils.container_to_pickleable_dict`."""
+        val = {"id": self.id, "container_type": self.container_type}
+        if self.container_type == "file":
+            val["parent_type"] = self.parent_type
+            val["parent_id"] = self.parent_id
+        return val
+
+    def get(self, client: flywheel.Client) -> datatypes.Container:
+        """Get the container from the API."""
+        return getattr(client, f"get_{self.container_type}")(self.id)
+
+    def __eq__(self, other: t.Any) -> bool:
+        if not isinstance(other, Entry):
+            return NotImplemented
+        return all(
+            getattr(self, name) == getattr(other, name) for name in self.__slots__
+        )
+
+    def __repr__(self) -> str:
+        return f"Entry({self.container_type}/{self.id})"
+
+
+def hydrate(entry: Entry, client: flywheel.Client) -> t.Optional[datatypes.Container]:
+    """Get the container of an entry, or None if it couldn't be fetched."""
+    try:
+        with tracing.span("hydrate", path=f"{entry.container_type}/{entry.id}"):
+            return entry.get(client)
+    except flywheel.rest.ApiException:
+        log.error("Could not get container, skipping curation", exc_info=True)
+        return None
+
+
+def _remove_database(connection: sqlite3.Connection, path: str) -> None:
+    connection.close()
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class SpillingQueue:
+    """First-in first-out queue of entries spilling to disk past a size.
+
+    Only entries are spilled, the first `size` elements queued may be
+    containers.
+
+    Entries are appended in memory until `size` are queued, and to a temporary
+    sqlite database after that, until the database is drained again, so they
+    are popped in the order they were appended.  When the entries in memory
+    run out, the next `size` entries are read back from the database.
+
+    Args:
+        size: Maximum number of entries held in memory.
+        entries: Entries to queue.
+        directory: Directory of the database (default: the temp directory).
+    """
+
+    def __init__(
+        self,
+        size: int,
+        entries: t.Iterable[Entry] = (),
+        directory: t.Optional[str] = None,
+    ) -> None:
+        if size < 1:
+            raise ValueError(f"Expected a positive frontier size, found {size}")
+        self.size = size
+        self.directory = directory
+        self.memory: t.Deque[Entry] = collections.deque()
+        self.spilled = 0
+        self.path: t.Optional[str] = None
+        self._db: t.Optional[sqlite3.Connection] = None
+        self.extend(entries)
+
+    @property
+    def db(self) -> sqlite3.Connection:
+        """Connection to the database, created on the first spill."""
+        if self._db is None:
+            fd, self.path = tempfile.mkstemp(
+                prefix="frontier-", suffix=".sqlite", dir=self.directory
+            )
+            os.close(fd)
+            self._db = sqlite3.connect(self.path, isolation_level=None)
+            # Nothing to recover if the job dies, so skip the journal.
+            self._db.execute("PRAGMA journal_mode = OFF")
+            self._db.execute("PRAGMA synchronous = OFF")
+            self._db.execute(
+                "CREATE TABLE entries (seq INTEGER PRIMARY KEY, "
+                "container_type TEXT, id TEXT, parent_type TEXT, parent_id TEXT)"
+            )
+            weakref.finalize(self, _remove_database, self._db, self.path)
+            log.debug(f"Spilling frontier entries to {self.path}")
+        return self._db
+
+    def append(self, entry: Entry) -> None:
+        """Queue an entry."""
+        self.extend([entry])
+
+    def extend(self, entries: t.Iterable[Entry]) -> None:
+        """Queue entries, spilling those past `size` to the database."""
+        entries = iter(entries)
+        if not self.spilled:
+            self.memory.extend(itertools.islice(entries, self.size - len(self.memory)))
+        rows = [
+            (entry.container_type, entry.id, entry.parent_type, entry.parent_id)
+            for entry in entries
+        ]
+        if rows:
+            self.db.executemany(
+                "INSERT INTO entries "
+                "(container_type, id, parent_type, parent_id) VALUES (?, ?, ?, ?)",
+                rows,
+            )
+            self.spilled += len(rows)
+
+    def _unspill(self) -> None:
+        rows = self.db.execute(
+            "SELECT seq, container_type, id, parent_type, parent_id FROM entries "
+            "ORDER BY seq LIMIT ?",
+            (self.size,),
+        ).fetchall()
+        self.db.execute("DELETE FROM entries WHERE seq <= ?", (rows[-1][0],))
+        self.spilled -= len(rows)
+        self.memory.extend(Entry(*row[1:]) for row in rows)
+
+    def popleft(self) -> Entry:
+        """Pop the oldest entry.
+
+        Raises:
+            IndexError: If the queue is empty.
+        """
+        if not self.memory and self.spilled:
+            self._unspill()
+        return self.memory.popleft()
+
+    def __len__(self) -> int:
+        return len(self.memory) + self.spilled
+
+    def __iter__(self) -> t.Iterator[Entry]:
+        yield from list(self.memory)
+        if self.spilled:
+            rows = self.db.execute(
+                "SELECT container_type, id, parent_type, parent_id FROM entries "
+                "ORDER BY seq"
+            )
+            for row in rows:
+                yield Entry(*row)
+
+
+class Frontier(walker.Walker):
+    """Walker queueing compact entries, hydrated when they are popped.
+
+    Args:
+        root: Root container, or entry of the root container.
+        client: Client to get the queued containers with.
+        depth_first: Walk depth-first if True, breadth-first if False.
+        reload: Reload containers to load all their metadata.
+        stop_level: Container type at which to stop walking.
+        compact: Queue children as entries (default `reload`, or True with
+            `size`).
+        size: Maximum number of entries a breadth-first frontier holds in
+            memory before spilling to disk (default unbounded).
+    """
+
+    def __init__(
+        self,
+        root: t.Union[datatypes.Container, Entry],
+        client: flywheel.Client,
+        depth_first: bool = True,
+        reload: bool = False,
+        stop_level: t.Optional[str] = None,
+        compact: t.Optional[bool] = None,
+        size: t.Optional[int] = None,
+    ) -> None:
+        super().__init__(
+            root, depth_first=depth_first, reload=False, stop_level=stop_level
+        )
+        self.client = client
+        self.reload = reload
+        if compact is None:
+            compact = reload or bool(size)
+        self.compact = compact
+        if reload:
+            self.deque[0] = Entry.from_container(root)
+        # Only entries can be spilled, and only the end of a FIFO queue.
+        if size and compact and not depth_first:
+            self.deque = SpillingQueue(size, self.deque)
+
+    def _queued(self, element: t.Any, parent=None) -> t.Any:
+        if isinstance(element, Entry):
+            return element
+        if self.compact:
+            return Entry.from_container(element, parent)
+        return self._reload_container(element)
+
+    def _pop(self) -> t.Optional[datatypes.Container]:
+        element = self.deque.pop() if self.depth_first else self.deque.popleft()
+        if isinstance(element, Entry):
+            return hydrate(element, self.client)
+        return element
+
+    def _visit(
+        self,
+        element: datatypes.Container,
+        callback: t.Optional[t.Callable[[datatypes.Container], bool]],
+    ) -> datatypes.Container:
+        to_queue = True
+        if callback and callable(callback):
+            to_queue = callback(element)
+        if to_queue:
+            self.queue_children(element)
+        return element
+
+    def next(self, callback=None) -> datatypes.Container:
+        """Return the next container, skipping those that couldn't be fetched.
+
+        Raises:
+            IndexError: If the frontier is empty.
+        """
+        element = None
+        while element is None:
+            element = self._pop()
+        return self._visit(element, callback)
+
+    def add(self, element) -> None:
+        """Add a container or entry, or a list of them."""
+        elements = element if isinstance(element, list) else [element]
+        if self.compact:
+            elements = [Entry.from_container(element) for element in elements]
+        self.deque.extend(elements)
+
+    def queue_children(self, element: datatypes.Container) -> None:
+        """Queue the children of a container, as entries if compact."""
+        container_type = element.container_type
+        if container_type in ["file", "analysis"] or container_type in self._exclude:
+            return
+        self.deque.extend(self._queued(file_, element) for file_ in element.files or [])
+        if isinstance(element.analyses, list):
+            self.deque.extend(self._queued(analysis) for analysis in element.analyses)
+        finder = {
+            "project": "subjects",
+            "subject": "sessions",
+            "session": "acquisitions",
+        }.get(container_type)
+        if finder:
+            children = getattr(element, finder).iter_find()
+            self.deque.extend(self._queued(child) for child in children)
+
+    def walk(self, callback=None) -> t.Iterator[datatypes.Container]:
+        """Walk the hierarchy, skipping containers that couldn't be fetched."""
+        while not self.is_empty():
+            element = self._pop()
+            if element is not None:
+                yield self._visit(element, callback)
+
+    def walk_to(
+        self, level: str, callback=None
+    ) -> t.Iterator[t.Union[datatypes.Container, Entry]]:
+        """Walk the hierarchy above a level.
+
+        Containers above `level`, and their files and analyses, are yielded
+        and visited as by `walk`.  Those at `level` are yielded as queued,
+        i.e. as entries if compact, without fetching or visiting them.
+        """
+        while not self.is_empty():
+            element = self.deque.pop() if self.depth_first else self.deque.popleft()
+            if element.container_type == level:
+                yield element
+                continue
+            if isinstance(element, Entry):
+                element = hydrate(element, self.client)
+            if element is not None:
+                yield self._visit(element, callback)
@@ -0,0 +1,134 @@
+"""Lock-free reads of the additional input files from the workers.
+
+`HierarchyCurator.open_input` takes the lock shared by all workers, so only
+one worker at a time can read an input, even though the inputs are never
+written.  Before starting the workers, the main process publishes each
+additional input: it maps the file read-only and asks the OS to load it into
+the page cache.  Each worker then serves `open_input` calls for reading a
+published input from its own read-only memory map of the file, without taking
+the lock and sharing the same physical pages as the other workers.  Other
+paths and modes still go through the original `open_input`.
+"""
+import contextlib
+import dataclasses
+import io
+import logging
+import mmap
+import os
+import typing as t
+
+from flywheel_gear_toolkit.utils import curator as c
+from flywheel_gear_toolkit.utils import datatypes
+
+log = logging.getLogger(__name__)
+
+# Attributes of the curator holding the paths to the inputs.
+INPUT_ATTRS = ["additional_input_one", "additional_input_two", "additional_input_three"]
+
+# Read-only maps of the published inputs opened by the current process.
+_maps: t.Dict[str, mmap.mmap] = {}
+
+
+@dataclasses.dataclass(frozen=True)
+class SharedInput:
+    """Input file published to the workers."""
+
+    path: str
+    size: int
+
+
+def _map(path: str) -> mmap.mmap:
+    with open(path, "rb") as fp:
+        return mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def publish_inputs(curator: c.HierarchyCurator) -> t.Dict[str, SharedInput]:
+    """Publish the additional inputs of a curator, keyed by path.
+
+    Empty and missing inputs are not published.
+    """
+    published = {}
+    for attr in INPUT_ATTRS:
+        path = getattr(curator, attr, None)
+        if not path or not os.path.isfile(path):
+            continue
+        size = os.path.getsize(path)
+        if not size:
+            continue
+        buffer = _map(str(path))
+        if hasattr(mmap, "MADV_WILLNEED"):
+            # Read the file into the page cache once for all workers.
+            buffer.madvise(mmap.MADV_WILLNEED)
+        buffer.close()
+        published[str(path)] = SharedInput(str(path), size)
+        log.debug(f"Published {attr} ({size} bytes) to the workers")
+    return published
+
+
+def get_buffer(shared: SharedInput) -> memoryview:
+    """Read-only buffer of a published input, mapped once per process."""
+    if shared.path not in _maps:
+        _maps[shared.path] = _map(shared.path)
+    return memoryview(_maps[shared.path])
+
+
+class BufferReader(io.RawIOBase):
+    """Raw binary stream reading from a buffer without copying it."""
+
+    def __init__(self, buffer: memoryview) -> None:
+        super().__init__()
+        self.buffer = buffer
+        self.pos = 0
+
+    def readable(self) -> bool:
+        return True
+
+    def seekable(self) -> bool:
+        return True
+
+    def readinto(self, b: t.Any) -> int:
+        data = self.buffer[self.pos : self.pos + len(b)]
+        size = len(data)
+        memoryview(b).cast("B")[:size] = data
+        self.pos += size
+        return size
+
+    def seek(self, offset: int, whence: int = io.SEEK_SET) -> int:
+        if whence == io.SEEK_CUR:
+            offset += self.pos
+        elif whence == io.SEEK_END:
+            offset += len(self.buffer)
+        self.pos = max(offset, 0)
+        return self.pos
+
+    def tell(self) -> int:
+        return self.pos
+
+
+def open_buffer(buffer: memoryview, mode: str = "r") -> t.IO:
+    """Open a buffer like `open` would open a file with the same contents."""
+    stream = io.BufferedReader(BufferReader(buffer))
+    if "b" in mode:
+        return stream
+    return io.TextIOWrapper(stream)
+
+
+def attach_inputs(
+    local_curator: c.HierarchyCurator, published: t.Optional[t.Dict[str, SharedInput]]
+) -> None:
+    """Serve reads of the published inputs from memory maps in a worker."""
+    if not published:
+        return
+    locked_open = local_curator.open_input
+
+    @contextlib.contextmanager
+    def open_input(path: datatypes.PathLike, mode: str = "r"):
+        shared = published.get(str(path))
+        if shared is None or not set(mode) <= set("rbt"):
+            with locked_open(path, mode) as fp:
+                yield fp
+            return
+        with open_buffer(get_buffer(shared), mode) as fp:
+            yield fp
+
+    local_curator.open_input = open_input
@@ -0,0 +1,93 @@
+"""Deferred imports of heavy modules.
+
+Curators commonly import pandas, nibabel, matplotlib, ... at the top of their
+module, which the main process pays for when it loads the curator even if the
+run never uses them, e.g. a short run whose containers are all rejected by
+`validate_container`.  While the curator is loaded, the top-level modules in
+`LAZY_MODULES` are imported lazily: the import statement only finds the
+module, and the module is executed on first attribute access, e.g.
+`pd.DataFrame`.
+
+Modules first used in the workers are imported by each worker, as they would
+be if the curator imported them inside its methods.  With the `forkserver`
+start method, the fork server preloads them once for all workers.
+"""
+import contextlib
+import importlib.abc
+import importlib.machinery
+import importlib.util
+import sys
+import types
+import typing as t
+
+# Top-level modules imported lazily while a curator is loaded.
+LAZY_MODULES = [
+    "pandas",
+    "matplotlib",
+    "nibabel",
+    "pydicom",
+    "lxml",
+    "PIL",
+    "piexif",
+    "png",
+    "fw_file",
+    "scipy",
+]
+
+
+def lazy_spec(spec: t.Optional[importlib.machinery.ModuleSpec]):
+    """Make a module spec execute the module on first attribute access."""
+    if spec is None or not hasattr(spec.loader, "exec_module"):
+        return spec
+    spec.loader = importlib.util.LazyLoader(spec.loader)
+    return spec
+
+
+def lazy_import(name: str) -> types.ModuleType:
+    """Import a module, deferring its execution until an attribute is used.
+
+    Raises:
+        ModuleNotFoundError: If the module can't be found.
+    """
+    if name in sys.modules:
+        return sys.modules[name]
+    spec = lazy_spec(importlib.util.find_spec(name))
+    if spec is None:
+        raise ModuleNotFoundError(f"No module named {name!r}", name=name)
+    module = importlib.util.module_from_spec(spec)
+    sys.modules[name] = module
+    spec.loader.exec_module(module)
+    return module
+
+
+class LazyFinder(importlib.abc.MetaPathFinder):
+    """Finder importing some top-level modules lazily.
+
+    Args:
+        names: Names of the top-level modules.
+    """
+
+    def __init__(self, names: t.Iterable[str]) -> None:
+        self.names = set(names)
+
+    def find_spec(self, fullname, path, target=None):
+        if fullname not in self.names:
+            return None
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, "find_spec"):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                return lazy_spec(spec)
+        return None
+
+
+@contextlib.contextmanager
+def lazy_imports(names: t.Iterable[str] = LAZY_MODULES):
+    """Import the top-level modules `names` lazily in this context."""
+    finder = LazyFinder(names)
+    sys.meta_path.insert(0, finder)
+    try:
+        yield
+    finally:
+        sys.meta_path.remove(finder)
@@ -0,0 +1,239 @@
+"""Logging from the worker processes.
+
+Worker processes don't write log records themselves.  Each worker replaces the
+handlers it inherited with a `BatchingHandler`, which sends its records in
+batches over a queue, and a `LogListener` thread in the main process passes
+them to the handlers of the main process.  Records of the workers are then
+written by a single writer, one whole record at a time, and also reach
+handlers added to the main process later, like pytest's `caplog`.
+
+Workers log at the level of the root logger of the main process, passed to
+them as `config.log_level`, as workers that aren't forked don't inherit it.
+
+Debug records are rate limited per worker (`config.log_rate_limit` records per
+second, default 200): records over the limit are dropped before they are
+formatted, and the number dropped is logged instead.
+"""
+import logging
+import multiprocessing
+import queue
+import threading
+import time
+import typing as t
+
+from flywheel_gear_toolkit.utils import curator as c
+
+from .utils import get_config_option
+
+log = logging.getLogger(__name__)
+
+# Records buffered by a worker before they are sent.
+DEFAULT_BATCH_SIZE = 100
+# Seconds after which buffered records are sent with the next record.
+DEFAULT_FLUSH_INTERVAL = 1.0
+# Debug records per second a worker may send.
+DEFAULT_RATE_LIMIT = 200
+
+# Handler of the current worker process, if installed.
+_handler: t.Optional["BatchingHandler"] = None
+
+
+class RateLimiter:
+    """Token bucket allowing `rate` events per second, in bursts of `rate`."""
+
+    def __init__(self, rate: float) -> None:
+        self.rate = rate
+        self.tokens = rate
+        self.last = time.monotonic()
+        self.dropped = 0
+
+    def allow(self) -> bool:
+        """Take a token if there is one, counting the event as dropped if not."""
+        now = time.monotonic()
+        self.tokens = min(self.rate, self.tokens + (now - self.last) * self.rate)
+        self.last = now
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True
+        self.dropped += 1
+        return False
+
+
+class BatchingHandler(logging.Handler):
+    """Send records to a queue in batches.
+
+    Batches are sent when `batch_size` records are buffered, with the next
+    record after `flush_interval` seconds, with any warning or error, and when
+    the handler is closed.
+
+    Args:
+        log_queue: Queue to put lists of records on.
+        batch_size: Number of records to buffer.
+        flush_interval: Seconds to buffer records for.
+        rate_limit: Debug records allowed per second, unlimited if 0.
+    """
+
+    def __init__(
+        self,
+        log_queue: t.Any,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+        flush_interval: float = DEFAULT_FLUSH_INTERVAL,
+        rate_limit: float = DEFAULT_RATE_LIMIT,
+    ) -> None:
+        super().__init__()
+        self.queue = log_queue
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.limiter = RateLimiter(rate_limit) if rate_limit else None
+        self.buffer: t.List[logging.LogRecord] = []
+        self.flushed = time.monotonic()
+
+    def prepare(self, record: logging.LogRecord) -> logging.LogRecord:
+        """Merge the arguments and traceback into the record so it pickles."""
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def emit(self, record: logging.LogRecord) -> None:
+        try:
+            if (
+                record.levelno < logging.INFO
+                and self.limiter
+                and not self.limiter.allow()
+            ):
+                return
+            self.buffer.append(self.prepare(record))
+            if (
+                len(self.buffer) >= self.batch_size
+                or record.levelno >= logging.WARNING
+                or time.monotonic() - self.flushed >= self.flush_interval
+            ):
+                self.flush()
+        except Exception:  # pylint: disable=broad-except
+            self.handleError(record)
+
+    def flush(self) -> None:
+        """Send the buffered records, and the number of dropped records."""
+        self.acquire()
+        try:
+            if self.limiter and self.limiter.dropped:
+                self.buffer.append(
+                    logging.LogRecord(
+                        log.name,
+                        logging.INFO,
+                        __file__,
+                        0,
+                        f"Dropped {self.limiter.dropped} debug records of "
+                        f"{multiprocessing.current_process().name} over the "
+                        f"rate limit of {self.limiter.rate}/s",
+                        None,
+                        None,
+                    )
+                )
+                self.limiter.dropped = 0
+            if self.buffer:
+                self.queue.put(self.buffer)
+                self.buffer = []
+            self.flushed = time.monotonic()
+        finally:
+            self.release()
+
+    def close(self) -> None:
+        self.flush()
+        super().close()
+
+
+class LogListener:
+    """Pass batches of records from the workers to the main process' handlers.
+
+    Args:
+        log_queue: Queue the workers put their batches on.
+    """
+
+    def __init__(self, log_queue: t.Any) -> None:
+        self.queue = log_queue
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while True:
+            try:
+                batch = self.queue.get(timeout=0.5)
+            except queue.Empty:
+                if self._stop.is_set():
+                    return
+                continue
+            if batch is None:
+                return
+            for record in batch:
+                logger = logging.getLogger(record.name)
+                if logger.isEnabledFor(record.levelno):
+                    logger.handle(record)
+
+    def start(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Handle the records left on the queue and stop the thread."""
+        self.queue.put(None)
+        self._stop.set()
+        self._thread.join()
+
+
+def start_logging(
+    curator: t.Optional[c.HierarchyCurator] = None,
+) -> t.Tuple[t.Any, LogListener]:
+    """Create the queue the workers log to and start the listener thread.
+
+    The level of the root logger is set as `config.log_level` of the curator,
+    if given, for the workers to log at.
+    """
+    if curator is not None:
+        curator.config.log_level = logging.getLogger().level
+    log_queue = multiprocessing.Queue()
+    listener = LogListener(log_queue)
+    listener.start()
+    return log_queue, listener
+
+
+def stop_logging(listener: LogListener) -> None:
+    """Write the records left on the queue once the workers have stopped."""
+    listener.stop()
+
+
+def start_worker_logging(curator: c.HierarchyCurator, log_queue: t.Any) -> None:
+    """Replace the handlers of a worker with one sending records to the queue,
+    and set the level of the main process (see `start_logging`).
+    """
+    global _handler  # pylint: disable=global-statement
+    if log_queue is None:
+        return
+    rate_limit = get_config_option(curator, "log_rate_limit", DEFAULT_RATE_LIMIT)
+    _handler = BatchingHandler(log_queue, rate_limit=rate_limit)
+    root = logging.getLogger()
+    root.handlers = [_handler]
+    level = get_config_option(curator, "log_level")
+    if level is not None:
+        root.setLevel(level)
+
+
+def stop_worker_logging(wait: bool = False) -> None:
+    """Send the records buffered by a worker.
+
+    Args:
+        wait: Wait until the records are written to the queue's pipe, e.g.
+            before signalling a failure that gets the worker terminated.
+            Records logged afterwards go to stderr.
+    """
+    global _handler  # pylint: disable=global-statement
+    if _handler is None:
+        return
+    handler, _handler = _handler, None
+    handler.flush()
+    if wait:
+        logging.getLogger().removeHandler(handler)
+        handler.queue.close()
+        handler.queue.join_thread()
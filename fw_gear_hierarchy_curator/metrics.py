@@ -0,0 +1,354 @@
+"""Live metrics of a curation run.
+
+With `config.metrics_interval` set, each process counts the containers it
+curates and rejects per level, times the SDK requests it makes per endpoint,
+and tracks how many containers are queued in its walker.  Every few seconds it
+publishes a snapshot to a dictionary shared through the manager, which costs
+one round trip rather than one per container.  The main process aggregates the
+snapshots, rewrites a JSON (or Prometheus text, for a `.prom` path) file and
+logs a summary line every `metrics_interval` seconds.
+"""
+import bisect
+import collections
+import json
+import logging
+import os
+import threading
+import time
+import typing as t
+from pathlib import Path
+
+from flywheel_gear_toolkit.utils import curator as c
+
+from .utils import add_request_hook, get_config_option
+
+log = logging.getLogger(__name__)
+
+# Upper bounds of the API latency histogram buckets, in seconds.
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+# Metrics of the current process, if enabled.
+_metrics: t.Optional["Metrics"] = None
+
+
+class Histogram:
+    """Counts of observations falling in each bucket, Prometheus style."""
+
+    def __init__(self, buckets: t.Sequence[float] = LATENCY_BUCKETS) -> None:
+        self.buckets = list(buckets)
+        # Last count is for observations above the last bucket.
+        self.counts = [0] * (len(self.buckets) + 1)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        """Add an observation."""
+        self.counts[bisect.bisect_left(self.buckets, value)] += 1
+        self.sum += value
+        self.count += 1
+
+    def merge(self, other: "Histogram") -> None:
+        """Add the observations of another histogram with the same buckets."""
+        self.counts = [a + b for a, b in zip(self.counts, other.counts)]
+        self.sum += other.sum
+        self.count += other.count
+
+    def to_dict(self) -> t.Dict[str, t.Any]:
+        return {
+            "buckets": self.buckets,
+            "counts": self.counts,
+            "sum": self.sum,
+            "count": self.count,
+        }
+
+    @classmethod
+    def from_dict(cls, val: t.Dict[str, t.Any]) -> "Histogram":
+        hist = cls(val["buckets"])
+        hist.counts = list(val["counts"])
+        hist.sum = val["sum"]
+        hist.count = val["count"]
+        return hist
+
+
+class Metrics:
+    """Counters and histograms recorded by one process.
+
+    Args:
+        worker_id: Key of this process in the shared snapshots.
+        shared: Dictionary to publish snapshots to.
+        publish_interval: Minimum seconds between snapshots.
+    """
+
+    def __init__(
+        self,
+        worker_id: t.Any = "main",
+        shared: t.Optional[t.MutableMapping] = None,
+        publish_interval: float = 5,
+    ) -> None:
+        self.worker_id = worker_id
+        self.shared = shared
+        self.publish_interval = publish_interval
+        self.curated: t.Counter[str] = collections.Counter()
+        self.rejected: t.Counter[str] = collections.Counter()
+        self.api: t.Dict[str, Histogram] = collections.defaultdict(Histogram)
+        self.queue_depth = 0
+        self._published = time.monotonic()
+
+    def record_container(self, level: str, curated: bool, queue_depth: int) -> None:
+        """Record a container that was curated, or rejected by validate."""
+        if curated:
+            self.curated[level] += 1
+        else:
+            self.rejected[level] += 1
+        self.queue_depth = queue_depth
+        self.maybe_publish()
+
+    def record_api(self, endpoint: str, seconds: float) -> None:
+        """Record the latency of an SDK request."""
+        self.api[endpoint].observe(seconds)
+
+    def snapshot(self) -> t.Dict[str, t.Any]:
+        """Pickleable copy of the metrics."""
+        return {
+            "curated": dict(self.curated),
+            "rejected": dict(self.rejected),
+            "api": {endpoint: hist.to_dict() for endpoint, hist in self.api.items()},
+            "queue_depth": self.queue_depth,
+        }
+
+    def maybe_publish(self) -> None:
+        """Publish a snapshot if the last one is older than the interval."""
+        if time.monotonic() - self._published >= self.publish_interval:
+            self.publish()
+
+    def publish(self) -> None:
+        """Publish a snapshot to the shared dictionary."""
+        self._published = time.monotonic()
+        if self.shared is not None:
+            self.shared[self.worker_id] = self.snapshot()
+
+
+def get_metrics() -> t.Optional[Metrics]:
+    """Metrics of the current process, or None if disabled."""
+    return _metrics
+
+
+def set_metrics(metrics: t.Optional[Metrics]) -> None:
+    """Set the metrics of the current process."""
+    global _metrics  # pylint: disable=global-statement
+    _metrics = metrics
+
+
+def record_container(level: str, curated: bool, queue_depth: int = 0) -> None:
+    """Record a container in the metrics of the current process, if enabled."""
+    if _metrics is not None:
+        _metrics.record_container(level, curated, queue_depth)
+
+
+def instrument_client(client: t.Any, metrics: Metrics) -> None:
+    """Time the requests made by an SDK client, per method and endpoint."""
+    add_request_hook(
+        client, lambda request: metrics.record_api(request.endpoint, request.duration)
+    )
+
+
+def start_worker_metrics(
+    local_curator: c.HierarchyCurator,
+    worker_id: t.Any,
+    shared: t.Optional[t.MutableMapping],
+) -> None:
+    """Enable metrics in a worker process publishing to `shared`."""
+    if shared is None:
+        set_metrics(None)
+        return
+    interval = get_config_option(local_curator, "metrics_interval")
+    metrics = Metrics(worker_id, shared, publish_interval=interval / 2)
+    instrument_client(local_curator.context._client, metrics)
+    set_metrics(metrics)
+
+
+def stop_worker_metrics() -> None:
+    """Publish the final snapshot of a worker process."""
+    if _metrics is not None:
+        _metrics.publish()
+
+
+def aggregate(snapshots: t.Iterable[t.Tuple[t.Any, t.Dict[str, t.Any]]]) -> t.Dict:
+    """Combine `(worker_id, snapshot)` pairs into totals."""
+    curated: t.Counter[str] = collections.Counter()
+    rejected: t.Counter[str] = collections.Counter()
+    api: t.Dict[str, Histogram] = {}
+    queue_depth = {}
+    for worker_id, snapshot in snapshots:
+        curated.update(snapshot["curated"])
+        rejected.update(snapshot["rejected"])
+        for endpoint, val in snapshot["api"].items():
+            hist = Histogram.from_dict(val)
+            if endpoint in api:
+                api[endpoint].merge(hist)
+            else:
+                api[endpoint] = hist
+        queue_depth[str(worker_id)] = snapshot["queue_depth"]
+    return {
+        "curated": dict(curated),
+        "rejected": dict(rejected),
+        "api": api,
+        "queue_depth": queue_depth,
+    }
+
+
+def to_json(totals: t.Dict, elapsed: float) -> str:
+    """Render aggregated metrics as JSON."""
+    return json.dumps(
+        {
+            "elapsed": elapsed,
+            "curated": totals["curated"],
+            "curated_per_second": {
+                level: count / elapsed if elapsed else 0
+                for level, count in totals["curated"].items()
+            },
+            "rejected": totals["rejected"],
+            "api": {
+                endpoint: hist.to_dict() for endpoint, hist in totals["api"].items()
+            },
+            "queue_depth": totals["queue_depth"],
+        },
+        indent=4,
+    )
+
+
+def to_prometheus(totals: t.Dict, elapsed: float) -> str:
+    """Render aggregated metrics in the Prometheus text format."""
+    lines = [
+        "# TYPE curator_elapsed_seconds gauge",
+        f"curator_elapsed_seconds {elapsed}",
+        "# TYPE curator_containers_curated_total counter",
+    ]
+    for level, count in totals["curated"].items():
+        lines.append(f'curator_containers_curated_total{{level="{level}"}} {count}')
+    lines.append("# TYPE curator_containers_rejected_total counter")
+    for level, count in totals["rejected"].items():
+        lines.append(f'curator_containers_rejected_total{{level="{level}"}} {count}')
+    lines.append("# TYPE curator_api_request_duration_seconds histogram")
+    for endpoint, hist in totals["api"].items():
+        name = "curator_api_request_duration_seconds"
+        cumulative = 0
+        for bound, count in zip([*hist.buckets, "+Inf"], hist.counts):
+            cumulative += count
+            lines.append(
+                f'{name}_bucket{{endpoint="{endpoint}",le="{bound}"}} {cumulative}'
+            )
+        lines.append(f'{name}_sum{{endpoint="{endpoint}"}} {hist.sum}')
+        lines.append(f'{name}_count{{endpoint="{endpoint}"}} {hist.count}')
+    lines.append("# TYPE curator_worker_queue_depth gauge")
+    for worker_id, depth in totals["queue_depth"].items():
+        lines.append(f'curator_worker_queue_depth{{worker="{worker_id}"}} {depth}')
+    return "\n".join(lines) + "\n"
+
+
+def summarize(totals: t.Dict, previous: t.Dict, elapsed: float, interval: float):
+    """One line summary of the progress since the previous summary."""
+    levels = []
+    for level, count in totals["curated"].items():
+        rate = (count - previous["curated"].get(level, 0)) / interval
+        levels.append(f"{level} {count} ({rate:.1f}/s)")
+    calls = sum(hist.count for hist in totals["api"].values())
+    latency = sum(hist.sum for hist in totals["api"].values())
+    mean = f"{latency / calls * 1000:.0f}ms" if calls else "-"
+    queued = sum(totals["queue_depth"].values())
+    return (
+        f"{elapsed:.0f}s: curated {', '.join(levels) or 'nothing'}; "
+        f"rejected {sum(totals['rejected'].values())}; "
+        f"{calls} API calls (mean {mean}); {queued} queued"
+    )
+
+
+class MetricsWriter:
+    """Aggregate the published snapshots every `interval` seconds.
+
+    Args:
+        shared: Dictionary the processes publish snapshots to.
+        path: File to rewrite with the aggregated metrics.
+        interval: Seconds between writes.
+    """
+
+    def __init__(self, shared: t.MutableMapping, path: Path, interval: float):
+        self.shared = shared
+        self.path = Path(path)
+        self.interval = interval
+        self.start = time.monotonic()
+        self.previous: t.Dict = {"curated": {}}
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.write()
+            except Exception:  # pylint: disable=broad-except
+                log.warning("Could not write metrics", exc_info=True)
+
+    def write(self) -> t.Dict:
+        """Rewrite the metrics file and log a summary line."""
+        if _metrics is not None:
+            _metrics.publish()
+        totals = aggregate(list(self.shared.items()))
+        elapsed = time.monotonic() - self.start
+        if self.path.suffix == ".prom":
+            text = to_prometheus(totals, elapsed)
+        else:
+            text = to_json(totals, elapsed)
+        # Write to a temporary file first so readers never see a partial file.
+        tmp_path = self.path.with_name(f".{self.path.name}.tmp")
+        tmp_path.write_text(text, encoding="utf-8")
+        os.replace(tmp_path, self.path)
+        log.info(summarize(totals, self.previous, elapsed, self.interval))
+        if totals["curated"] == self.previous["curated"]:
+            log.warning(f"No containers curated in the last {self.interval}s")
+        self.previous = totals
+        return totals
+
+    def start_thread(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        """Stop the writer thread and write the final metrics."""
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+        self.write()
+
+
+def get_metrics_path(curator: c.HierarchyCurator) -> Path:
+    """Path to write the metrics to.
+
+    `config.metrics_path`, defaulting to `metrics.json` next to the report
+    path.  Use a `.prom` extension for the Prometheus text format.
+    """
+    path = get_config_option(curator, "metrics_path")
+    if path:
+        return Path(path)
+    return Path(curator.config.path).parent / "metrics.json"
+
+
+def start_metrics(
+    curator: c.HierarchyCurator, manager: t.Any
+) -> t.Optional[MetricsWriter]:
+    """Start collecting metrics if `config.metrics_interval` is set."""
+    interval = get_config_option(curator, "metrics_interval")
+    if not interval:
+        set_metrics(None)
+        return None
+    shared = manager.dict()
+    set_metrics(Metrics("main", shared, publish_interval=interval / 2))
+    writer = MetricsWriter(shared, get_metrics_path(curator), interval)
+    writer.start_thread()
+    log.info(f"Writing metrics to {writer.path} every {interval}s")
+    return writer
+
+
+def stop_metrics(writer: t.Optional[MetricsWriter]) -> None:
+    """Write the final metrics."""
+    if writer:
+        writer.stop()
+        set_metrics(None)
@@ -0,0 +1,142 @@
+"""Installs of the curator `extra_packages` from a wheel cache.
+
+The gear toolkit pip installs each of the `extra_packages` of a curator when
+it is instantiated, downloading (and possibly building) them on every job.
+With the `package_cache` option set to a directory, e.g. a mounted volume
+shared by the jobs, the packages are instead:
+
+* not installed at all if the installed distributions already satisfy them,
+* installed offline from wheels cached under a key hashing the list of
+  packages, the Python version and the platform,
+* or, the first time, built into wheels saved to the cache, then installed
+  from them.
+
+Wheels are built in a temporary directory and moved into place, so that jobs
+sharing the cache never install from a partial set of wheels.  The time taken
+is logged in every case.
+"""
+import contextlib
+import hashlib
+import importlib
+import importlib.metadata
+import json
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import sysconfig
+import tempfile
+import time
+import typing as t
+from pathlib import Path
+
+from flywheel_gear_toolkit.utils import curator as c
+from flywheel_gear_toolkit.utils import datatypes
+
+log = logging.getLogger(__name__)
+
+
+def cache_key(packages: t.List[str]) -> str:
+    """Key of the wheels of a list of packages."""
+    spec = {
+        "packages": packages,
+        "python": f"{sys.version_info.major}.{sys.version_info.minor}",
+        "platform": sysconfig.get_platform(),
+    }
+    return hashlib.sha256(json.dumps(spec).encode()).hexdigest()[:16]
+
+
+def is_satisfied(packages: t.List[str]) -> bool:
+    """Whether installed distributions satisfy each requirement."""
+    try:
+        # pylint: disable=import-outside-toplevel
+        from packaging.requirements import InvalidRequirement, Requirement
+    except ImportError:
+        return False
+    for package in packages:
+        try:
+            requirement = Requirement(package)
+            if requirement.marker and not requirement.marker.evaluate():
+                continue
+            version = importlib.metadata.version(requirement.name)
+        except (InvalidRequirement, importlib.metadata.PackageNotFoundError):
+            return False
+        if requirement.url or not requirement.specifier.contains(
+            version, prereleases=True
+        ):
+            return False
+    return True
+
+
+def run_pip(*args: str) -> None:
+    subprocess.run([sys.executable, "-m", "pip", *args], check=True)
+
+
+def build_wheels(packages: t.List[str], directory: Path) -> None:
+    """Build the wheels of packages and their dependencies into a directory."""
+    directory.parent.mkdir(parents=True, exist_ok=True)
+    tmp_dir = tempfile.mkdtemp(prefix=f".{directory.name}-", dir=directory.parent)
+    try:
+        run_pip("wheel", "--wheel-dir", tmp_dir, *packages)
+        try:
+            os.rename(tmp_dir, directory)
+        except OSError:
+            # Built by another job in the meantime.
+            if not directory.is_dir():
+                raise
+    finally:
+        shutil.rmtree(tmp_dir, ignore_errors=True)
+
+
+def install_extra_packages(
+    packages: t.List[str], cache: t.Optional[datatypes.PathLike] = None
+) -> None:
+    """Install packages, from the wheel cache if one is given.
+
+    Raises:
+        subprocess.CalledProcessError: If pip failed.
+    """
+    start = time.perf_counter()
+    if is_satisfied(packages):
+        log.info(f"Extra packages {packages} are already installed")
+        return
+    if cache is None:
+        for package in packages:
+            run_pip("install", package)
+        source = "from the index"
+    else:
+        directory = Path(cache) / cache_key(packages)
+        if directory.is_dir():
+            source = f"from the wheels cached in {directory}"
+        else:
+            build_wheels(packages, directory)
+            source = f"from the index, caching wheels in {directory}"
+        run_pip("install", "--no-index", "--find-links", str(directory), *packages)
+    importlib.invalidate_caches()
+    elapsed = time.perf_counter() - start
+    log.info(f"Installed extra packages {packages} {source} in {elapsed:.1f}s")
+
+
+@contextlib.contextmanager
+def cached_installs(options: t.Optional[t.Dict[str, t.Any]]):
+    """Install the extra_packages of curators created in this context.
+
+    The install happens in the curator `__init__`, before engine options are
+    set on its config, so the cache is read from the gear options.
+    """
+    cache = (options or {}).get("package_cache")
+    original = c.Curator._install_extra_package
+
+    def _install_extra_package(self):
+        try:
+            install_extra_packages(self.extra_packages, cache)
+        except subprocess.CalledProcessError as exc:
+            log.error(f"Package installation failed: {exc}")
+            sys.exit(1)
+
+    c.Curator._install_extra_package = _install_extra_package
+    try:
+        yield
+    finally:
+        c.Curator._install_extra_package = original
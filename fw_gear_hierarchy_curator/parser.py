@@ -1,5 +1,36 @@
 """Flywheel gear context parser."""
 
+# Gear config keys that are set as engine options on the curator config.
+CURATOR_OPTIONS = [
+    "shard_index",
+    "shard_count",
+    "coordinator_address",
+    "coordinator_role",
+    "coordinator_authkey",
+    "time_budget",
+    "priority",
+    "feed_state",
+    "report_batch_size",
+    "metrics_interval",
+    "metrics_path",
+    "trace",
+    "trace_path",
+    "api_accounting",
+    "profile",
+    "log_rate_limit",
+    "slow_threshold",
+    "start_method",
+    "client_threads",
+    "package_cache",
+    "frontier_size",
+    "max_containers_per_worker",
+    "max_worker_rss",
+    "parallel_level",
+]
+# Boolean options that are only set when true, so that a false value from the
+# gear config doesn't turn off what the curator enabled in its own config.
+CURATOR_FLAGS = ["trace", "api_accounting", "profile"]
+
 
 def parse_config(gear_context):
     """Parse gear config.
@@ -31,3 +62,72 @@ def parse_config(gear_context):
         "additional_input_three": input_file_three,
     }
     return parent, curator_path, input_files
+
+
+def parse_query(gear_context):
+    """Parse query mode options from the gear config.
+
+    Args:
+        gear_context (flywheel_gear_toolkit.GearToolkitContext): context
+
+    Returns:
+        (dict or None): Keyword arguments for `curate.query_main`, or None if
+            no query was configured.
+    """
+    query = gear_context.config.get("query")
+    file_query = gear_context.config.get("file_query")
+    if not (query or file_query):
+        return None
+    return {
+        "container_type": gear_context.config.get("query_type", "acquisition"),
+        "query": query,
+        "file_query": file_query,
+    }
+
+
+def parse_feed(gear_context):
+    """Parse change-feed mode options from the gear config.
+
+    Args:
+        gear_context (flywheel_gear_toolkit.GearToolkitContext): context
+
+    Returns:
+        (dict or None): Keyword arguments for `feed.feed_main`, or None if
+            no feed interval was configured.
+    """
+    interval = gear_context.config.get("feed_interval")
+    if not interval:
+        return None
+    return {
+        "interval": interval,
+        "container_type": gear_context.config.get("query_type", "acquisition"),
+        "query": gear_context.config.get("query"),
+        "file_query": gear_context.config.get("file_query"),
+    }
+
+
+def parse_options(gear_context):
+    """Parse engine options to set on the curator config from the gear config.
+
+    Args:
+        gear_context (flywheel_gear_toolkit.GearToolkitContext): context
+
+    Returns:
+        (dict): Options that are set in the gear config.
+
+    Raises:
+        ValueError: If resuming from a journal with `parallel_level` set.
+    """
+    options = {
+        key: gear_context.config[key]
+        for key in CURATOR_OPTIONS
+        if gear_context.config.get(key) is not None
+        and not (key in CURATOR_FLAGS and gear_context.config[key] is False)
+    }
+    resume_journal = gear_context.get_input_path("resume-journal")
+    if resume_journal:
+        if options.get("parallel_level"):
+            # The journal has no snapshots of the curator data to resume from.
+            raise ValueError("parallel_level can't be used with a resume-journal")
+        options["resume_journal"] = resume_journal
+    return options
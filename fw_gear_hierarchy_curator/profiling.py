@@ -0,0 +1,165 @@
+"""Opt-in profiling of the worker processes.
+
+With `config.profile` set, each worker runs under `cProfile` and dumps its
+stats to its own file when it finishes.  The main process merges them into
+`profile.prof` in the output directory, which can be loaded with `pstats` or
+viewers like snakeviz, and into `profile.collapsed`, the collapsed stack
+format read by flamegraph.pl and speedscope.
+
+cProfile records callers rather than full stacks, so the collapsed stacks are
+rebuilt from the call graph, splitting the time of a function between its
+callers in proportion to the time spent in it from each caller.
+"""
+import cProfile
+import logging
+import pstats
+import typing as t
+from pathlib import Path
+
+from flywheel_gear_toolkit.utils import curator as c
+from flywheel_gear_toolkit.utils import datatypes
+
+from .utils import get_config_option
+
+log = logging.getLogger(__name__)
+
+# Stacks deeper than this are cut when rebuilding the collapsed stacks.
+MAX_DEPTH = 100
+
+# Profiler of the current process, with the path to dump it to, if enabled.
+_profiler: t.Optional[t.Tuple[cProfile.Profile, Path]] = None
+
+# pstats function key, (filename, line number, function name)
+Func = t.Tuple[str, int, str]
+
+
+def get_profile_dir(curator: c.HierarchyCurator) -> Path:
+    """Directory to write the profile to, next to the report path."""
+    return Path(curator.config.path).parent
+
+
+def worker_profile_path(directory: datatypes.PathLike, worker_id: t.Any) -> Path:
+    """Path of the stats of one worker, e.g. `profile.worker-0.prof`."""
+    return Path(directory) / f"profile.worker-{worker_id}.prof"
+
+
+def start_worker_profiling(local_curator: c.HierarchyCurator, worker_id: t.Any):
+    """Start profiling a worker process if `config.profile` is set."""
+    global _profiler  # pylint: disable=global-statement
+    _profiler = None
+    if not get_config_option(local_curator, "profile"):
+        return
+    profiler = cProfile.Profile()
+    _profiler = (
+        profiler,
+        worker_profile_path(get_profile_dir(local_curator), worker_id),
+    )
+    profiler.enable()
+
+
+def stop_worker_profiling() -> None:
+    """Stop profiling a worker process and dump its stats."""
+    global _profiler  # pylint: disable=global-statement
+    if _profiler is None:
+        return
+    profiler, path = _profiler
+    _profiler = None
+    profiler.disable()
+    profiler.dump_stats(str(path))
+
+
+def frame_name(func: Func) -> str:
+    """Name of a function in a collapsed stack, e.g. `curate (curator.py:10)`."""
+    filename, lineno, name = func
+    if filename == "~":
+        # Built-in
+        label = name
+    else:
+        label = f"{name} ({Path(filename).name}:{lineno})"
+    # Semicolons separate frames and spaces the count in the collapsed format.
+    return label.replace(";", ":").replace(" ", "_")
+
+
+def collapse_stacks(stats: pstats.Stats) -> t.Dict[str, float]:
+    """Rebuild stacks with the time spent in their last function, in seconds.
+
+    Starts from the functions without a profiled caller.  A function reached
+    through a stack gets the share of its time that was spent in calls from
+    the previous function in the stack.  Recursive calls are folded into the
+    first occurrence of the function in the stack.
+    """
+    entries = stats.stats  # type: ignore[attr-defined]
+    callees: t.Dict[Func, t.Dict[Func, float]] = {}
+    for func, (_, _, _, _, callers) in entries.items():
+        for caller, edge in callers.items():
+            # Cumulative time spent in func when called from caller
+            callees.setdefault(caller, {})[func] = edge[3]
+    roots = [
+        func
+        for func, (_, _, _, _, callers) in entries.items()
+        if not any(caller in entries for caller in callers)
+    ]
+    stacks: t.Dict[str, float] = {}
+
+    def walk(func: Func, stack: t.List[Func], fraction: float) -> None:
+        stack = [*stack, func]
+        key = ";".join(frame_name(frame) for frame in stack)
+        self_time = entries[func][2] * fraction
+        if self_time > 0:
+            stacks[key] = stacks.get(key, 0) + self_time
+        if len(stack) >= MAX_DEPTH:
+            return
+        for callee, edge_time in callees.get(func, {}).items():
+            total = entries[callee][3]
+            if callee in stack or total <= 0 or edge_time * fraction <= 1e-6:
+                continue
+            walk(callee, stack, fraction * edge_time / total)
+
+    for root in roots:
+        walk(root, [], 1.0)
+    return stacks
+
+
+def write_collapsed(stats: pstats.Stats, path: datatypes.PathLike) -> None:
+    """Write stacks in the collapsed format, with counts in microseconds."""
+    with open(path, "w", encoding="utf-8") as fp:
+        for stack, seconds in sorted(collapse_stacks(stats).items()):
+            count = round(seconds * 1e6)
+            if count:
+                fp.write(f"{stack} {count}\n")
+
+
+def merge_profiles(
+    paths: t.Sequence[datatypes.PathLike], directory: datatypes.PathLike
+) -> t.Optional[pstats.Stats]:
+    """Merge stats files into `profile.prof` and `profile.collapsed`."""
+    if not paths:
+        return None
+    stats = pstats.Stats(str(paths[0]))
+    for path in paths[1:]:
+        stats.add(str(path))
+    directory = Path(directory)
+    stats.dump_stats(str(directory / "profile.prof"))
+    write_collapsed(stats, directory / "profile.collapsed")
+    return stats
+
+
+def start_profiling(curator: c.HierarchyCurator) -> t.Optional[Path]:
+    """Directory the workers' profiles will be merged into, if enabled."""
+    if not get_config_option(curator, "profile"):
+        return None
+    directory = get_profile_dir(curator)
+    log.info(f"Profiling workers to {directory / 'profile.prof'}")
+    return directory
+
+
+def stop_profiling(directory: t.Optional[Path], workers: int) -> None:
+    """Merge the stats of the workers and remove their files."""
+    if directory is None:
+        return
+    paths = [worker_profile_path(directory, i) for i in range(workers)]
+    paths = [path for path in paths if path.exists()]
+    merge_profiles(paths, directory)
+    for path in paths:
+        path.unlink()
+    log.info(f"Merged the profiles of {len(paths)} workers into {directory}")
@@ -0,0 +1,77 @@
+"""Recycling of workers whose memory grows over long runs.
+
+Curators loading DICOMs or NIfTIs, or caching per-container data, can make a
+worker grow until the job is killed, and memory freed by Python is seldom
+returned to the system.  When `config.max_containers_per_worker` or
+`config.max_worker_rss` (in MiB) is set, a worker checks its limits after each
+unit of work.  Once one is reached, it hands the units it didn't start to the
+main process and exits with `EXIT_CODE`, and the main process starts a fresh
+worker, with a new ID, on them.
+
+A worker always finishes the unit it started, so a unit is never curated
+twice, and it handles at least one unit before exiting, so that a worker
+started over the limit still makes progress.
+"""
+import logging
+import typing as t
+
+from flywheel_gear_toolkit.utils import curator as c
+
+from .state import memory_usage
+from .utils import get_config_option
+
+log = logging.getLogger(__name__)
+
+# Exit code of a worker that handed its work off to a replacement (EX_TEMPFAIL).
+EXIT_CODE = 75
+
+# Containers curated by this process.
+_curated = 0
+
+
+def record_container() -> None:
+    """Count a container curated by this process."""
+    global _curated
+    _curated += 1
+
+
+def curated() -> int:
+    """Number of containers curated by this process."""
+    return _curated
+
+
+class Limits:
+    """Limits after which a worker is replaced.
+
+    Args:
+        max_containers: Containers a worker curates before it is replaced.
+        max_rss: Resident memory, in bytes, above which a worker is replaced.
+    """
+
+    def __init__(
+        self, max_containers: t.Optional[int] = None, max_rss: t.Optional[int] = None
+    ) -> None:
+        self.max_containers = max_containers
+        self.max_rss = max_rss
+
+    @classmethod
+    def from_curator(cls, curator: c.HierarchyCurator) -> t.Optional["Limits"]:
+        """Create from `config.max_containers_per_worker` and
+        `config.max_worker_rss`, or return None if neither is set.
+        """
+        max_containers = get_config_option(curator, "max_containers_per_worker")
+        max_rss = get_config_option(curator, "max_worker_rss")
+        if not (max_containers or max_rss):
+            return None
+        return cls(max_containers or None, int(max_rss * 2**20) if max_rss else None)
+
+    def reached(self) -> t.Optional[str]:
+        """Describe the limit this process reached, or return None."""
+        if self.max_containers and curated() >= self.max_containers:
+            return f"Curated {curated()} containers"
+        if self.max_rss:
+            usage = memory_usage()
+            rss = usage.get("rss", usage["peak_rss"])
+            if rss >= self.max_rss:
+                return f"Using {rss / 2**20:.1f}MB"
+        return None
@@ -0,0 +1,416 @@
+"""Utilities for report files written by the curator."""
+import argparse
+import csv
+import dataclasses
+import gzip
+import importlib
+import json
+import logging
+import typing as t
+from pathlib import Path
+
+from flywheel_gear_toolkit.utils import datatypes, reporters
+
+log = logging.getLogger(__name__)
+
+# Records buffered by a BatchedReporter before they are written out.
+DEFAULT_BATCH_SIZE = 1000
+# Rows written at once by a StreamingReporter (one Parquet row group).
+DEFAULT_ROW_GROUP_SIZE = 10000
+
+# Report types written by a StreamingReporter
+STREAMING_TYPES = ["csv.gz", "csv.zst", "parquet"]
+REPORT_TYPES = ["csv", "json", *STREAMING_TYPES]
+
+# Arrow type names of the log record field types, others are written as strings.
+ARROW_TYPES = {str: "string", bool: "bool_", int: "int64", float: "float64"}
+
+
+def report_type(path: datatypes.PathLike) -> str:
+    """Return the type of a report from its extension, e.g. `csv.gz`."""
+    name = Path(path).name
+    # Longest match first, so that `csv.gz` isn't read as `gz`.
+    for type_ in sorted(REPORT_TYPES, key=len, reverse=True):
+        if name.endswith(f".{type_}"):
+            return type_
+    return Path(path).suffix[1:]
+
+
+def tag_report_path(path: datatypes.PathLike, tag: str) -> Path:
+    """Insert a tag before the report extension, e.g. `output.<tag>.csv.gz`."""
+    path = Path(path)
+    type_ = report_type(path)
+    stem = path.name[: -len(type_) - 1] if type_ else path.name
+    return path.with_name(f"{stem}.{tag}.{type_}" if type_ else f"{stem}.{tag}")
+
+
+def shard_report_path(
+    path: datatypes.PathLike, shard_index: int, shard_count: int
+) -> Path:
+    """Return the report path for one shard, e.g. `output.shard-0-of-4.csv`."""
+    return tag_report_path(path, f"shard-{shard_index}-of-{shard_count}")
+
+
+def worker_report_path(path: datatypes.PathLike, worker_id: t.Any) -> Path:
+    """Return the report path for one worker, e.g. `output.worker-0.csv`."""
+    return tag_report_path(path, f"worker-{worker_id}")
+
+
+def is_streaming_report(path: datatypes.PathLike) -> bool:
+    """Whether a report path needs a `StreamingReporter`."""
+    return report_type(path) in STREAMING_TYPES
+
+
+def make_reporter(
+    path: datatypes.PathLike,
+    format: t.Type[reporters.BaseLogRecord] = reporters.LogRecord,
+    queue: t.Optional[t.Any] = None,
+) -> reporters.AggregatedReporter:
+    """Create the reporter for a report path, streaming if the type needs it."""
+    if is_streaming_report(path):
+        return StreamingReporter(path, format=format, queue=queue)
+    return reporters.AggregatedReporter(path, format=format, queue=queue)
+
+
+def _import_optional(module: str, type_: str) -> t.Any:
+    try:
+        return importlib.import_module(module)
+    except ImportError as exc:
+        raise ImportError(
+            f"{module} is required to write {type_} reports, add it to the "
+            "curator's extra_packages"
+        ) from exc
+
+
+def arrow_schema(format: t.Type[reporters.BaseLogRecord]) -> t.Any:
+    """Arrow schema of the fields of a log record dataclass."""
+    pa = _import_optional("pyarrow", "parquet")
+    types = t.get_type_hints(format)
+    return pa.schema(
+        [
+            (field.name, getattr(pa, ARROW_TYPES.get(types[field.name], "string"))())
+            for field in dataclasses.fields(format)
+        ]
+    )
+
+
+def _open_csv(path: Path, type_: str, mode: str) -> t.IO[str]:
+    """Open a plain or compressed CSV report in text mode."""
+    if type_ == "csv.zst":
+        open_fn = _import_optional("zstandard", type_).open
+    elif type_ == "csv.gz":
+        open_fn = gzip.open
+    else:
+        open_fn = open
+    return open_fn(path, mode, encoding="utf-8", newline="")
+
+
+class _CSVStream:
+    """Compressed CSV file, written a batch of rows at a time."""
+
+    def __init__(self, path: Path, type_: str, keys: t.List[str]) -> None:
+        self.fp = _open_csv(path, type_, "wt")
+        self.writer = csv.writer(self.fp)
+        self.writer.writerow(keys)
+
+    def write_rows(self, rows: t.List[t.List[t.Any]]) -> None:
+        self.writer.writerows(rows)
+
+    def close(self) -> None:
+        self.fp.close()
+
+
+class _ParquetStream:
+    """Parquet file, written one row group at a time."""
+
+    def __init__(self, path: Path, format: t.Type[reporters.BaseLogRecord]) -> None:
+        self.pa = _import_optional("pyarrow", "parquet")
+        parquet = _import_optional("pyarrow.parquet", "parquet")
+        self.schema = arrow_schema(format)
+        self.writer = parquet.ParquetWriter(path, self.schema)
+
+    def write_rows(self, rows: t.List[t.List[t.Any]]) -> None:
+        columns = list(zip(*rows))
+        arrays = []
+        for field, column in zip(self.schema, columns):
+            if self.pa.types.is_string(field.type):
+                column = [None if val is None else str(val) for val in column]
+            arrays.append(self.pa.array(column, type=field.type))
+        self.writer.write_table(self.pa.Table.from_arrays(arrays, schema=self.schema))
+
+    def close(self) -> None:
+        self.writer.close()
+
+
+class BatchedReporter(reporters.AggregatedReporter):
+    """Reporter buffering records and writing them to its own file in batches.
+
+    Unlike the `AggregatedReporter` with a queue, which sends every record to a
+    writer process through a manager, each process writes its own report file
+    with one `open` per batch.  The files are combined with `merge_reports`
+    once the workers are done.
+
+    Args:
+        output_path: Path of the report written by this reporter.
+        format: Dataclass representing log entry fields.
+        batch_size: Number of records to buffer before writing.
+    """
+
+    def __init__(
+        self,
+        output_path: datatypes.PathLike,
+        format: t.Type[reporters.BaseLogRecord] = reporters.LogRecord,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        self.buffer: t.List[t.Any] = []
+        self.batch_size = batch_size
+        # Don't touch the file from __del__ if initialization fails.
+        self.closed = True
+        super().__init__(output_path, format=format)
+        self.closed = False
+
+    def __del__(self):
+        self.close()
+
+    def write(self, to_write: t.Any) -> None:
+        """Buffer a row, writing the buffer out once it is full."""
+        self.buffer.append(to_write)
+        if len(self.buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered rows to the report file."""
+        if not self.buffer:
+            return
+        with open(
+            self.output_path,
+            mode="a",
+            encoding="utf-8",
+            newline=("" if self.output_type == "csv" else None),
+        ) as fp:
+            for to_write in self.buffer:
+                self.writer_fn(fp, to_write)
+        self.buffer = []
+
+    def close(self) -> None:
+        """Terminate the report and write out buffered rows."""
+        if self.closed:
+            return
+        self.closed = True
+        if self.output_type == "json":
+            self.buffer.append("]")
+        self.flush()
+
+    def discard(self) -> None:
+        """Drop the buffered rows and close without writing, e.g. the copy of
+        the main process reporter inherited by a forked worker, whose rows the
+        main process writes itself.
+        """
+        self.buffer = []
+        self.closed = True
+
+
+class StreamingReporter(reporters.AggregatedReporter):
+    """Reporter streaming compressed CSV (`.csv.gz`, `.csv.zst`) or Parquet.
+
+    Rows are buffered and written `row_group_size` at a time to a file kept
+    open by the process writing the report, so memory use is bounded however
+    many records are reported.  The Parquet schema is inferred from the
+    annotations of the `format` dataclass.
+
+    Like `AggregatedReporter`, records are sent to `queue` if given, and
+    written by the process running `worker`.  The report is complete once
+    `close` is called, which `worker` does after the termination signal.
+
+    Args:
+        output_path: Path of the report, its type is inferred by extension.
+        format: Dataclass representing log entry fields.
+        queue: Queue to send records to the writer process.
+        row_group_size: Number of rows to buffer before writing.
+
+    Raises:
+        ValueError: When the type isn't a streaming type, or the path exists.
+        TypeError: If format is not a subclass of BaseLogRecord.
+    """
+
+    def __init__(
+        self,
+        output_path: datatypes.PathLike,
+        format: t.Type[reporters.BaseLogRecord] = reporters.LogRecord,
+        queue: t.Optional[t.Any] = None,
+        row_group_size: int = DEFAULT_ROW_GROUP_SIZE,
+    ) -> None:
+        # Set before validating so that __del__ never touches the file.
+        self.closed = True
+        self.queue = queue
+        self.output_path = Path(output_path)
+        self.output_type = report_type(self.output_path)
+        self.format = format
+        self.first_record = True
+        if not issubclass(self.format, reporters.BaseLogRecord):
+            raise TypeError("Log format must be a subclass of BaseLogRecord")
+        self.keys = list(self.format.keys())
+        if not self.keys:
+            raise ValueError(
+                f"No fields found in log format class {self.format.__name__}"
+            )
+        if self.output_type not in STREAMING_TYPES:
+            raise ValueError(
+                f"Expected one of {STREAMING_TYPES}, found {self.output_type}"
+            )
+        if self.output_path.exists():
+            raise ValueError("Log path exists already, won't overwrite")
+        self.rows: t.List[t.List[t.Any]] = []
+        self.row_group_size = row_group_size
+        # Opened by the process writing the report.
+        self.stream: t.Optional[t.Union[_CSVStream, _ParquetStream]] = None
+        self.closed = False
+
+    def __del__(self):
+        # With a queue, the writer process closes the report.
+        if not self.queue:
+            self.close()
+
+    def write_log(self, rec: t.Any) -> None:
+        """Write a record to the report."""
+        if not rec:
+            raise ValueError(f"Record must contain a dictionary to write, got '{rec}'")
+        self.write(list(rec.values()))
+
+    def _write(self, to_write: t.List[t.Any]) -> None:
+        self.rows.append(to_write)
+        if len(self.rows) >= self.row_group_size:
+            self.flush()
+
+    def flush(self) -> None:
+        """Write buffered rows to the report."""
+        if self.stream is None:
+            if self.output_type == "parquet":
+                self.stream = _ParquetStream(self.output_path, self.format)
+            else:
+                self.stream = _CSVStream(self.output_path, self.output_type, self.keys)
+        if self.rows:
+            self.stream.write_rows(self.rows)
+            self.rows = []
+
+    def close(self) -> None:
+        """Write out buffered rows and finish the report."""
+        if self.closed:
+            return
+        self.closed = True
+        self.flush()
+        self.stream.close()
+
+    def worker(self):
+        """Worker target for the writer process."""
+        super().worker()
+        self.close()
+
+
+def merge_reports(
+    paths: t.Iterable[datatypes.PathLike], output_path: datatypes.PathLike
+) -> int:
+    """Combine reports written by separate jobs (or shards) into one.
+
+    Reports must all be of the type of `output_path`, one of `REPORT_TYPES`.
+    CSV reports, compressed or not, must share the same header, and Parquet
+    reports the same schema.
+
+    Args:
+        paths: Reports to merge, in order.
+        output_path: Path of the merged report.
+
+    Returns:
+        int: Number of records written.
+
+    Raises:
+        ValueError: If the output exists, the types don't match or the CSV
+            headers or Parquet schemas differ.
+    """
+    output_path = Path(output_path)
+    paths = [Path(path) for path in paths]
+    output_type = report_type(output_path)
+    if output_path.exists():
+        raise ValueError("Report path exists already, won't overwrite")
+    if output_type not in REPORT_TYPES:
+        raise ValueError(f"Expected one of {REPORT_TYPES}, found {output_type}")
+    for path in paths:
+        if report_type(path) != output_type:
+            raise ValueError(f"Expected {output_type} report, found {path}")
+    if output_type == "parquet":
+        count = _merge_parquet(paths, output_path)
+    elif output_type == "json":
+        records = []
+        for path in paths:
+            with open(path, encoding="utf-8") as fp:
+                text = fp.read().strip()
+            # Reports from killed jobs may be missing their closing bracket.
+            if not text.endswith("]"):
+                text += "]"
+            records.extend(json.loads(text))
+        with open(output_path, "w", encoding="utf-8") as fp:
+            json.dump(records, fp, indent=4)
+        count = len(records)
+    else:
+        header = None
+        count = 0
+        with _open_csv(output_path, output_type, "wt") as out_fp:
+            writer = csv.writer(out_fp)
+            for path in paths:
+                with _open_csv(path, output_type, "rt") as fp:
+                    reader = csv.reader(fp)
+                    file_header = next(reader, None)
+                    if file_header is None:
+                        continue
+                    if header is None:
+                        header = file_header
+                        writer.writerow(header)
+                    elif file_header != header:
+                        raise ValueError(
+                            f"Header of {path} doesn't match {paths[0]}: "
+                            f"{file_header} != {header}"
+                        )
+                    for row in reader:
+                        writer.writerow(row)
+                        count += 1
+    log.info(f"Merged {count} records from {len(paths)} reports into {output_path}")
+    return count
+
+
+def _merge_parquet(paths: t.List[Path], output_path: Path) -> int:
+    """Copy the row groups of Parquet reports into one, returning the rows."""
+    parquet = _import_optional("pyarrow.parquet", "parquet")
+    writer = None
+    count = 0
+    try:
+        for path in paths:
+            parquet_file = parquet.ParquetFile(path)
+            if writer is None:
+                writer = parquet.ParquetWriter(output_path, parquet_file.schema_arrow)
+            elif not parquet_file.schema_arrow.equals(writer.schema):
+                raise ValueError(
+                    f"Schema of {path} doesn't match {paths[0]}: "
+                    f"{parquet_file.schema_arrow} != {writer.schema}"
+                )
+            for i in range(parquet_file.num_row_groups):
+                row_group = parquet_file.read_row_group(i)
+                writer.write_table(row_group)
+                count += row_group.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return count
+
+
+def main(argv: t.Optional[t.List[str]] = None) -> None:
+    """Command line interface to merge reports."""
+    parser = argparse.ArgumentParser(description="Merge curator reports.")
+    parser.add_argument("output", help="Path of the merged report.")
+    parser.add_argument("reports", nargs="+", help="Reports to merge.")
+    args = parser.parse_args(argv)
+    merge_reports(args.reports, args.output)
+
+
+if __name__ == "__main__":  # pragma: no cover
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,197 @@
+"""Scheduling of work units.
+
+Units can be ordered by `config.priority` so that the most valuable containers
+are curated first.
+
+Gear jobs are killed at a hard time limit.  When `config.deadline` (or
+`config.time_budget`) is set, workers stop starting new units once the time
+remaining is less than the projected duration of the next unit, and the units
+that weren't started are written to a resume journal which can be passed to a
+follow-up job.
+"""
+import datetime
+import json
+import logging
+import statistics
+import time
+import typing as t
+from pathlib import Path
+
+from flywheel_gear_toolkit.utils import curator as c
+from flywheel_gear_toolkit.utils import datatypes
+
+from .utils import get_config_option, handle_work
+
+log = logging.getLogger(__name__)
+
+# Seconds kept in reserve to drain workers, flush the report and write the
+# journal.
+DEFAULT_MARGIN = 60
+
+
+def _file_count(container: datatypes.Container) -> t.Optional[int]:
+    files = getattr(container, "files", None)
+    return None if files is None else len(files)
+
+
+# Built-in priorities, name: (key, reverse)
+PRIORITIES: t.Dict[str, t.Tuple[t.Callable[[datatypes.Container], t.Any], bool]] = {
+    "modified_desc": (lambda container: getattr(container, "modified", None), True),
+    "created_desc": (lambda container: getattr(container, "created", None), True),
+    "file_count_desc": (_file_count, True),
+}
+
+
+def order_by_priority(
+    curator: c.HierarchyCurator, containers: t.Iterable[datatypes.Container]
+) -> t.List[datatypes.Container]:
+    """Order containers by `config.priority`.
+
+    `config.priority` is either the name of a built-in priority (see
+    `PRIORITIES`), or a callable taking a container and returning a key to sort
+    on in ascending order, as with `sorted()`.  Containers whose key is `None`
+    are placed last, and ties keep their original order.
+    """
+    containers = list(containers)
+    priority = get_config_option(curator, "priority")
+    if priority is None:
+        return containers
+    reverse = False
+    if isinstance(priority, str):
+        try:
+            priority, reverse = PRIORITIES[priority]
+        except KeyError:
+            raise ValueError(
+                f"Expected priority to be a callable or one of "
+                f"{list(PRIORITIES)}, found {priority}"
+            )
+    keyed = [(priority(container), container) for container in containers]
+    known = sorted(
+        [item for item in keyed if item[0] is not None],
+        key=lambda item: item[0],
+        reverse=reverse,
+    )
+    unknown = [container for key, container in keyed if key is None]
+    log.info(f"Ordered {len(containers)} units by priority")
+    return [container for _, container in known] + unknown
+
+
+class Deadline:
+    """Track the time left before a deadline and decide when to stop.
+
+    Args:
+        deadline: Deadline as a POSIX timestamp.
+        margin: Seconds to keep in reserve before the deadline.
+    """
+
+    def __init__(self, deadline: float, margin: float = DEFAULT_MARGIN) -> None:
+        self.deadline = deadline
+        self.margin = margin
+        self.durations: t.List[float] = []
+
+    @classmethod
+    def from_curator(cls, curator: c.HierarchyCurator) -> t.Optional["Deadline"]:
+        """Create from `config.deadline`, or return None if it isn't set."""
+        deadline = get_config_option(curator, "deadline")
+        if deadline is None:
+            return None
+        if isinstance(deadline, datetime.datetime):
+            deadline = deadline.timestamp()
+        return cls(
+            float(deadline),
+            get_config_option(curator, "deadline_margin", DEFAULT_MARGIN),
+        )
+
+    def remaining(self) -> float:
+        """Seconds left before the deadline, less the margin."""
+        return self.deadline - time.time() - self.margin
+
+    def record(self, duration: float) -> None:
+        """Record how long a unit took."""
+        self.durations.append(duration)
+
+    def projected(self) -> float:
+        """Projected duration of the next unit.
+
+        The mean of past unit durations, or 0 if no unit has completed yet.
+        """
+        if not self.durations:
+            return 0
+        return statistics.mean(self.durations)
+
+    def should_stop(self) -> bool:
+        """Whether the next unit is projected to not finish before the deadline."""
+        remaining = self.remaining()
+        return remaining <= 0 or remaining < self.projected()
+
+
+def resolve_deadline(curator: c.HierarchyCurator, start: float) -> None:
+    """Set `config.deadline` from `config.time_budget` (seconds from `start`)."""
+    time_budget = get_config_option(curator, "time_budget")
+    if time_budget and get_config_option(curator, "deadline") is None:
+        curator.config.deadline = start + time_budget
+    deadline = get_config_option(curator, "deadline")
+    if deadline is not None:
+        if isinstance(deadline, (int, float)):
+            deadline = datetime.datetime.fromtimestamp(deadline)
+        log.info(f"Curation will stop starting new work before {deadline}")
+
+
+def handle_work_until_deadline(
+    work: t.List[t.Dict[str, str]],
+    local_curator: c.HierarchyCurator,
+    handle: t.Callable[[c.HierarchyCurator, t.List[datatypes.Container]], None],
+    deadline: t.Optional[Deadline],
+    stop: t.Optional[t.Callable[[], t.Any]] = None,
+) -> t.List[t.Dict[str, str]]:
+    """Handle each unit of work separately until the deadline approaches.
+
+    Args:
+        stop: Also stop when this returns true, checked after each unit, e.g.
+            `recycling.Limits.reached`.
+
+    Returns:
+        list: Units that weren't started.
+    """
+    for i, unit in enumerate(work):
+        if deadline and deadline.should_stop():
+            log.warning(
+                f"{deadline.remaining():.0f}s left before deadline, projected "
+                f"{deadline.projected():.0f}s for next unit. Stopping with "
+                f"{len(work) - i} units left."
+            )
+            return work[i:]
+        if i and stop and stop():
+            return work[i:]
+        start = time.monotonic()
+        handle_work([unit], local_curator, handle)
+        if deadline:
+            deadline.record(time.monotonic() - start)
+    return []
+
+
+def get_journal_path(curator: c.HierarchyCurator) -> Path:
+    """Path to write the resume journal to.
+
+    `config.journal_path`, defaulting to `resume_journal.json` next to the
+    report path.
+    """
+    path = get_config_option(curator, "journal_path")
+    if path:
+        return Path(path)
+    return Path(curator.config.path).parent / "resume_journal.json"
+
+
+def write_journal(path: datatypes.PathLike, units: t.List[t.Dict[str, str]]) -> None:
+    """Write units that weren't curated to a resume journal."""
+    with open(path, "w", encoding="utf-8") as fp:
+        json.dump({"units": units}, fp, indent=4)
+    log.info(f"Wrote {len(units)} units left to curate to resume journal {path}")
+
+
+def read_journal(path: datatypes.PathLike) -> t.List[t.Dict[str, str]]:
+    """Read units to curate from a resume journal."""
+    with open(path, encoding="utf-8") as fp:
+        units = json.load(fp)["units"]
+    log.info(f"Resuming {len(units)} units from journal {path}")
+    return units
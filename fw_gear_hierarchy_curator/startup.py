@@ -0,0 +1,123 @@
+"""How worker processes are started, and how long they take to start.
+
+By default workers are forked from the main process.  That is fast, but the
+main process may by then be large and run threads (log listener, metrics
+writer, ...), which forked workers inherit a copy of, locks included.
+
+With the `forkserver` start method, a small server process is started early,
+imports the heavy modules (the SDK, pandas, pydicom, ...) and the curator
+module once, and each worker, including workers started later on, is forked
+from it.  Workers then only unpickle their arguments before they are ready.
+With `spawn`, each worker starts a new interpreter and imports everything
+itself, which is the slowest but shares nothing with the main process.
+
+Each worker logs the time from its launch by the main process until it was
+ready, and until it curated its first container.
+"""
+import contextlib
+import logging
+import multiprocessing
+import multiprocessing.forkserver
+import sys
+import time
+import typing as t
+from pathlib import Path
+
+from flywheel_gear_toolkit.utils import curator as c
+
+from .utils import get_config_option
+
+log = logging.getLogger(__name__)
+
+START_METHODS = ("fork", "forkserver", "spawn")
+
+# Imported once by the fork server, modules that aren't installed are skipped.
+PRELOAD_MODULES = [
+    "flywheel",
+    "flywheel_gear_toolkit",
+    "flywheel_gear_toolkit.utils.curator",
+    "numpy",
+    "pandas",
+    "pydicom",
+    "nibabel",
+    "fw_gear_hierarchy_curator.curate",
+]
+
+# Time the main process launched this worker, None in the main process.
+_launched: t.Optional[float] = None
+
+
+def curator_module(curator: c.HierarchyCurator) -> t.Optional[str]:
+    """Make the module of the curator importable by workers, return its name.
+
+    Curators are loaded from a file whose directory is only on `sys.path`
+    while it is imported.  Workers that aren't forked unpickle the curator,
+    so they need to import its module again.
+    """
+    name = type(curator).__module__
+    module = sys.modules.get(name)
+    path = getattr(module, "__file__", None)
+    if name == "__main__" or not path:
+        return None
+    directory = str(Path(path).parent)
+    if directory not in sys.path:
+        sys.path.append(directory)
+    return name
+
+
+def set_start_method(curator: c.HierarchyCurator) -> str:
+    """Set how workers are started from `config.start_method`.
+
+    With `forkserver`, the server is started right away, so that it imports
+    the preloaded modules while the main process walks the run container.
+    """
+    method = get_config_option(curator, "start_method", "fork")
+    if method not in START_METHODS:
+        raise ValueError(f"Expected start_method in {START_METHODS}, found {method}")
+    multiprocessing.set_start_method(method, force=True)
+    if method == "fork":
+        return method
+    module = curator_module(curator)
+    if method == "forkserver":
+        preload = PRELOAD_MODULES + ([module] if module else [])
+        multiprocessing.set_forkserver_preload(preload)
+        multiprocessing.forkserver.ensure_running()
+    log.info(f"Starting workers with {method}")
+    return method
+
+
+@contextlib.contextmanager
+def detached_client(curator: c.HierarchyCurator):
+    """Leave the SDK client out of the curator pickled for workers not forked.
+
+    The client can't be pickled, workers create their own.
+    """
+    if multiprocessing.get_start_method() == "fork":
+        yield
+        return
+    client = getattr(curator.context, "_client", None)
+    curator.context._client = None
+    try:
+        yield
+    finally:
+        curator.context._client = client
+
+
+def start_worker_clock(launched: t.Optional[float]) -> None:
+    """Keep the time the main process launched this worker."""
+    global _launched
+    _launched = launched if launched is not None else time.time()
+
+
+def since_launch() -> float:
+    """Seconds since this worker was launched."""
+    return time.time() - _launched if _launched is not None else 0.0
+
+
+def record_first_container(log: logging.Logger) -> None:
+    """Log the time to the first container curated by this worker."""
+    global _launched
+    if _launched is None:
+        return
+    log.info(f"Curated first container {since_launch():.3f}s after launch")
+    _launched = None
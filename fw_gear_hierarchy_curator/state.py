@@ -0,0 +1,150 @@
+"""Sharing the curator `data` built before distribution with the workers.
+
+Each worker used to deep copy the curator, and with it everything stored in
+`self.data` by the curation of the run container, e.g. a DataFrame loaded from
+an input.  That costs time at startup and one copy of the data per worker.
+
+Forked workers already have a private, copy-on-write image of the main
+process, so they now only make a shallow copy of the curator: `self.data` is
+shared with the main process until a worker changes it, and only the pages it
+changes are copied.
+
+Workers that are not forked receive the curator pickled.  For them, the main
+process pickles `self.data` once to a temporary file with protocol 5, storing
+the buffers of arrays (numpy arrays and the blocks of DataFrames) out of band.
+Each worker memory maps the file read-only and unpickles the data with arrays
+backed by the map, so the arrays are shared between the workers and can't be
+changed.
+"""
+import contextlib
+import copy
+import logging
+import mmap
+import multiprocessing
+import os
+import pickle
+import resource
+import struct
+import tempfile
+import typing as t
+from pathlib import Path
+
+from flywheel_gear_toolkit.utils import curator as c
+
+log = logging.getLogger(__name__)
+
+# Header of the shared data file: length of the pickle, number of buffers.
+_HEADER = struct.Struct("<QQ")
+_LENGTH = struct.Struct("<Q")
+
+
+class SharedData:
+    """Curator data pickled to a file for workers that are not forked.
+
+    Args:
+        path: File the data was written to with `write`.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+
+    @classmethod
+    def write(cls, data: t.Any) -> "SharedData":
+        """Pickle data to a temporary file, with array buffers out of band."""
+        buffers: t.List[pickle.PickleBuffer] = []
+        payload = pickle.dumps(data, protocol=5, buffer_callback=buffers.append)
+        fd, path = tempfile.mkstemp(prefix="curator-data-")
+        with os.fdopen(fd, "wb") as fp:
+            fp.write(_HEADER.pack(len(payload), len(buffers)))
+            for buffer in buffers:
+                fp.write(_LENGTH.pack(buffer.raw().nbytes))
+            fp.write(payload)
+            for buffer in buffers:
+                fp.write(buffer.raw())
+        return cls(path)
+
+    def read(self) -> t.Any:
+        """Unpickle the data, with arrays backed by a read-only map of the file."""
+        with open(self.path, "rb") as fp:
+            view = memoryview(mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ))
+        size, count = _HEADER.unpack_from(view)
+        offset = _HEADER.size
+        lengths = []
+        for _ in range(count):
+            lengths.append(_LENGTH.unpack_from(view, offset)[0])
+            offset += _LENGTH.size
+        payload = view[offset : offset + size]
+        offset += size
+        buffers = []
+        for length in lengths:
+            buffers.append(view[offset : offset + length])
+            offset += length
+        return pickle.loads(payload, buffers=buffers)
+
+    def remove(self) -> None:
+        Path(self.path).unlink(missing_ok=True)
+
+
+def share_data(curator: c.HierarchyCurator) -> t.Optional[SharedData]:
+    """Write the curator data for the workers if they won't be forked."""
+    if multiprocessing.get_start_method() == "fork" or not curator.data:
+        return None
+    return SharedData.write(curator.data)
+
+
+@contextlib.contextmanager
+def detached_data(curator: c.HierarchyCurator, shared: t.Optional[SharedData]):
+    """Leave the data out of the curator pickled for workers that get `shared`."""
+    if shared is None:
+        yield
+        return
+    data = curator.data
+    curator.data = {}
+    try:
+        yield
+    finally:
+        curator.data = data
+
+
+def make_local_curator(
+    curator: c.HierarchyCurator, shared: t.Optional[SharedData] = None
+) -> c.HierarchyCurator:
+    """Copy of the curator for a worker, sharing its data.
+
+    Attributes are copied shallowly, like `HierarchyCurator.__deepcopy__`
+    does except for `data`, which is shared copy-on-write with the main
+    process in forked workers, or read from `shared` otherwise.
+    """
+    local_curator = copy.copy(curator)
+    if shared is not None:
+        local_curator.data = shared.read()
+    return local_curator
+
+
+def memory_usage() -> t.Dict[str, int]:
+    """Resident and private memory of the current process, in bytes.
+
+    Private memory, i.e. pages not shared with other processes, is only
+    available on Linux.
+    """
+    usage = {"peak_rss": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024}
+    try:
+        with open("/proc/self/smaps_rollup", encoding="utf-8") as fp:
+            for line in fp:
+                name, _, value = line.partition(":")
+                if name == "Rss":
+                    usage["rss"] = int(value.split()[0]) * 1024
+                elif name in ("Private_Clean", "Private_Dirty"):
+                    usage["private"] = (
+                        usage.get("private", 0) + int(value.split()[0]) * 1024
+                    )
+    except OSError:
+        pass
+    return usage
+
+
+def log_worker_ready(log: logging.Logger, seconds: float) -> None:
+    """Log how long a worker took to start and the memory it uses."""
+    usage = memory_usage()
+    memory = ", ".join(f"{name} {value / 2**20:.1f}MB" for name, value in usage.items())
+    log.info(f"Started in {seconds:.3f}s ({memory})")
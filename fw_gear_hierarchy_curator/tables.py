@@ -0,0 +1,170 @@
+"""Indexed lookup tables parsed from the additional inputs.
+
+Curators often load an input CSV with pandas and scan it for every container,
+in every worker.  `load_input_table` parses an input once, in the main process
+(e.g. in the curator `__init__`), into a `LookupTable`: one typed numpy array
+per column and a hash index on a key column, so that rows are looked up in
+constant time, e.g. by subject or session label.
+
+Workers share the table without copying it.  When they are forked, the column
+arrays are shared copy-on-write, and as they are never written their pages
+stay shared.  When the table is pickled, e.g. for workers that are not
+forked, it is saved once as `.npy` files which each worker memory maps
+read-only.  The index is built lazily in each process.
+"""
+import json
+import logging
+import shutil
+import tempfile
+import typing as t
+import weakref
+from pathlib import Path
+
+import numpy as np
+from flywheel_gear_toolkit.utils import curator as c
+from flywheel_gear_toolkit.utils import datatypes
+
+from .inputs import INPUT_ATTRS
+from .lazy import lazy_import
+
+# Only needed to parse tables, not to open saved ones in the workers.
+pd = lazy_import("pandas")
+
+log = logging.getLogger(__name__)
+
+Row = t.Dict[str, t.Any]
+
+
+class LookupTable:
+    """Columns of a table with an index on a key column.
+
+    Args:
+        columns: Column arrays of the same length, by name.
+        key: Name of the column to look rows up by.
+    """
+
+    def __init__(self, columns: t.Dict[str, np.ndarray], key: str) -> None:
+        if key not in columns:
+            raise ValueError(f"Key column {key} not in {list(columns)}")
+        lengths = {len(array) for array in columns.values()}
+        if len(lengths) > 1:
+            raise ValueError(f"Columns have different lengths: {lengths}")
+        self.columns = columns
+        self.key = key
+        self.directory: t.Optional[Path] = None
+        self._index: t.Optional[t.Dict[t.Any, t.List[int]]] = None
+
+    @classmethod
+    def from_frame(cls, df: "pd.DataFrame", key: str) -> "LookupTable":
+        """Create a table from a DataFrame.
+
+        Numeric and boolean columns keep their type, other columns are stored
+        as fixed width strings, with "" for missing values.
+        """
+        columns = {}
+        for name in df.columns:
+            series = df[name]
+            if pd.api.types.is_numeric_dtype(series):
+                array = series.to_numpy()
+            else:
+                array = series.fillna("").astype(str).to_numpy().astype(str)
+            columns[str(name)] = array
+        return cls(columns, key)
+
+    @classmethod
+    def from_csv(
+        cls, path: datatypes.PathLike, key: str, **kwargs: t.Any
+    ) -> "LookupTable":
+        """Parse a CSV file, passing `kwargs` to `pandas.read_csv`."""
+        return cls.from_frame(pd.read_csv(path, **kwargs), key)
+
+    @property
+    def index(self) -> t.Dict[t.Any, t.List[int]]:
+        """Positions of the rows of each key, built on first use."""
+        if self._index is None:
+            index: t.Dict[t.Any, t.List[int]] = {}
+            for i, value in enumerate(self.columns[self.key].tolist()):
+                index.setdefault(value, []).append(i)
+            self._index = index
+        return self._index
+
+    def __len__(self) -> int:
+        return len(self.columns[self.key])
+
+    def __contains__(self, key: t.Any) -> bool:
+        return key in self.index
+
+    def row(self, position: int) -> Row:
+        """Row at a position, as a dictionary of Python values."""
+        return {name: array[position].item() for name, array in self.columns.items()}
+
+    def get(self, key: t.Any, default: t.Optional[Row] = None) -> t.Optional[Row]:
+        """First row with the key, or `default`."""
+        positions = self.index.get(key)
+        if not positions:
+            return default
+        return self.row(positions[0])
+
+    def get_all(self, key: t.Any) -> t.List[Row]:
+        """All rows with the key, e.g. all sessions of a subject."""
+        return [self.row(i) for i in self.index.get(key, [])]
+
+    def __getitem__(self, key: t.Any) -> Row:
+        row = self.get(key)
+        if row is None:
+            raise KeyError(key)
+        return row
+
+    def save(self, directory: datatypes.PathLike) -> None:
+        """Save the columns as `.npy` files that can be memory mapped."""
+        directory = Path(directory)
+        directory.mkdir(parents=True, exist_ok=True)
+        names = list(self.columns)
+        for i, name in enumerate(names):
+            np.save(directory / f"{i}.npy", self.columns[name], allow_pickle=False)
+        meta = {"key": self.key, "columns": names}
+        (directory / "table.json").write_text(json.dumps(meta), encoding="utf-8")
+        self.directory = directory
+
+    @classmethod
+    def open(cls, directory: datatypes.PathLike) -> "LookupTable":
+        """Memory map a saved table read-only."""
+        directory = Path(directory)
+        meta = json.loads((directory / "table.json").read_text(encoding="utf-8"))
+        columns = {
+            name: np.load(directory / f"{i}.npy", mmap_mode="r")
+            for i, name in enumerate(meta["columns"])
+        }
+        table = cls(columns, meta["key"])
+        table.directory = directory
+        return table
+
+    def __reduce__(self):
+        if self.directory is None:
+            # Saved once, removed when this table is garbage collected.
+            directory = tempfile.mkdtemp(prefix="lookup-table-")
+            self.save(directory)
+            weakref.finalize(self, shutil.rmtree, directory, True)
+        return (LookupTable.open, (str(self.directory),))
+
+
+def load_input_table(
+    curator: c.HierarchyCurator, name: str, key: str, **kwargs: t.Any
+) -> t.Optional[LookupTable]:
+    """Parse an additional input into a lookup table.
+
+    Args:
+        curator: Curator with the input.
+        name: Attribute of the input, e.g. `additional_input_one`, or a path.
+        key: Column to look rows up by.
+        kwargs: Passed to `pandas.read_csv`.
+
+    Returns:
+        LookupTable: The table, or None if the input was not provided.
+    """
+    path = getattr(curator, name, None) if name in INPUT_ATTRS else name
+    if not path:
+        return None
+    table = LookupTable.from_csv(path, key, **kwargs)
+    log.info(f"Loaded {len(table)} rows from {path} keyed by {key}")
+    return table
@@ -0,0 +1,256 @@
+"""Per-container trace spans, exported in the Chrome trace event format.
+
+With `config.trace` set, each process records a span for every container it
+hydrates, reloads, validates and curates, and workers for every SDK request
+they make.
+Spans are tagged with the worker ID and the path of the container.  Each
+process appends its spans to its own file in batches, and the main process
+merges them into `config.trace_path` (default `trace.json` next to the report)
+when the run ends, which can be opened in Perfetto or `chrome://tracing`.
+"""
+import contextlib
+import json
+import logging
+import os
+import time
+import typing as t
+from pathlib import Path
+
+from flywheel_gear_toolkit.utils import curator as c
+from flywheel_gear_toolkit.utils import datatypes
+
+from . import utils
+
+log = logging.getLogger(__name__)
+
+# Spans buffered by a Tracer before they are appended to its file.
+DEFAULT_BATCH_SIZE = 1000
+
+# Tracer of the current process, if enabled.
+_tracer: t.Optional["Tracer"] = None
+
+
+def container_path(container: datatypes.Container) -> str:
+    """Path of a container from the IDs of its parents and its label.
+
+    E.g. `<group>/<project id>/<subject id>/<session label>`, without any
+    request to the API.
+    """
+    parents = getattr(container, "parents", None) or {}
+    parts = [
+        parents.get(level)
+        for level in ["group", "project", "subject", "session", "acquisition"]
+    ]
+    parts = [part for part in parts if part]
+    for attr in ["label", "name", "code", "id"]:
+        name = getattr(container, attr, None)
+        if name:
+            parts.append(str(name))
+            break
+    return "/".join(parts)
+
+
+def get_trace_path(curator: c.HierarchyCurator) -> Path:
+    """Path to write the trace to.
+
+    `config.trace_path`, defaulting to `trace.json` next to the report path.
+    """
+    path = utils.get_config_option(curator, "trace_path")
+    if path:
+        return Path(path)
+    return Path(curator.config.path).parent / "trace.json"
+
+
+def worker_trace_path(path: datatypes.PathLike, worker_id: t.Any) -> Path:
+    """Path of the spans of one worker, e.g. `trace.worker-0.jsonl`."""
+    path = Path(path)
+    return path.with_name(f"{path.stem}.worker-{worker_id}.jsonl")
+
+
+class Tracer:
+    """Record spans of one process, appending them to a file in batches.
+
+    Args:
+        path: File to append the spans to, one JSON event per line.
+        worker_id: ID of the worker, added to each span.
+        batch_size: Number of spans to buffer before writing.
+    """
+
+    def __init__(
+        self,
+        path: datatypes.PathLike,
+        worker_id: t.Any,
+        batch_size: int = DEFAULT_BATCH_SIZE,
+    ) -> None:
+        self.path = Path(path)
+        self.worker_id = worker_id
+        self.batch_size = batch_size
+        self.pid = os.getpid()
+        self.events: t.List[t.Dict[str, t.Any]] = [
+            {
+                "name": "process_name",
+                "ph": "M",
+                "pid": self.pid,
+                "args": {"name": f"worker {worker_id}"},
+            }
+        ]
+
+    def add_span(
+        self,
+        name: str,
+        cat: str,
+        start: float,
+        duration: float,
+        args: t.Dict[str, t.Any],
+    ) -> None:
+        """Add a span starting at the POSIX timestamp `start`."""
+        self.events.append(
+            {
+                "name": name,
+                "cat": cat,
+                "ph": "X",
+                # Microseconds
+                "ts": start * 1e6,
+                "dur": duration * 1e6,
+                "pid": self.pid,
+                "tid": 0,
+                "args": {"worker": self.worker_id, **args},
+            }
+        )
+        if len(self.events) >= self.batch_size:
+            self.flush()
+
+    @contextlib.contextmanager
+    def span(self, name: str, cat: str = "curator", **args: t.Any):
+        """Record the time spent in the block as a span."""
+        start = time.time()
+        start_counter = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add_span(name, cat, start, time.perf_counter() - start_counter, args)
+
+    def flush(self) -> None:
+        """Append buffered spans to the file."""
+        if not self.events:
+            return
+        with open(self.path, "a", encoding="utf-8") as fp:
+            for event in self.events:
+                fp.write(json.dumps(event) + "\n")
+        self.events = []
+
+
+def get_tracer() -> t.Optional[Tracer]:
+    """Tracer of the current process, or None if disabled."""
+    return _tracer
+
+
+def set_tracer(tracer: t.Optional[Tracer]) -> None:
+    """Set the tracer of the current process."""
+    global _tracer  # pylint: disable=global-statement
+    _tracer = tracer
+
+
+def span(
+    name: str,
+    container: t.Optional[datatypes.Container] = None,
+    path: t.Optional[str] = None,
+) -> t.ContextManager:
+    """Record a span in the tracer of the current process, if enabled.
+
+    Args:
+        name: Name of the span, e.g. `curate`.
+        container: Container the span is about, to tag it with its path.
+        path: Path to tag the span with if there is no container yet.
+    """
+    if _tracer is None:
+        return contextlib.nullcontext()
+    if container is not None:
+        path = container_path(container)
+        name = f"{name} {container.container_type}"
+    return _tracer.span(name, path=path)
+
+
+def trace_client(client: t.Any, tracer: Tracer) -> None:
+    """Record a span for each request made by an SDK client."""
+    utils.add_request_hook(
+        client,
+        lambda request: tracer.add_span(
+            request.endpoint,
+            "api",
+            request.start,
+            request.duration,
+            {"sent": request.sent, "received": request.received},
+        ),
+    )
+
+
+def start_worker_tracing(local_curator: c.HierarchyCurator, worker_id: t.Any) -> None:
+    """Enable tracing in a worker process if `config.trace` is set."""
+    if not utils.get_config_option(local_curator, "trace"):
+        set_tracer(None)
+        return
+    tracer = Tracer(
+        worker_trace_path(get_trace_path(local_curator), worker_id), worker_id
+    )
+    trace_client(local_curator.context._client, tracer)
+    set_tracer(tracer)
+
+
+def stop_worker_tracing() -> None:
+    """Write out the spans buffered by a worker process."""
+    if _tracer is not None:
+        _tracer.flush()
+
+
+def merge_traces(
+    paths: t.Iterable[datatypes.PathLike], output_path: datatypes.PathLike
+) -> int:
+    """Combine span files into one Chrome trace file, one line at a time.
+
+    Returns:
+        int: Number of events written.
+    """
+    count = 0
+    with open(output_path, "w", encoding="utf-8") as out_fp:
+        out_fp.write('{"displayTimeUnit": "ms", "traceEvents": [\n')
+        for path in paths:
+            with open(path, encoding="utf-8") as fp:
+                for line in fp:
+                    if not line.strip():
+                        continue
+                    out_fp.write((",\n" if count else "") + line.rstrip("\n"))
+                    count += 1
+        out_fp.write("\n]}\n")
+    return count
+
+
+def start_tracing(curator: c.HierarchyCurator) -> t.Optional[Path]:
+    """Enable tracing in the main process if `config.trace` is set.
+
+    Returns:
+        Path: Path the trace will be written to, or None if disabled.
+    """
+    if not utils.get_config_option(curator, "trace"):
+        set_tracer(None)
+        return None
+    path = get_trace_path(curator)
+    set_tracer(Tracer(worker_trace_path(path, "main"), "main"))
+    log.info(f"Tracing containers to {path}")
+    return path
+
+
+def stop_tracing(path: t.Optional[Path], workers: int) -> None:
+    """Merge the spans of the main process and the workers into the trace."""
+    if path is None:
+        return
+    stop_worker_tracing()
+    set_tracer(None)
+    paths = [worker_trace_path(path, "main")] + [
+        worker_trace_path(path, i) for i in range(workers)
+    ]
+    paths = [span_path for span_path in paths if span_path.exists()]
+    count = merge_traces(paths, path)
+    for span_path in paths:
+        span_path.unlink()
+    log.info(f"Wrote {count} trace events to {path}")
@@ -1,20 +1,117 @@
 """Utilities for running the curator."""
 
+import dataclasses
+import datetime
+import functools
+import hashlib
+import json
 import logging
+import re
+import time
 import typing as t
 
 import flywheel
 from flywheel_gear_toolkit.utils import curator as c
-from flywheel_gear_toolkit.utils import datatypes, reporters, walker
+from flywheel_gear_toolkit.utils import datatypes, reporters
+
+from . import frontier, tracing
 
 log = logging.getLogger(__name__)
 
 
+def get_config_option(
+    curator: c.HierarchyCurator, name: str, default: t.Any = None
+) -> t.Any:
+    """Get an engine option that isn't a field of `CuratorConfig`.
+
+    These options are set as plain attributes on `curator.config`, e.g.
+    `self.config.shard_count = 4` in the curator `__init__`.
+    """
+    return vars(curator.config).get(name, default)
+
+
+def set_config_options(
+    curator: c.HierarchyCurator, options: t.Optional[t.Dict[str, t.Any]]
+) -> None:
+    """Set engine options (e.g. from the gear config) on `curator.config`.
+
+    Options that are `None` are skipped so they don't override values set by
+    the curator itself.
+    """
+    for name, value in (options or {}).items():
+        if value is not None:
+            setattr(curator.config, name, value)
+
+
+@dataclasses.dataclass
+class Request:
+    """An SDK request, as passed to request hooks.
+
+    Attributes:
+        method: HTTP verb.
+        path: Path template of the endpoint, e.g. `/sessions/{SessionId}`.
+        start: POSIX timestamp of the start of the request.
+        duration: Duration of the request in seconds.
+        sent: Size of the JSON body sent, in bytes.
+        received: Size of the response, in bytes (0 if the request failed).
+    """
+
+    method: str
+    path: str
+    start: float
+    duration: float
+    sent: int = 0
+    received: int = 0
+
+    @property
+    def endpoint(self) -> str:
+        """Verb and path of the request, e.g. `GET /sessions/{SessionId}`."""
+        return f"{self.method} {self.path}"
+
+
+def _response_size(response: t.Any) -> int:
+    data = getattr(response, "data", None)
+    if isinstance(data, (bytes, str)):
+        return len(data)
+    # Streamed downloads aren't read into data.
+    try:
+        return int(response.getheader("Content-Length") or 0)
+    except (AttributeError, TypeError, ValueError):
+        return 0
+
+
+def add_request_hook(
+    client: flywheel.Client, hook: t.Callable[[Request], None]
+) -> None:
+    """Call `hook(request)` after each request made by an SDK client."""
+    api_client = client.api_client
+    call_api = api_client.call_api
+
+    @functools.wraps(call_api)
+    def hooked_call_api(resource_path, method, *args, **kwargs):
+        request = Request(method, resource_path, time.time(), 0)
+        body = kwargs.get("body", args[3] if len(args) > 3 else None)
+        if body:
+            request.sent = len(json.dumps(api_client.sanitize_for_serialization(body)))
+        start_counter = time.perf_counter()
+        try:
+            out = call_api(resource_path, method, *args, **kwargs)
+            request.received = _response_size(api_client.last_response)
+            return out
+        finally:
+            request.duration = time.perf_counter() - start_counter
+            hook(request)
+
+    api_client.call_api = hooked_call_api
+
+
 def container_to_pickleable_dict(container: datatypes.Container) -> t.Dict[str, str]:
     """Take a flywheel container and transform into
     a simple dictionary that can be pickled for
     multiprocessing, excluding flywheel SDK.
     """
+    if isinstance(container, frontier.Entry):
+        return container.to_dict()
     val = {
         "id": container.id,
         "container_type": container.container_type,
@@ -27,45 +124,53 @@ def container_to_pickleable_dict(container: datatypes.Container) -> t.Dict[str,
     return val
 
 
+def shard_of(container_id: str, shard_count: int) -> int:
+    """Return the shard a container belongs to.
+
+    Uses a digest of the ID rather than `hash()`, which is randomized per
+    process, so every job computes the same assignment.
+    """
+    digest = hashlib.sha1(container_id.encode("utf-8")).hexdigest()
+    return int(digest, 16) % shard_count
+
+
 def container_from_pickleable_dict(
     val: t.Dict, local_curator: c.HierarchyCurator
 ) -> datatypes.Container:
     """Take the simple pickleable dict entry and
     return the flywheel container.
     """
-    get_container_fn = getattr(
-        local_curator.context.client, f"get_{val['container_type']}"
-    )
-    container = get_container_fn(val["id"])
-    return container
+    return frontier.Entry.from_dict(val).get(local_curator.context.client)
 
 
 def handle_work(
     children: t.List[t.Dict[str, str]],
     local_curator: c.HierarchyCurator,
-    handle: t.Callable[[c.HierarchyCurator, t.List[datatypes.Container]], None],
+    handle: t.Callable[[c.HierarchyCurator, t.List["frontier.Entry"]], None],
 ):
-    """Convert list of dicts into list of containers,
-    perform a callback on this list of containers.
+    """Convert list of dicts into list of frontier entries,
+    perform a callback on this list of entries.
+
+    The containers are only fetched when they are walked or curated, see
+    `frontier.hydrate`.
     """
-    containers = []
-    for child in children:
-        try:
-            container = container_from_pickleable_dict(child, local_curator)
-        except flywheel.rest.ApiException as e:
-            log.error("Could not get container, skipping curation", exc_info=True)
-        else:
-            containers.append(container)
-    handle(local_curator, containers)
+    handle(local_curator, [frontier.Entry.from_dict(child) for child in children])
 
 
-def make_walker(container: datatypes.Container, curator: c.HierarchyCurator):
-    """Generate a walker from a container and curator."""
-    w = walker.Walker(
+def make_walker(
+    container: t.Union[datatypes.Container, "frontier.Entry"],
+    curator: c.HierarchyCurator,
+    compact: t.Optional[bool] = None,
+) -> "frontier.Frontier":
+    """Generate a walker from a container (or entry) and curator."""
+    w = frontier.Frontier(
         container,
+        curator.context.client,
         depth_first=curator.config.depth_first,
         reload=curator.config.reload,
         stop_level=curator.config.stop_level,
+        compact=compact,
+        size=get_config_option(curator, "frontier_size"),
     )
     return w
 
@@ -82,3 +187,171 @@ def reload_file_parent(
         )
         container._parent = get_parent_fn(container.parent_ref.id)
     return container
+
+
+# A filter term: a dotted attribute path, an operator and the value, which may
+# contain operator characters itself, e.g. `label=T1<T2`.
+FILTER_TERM = re.compile(
+    r"^\s*(?P<key>[\w-]+(?:\.[\w-]+)*)\s*(?P<op><=|>=|!=|=|<|>)(?P<value>.*)$"
+)
+ORDERING_OPERATORS = ["<", ">", "<=", ">="]
+
+
+def _coerce_filter_value(term: str, value: str, current: t.Any) -> t.Any:
+    """Coerce a filter literal to the type of the attribute it is compared to.
+
+    Raises:
+        ValueError: If the literal can't be parsed as that type.
+    """
+    try:
+        if isinstance(current, datetime.datetime):
+            parsed = datetime.datetime.fromisoformat(value)
+            if parsed.tzinfo is None and current.tzinfo is not None:
+                parsed = parsed.replace(tzinfo=current.tzinfo)
+            return parsed
+        if isinstance(current, bool):
+            return value.lower() in ["true", "1", "yes"]
+        if isinstance(current, (int, float)):
+            return float(value)
+    except ValueError:
+        raise ValueError(
+            f"Could not parse '{value}' as {type(current).__name__} in filter "
+            f"term '{term}'"
+        ) from None
+    return value
+
+
+def parse_filter(query: t.Optional[str]) -> t.List[t.Tuple[str, str, str, str]]:
+    """Split a finder style filter string into its terms.
+
+    Returns:
+        list: The term, key, operator and value of each term.
+
+    Raises:
+        ValueError: If a term can't be parsed.
+    """
+    if not query:
+        return []
+    terms = []
+    for term in query.split(","):
+        match = FILTER_TERM.match(term)
+        if not match:
+            raise ValueError(f"Could not parse filter term '{term}'")
+        terms.append((term, *match.group("key", "op", "value")))
+    return terms
+
+
+def match_filter(obj: t.Any, query: t.Optional[str]) -> bool:
+    """Evaluate a finder style filter string against an object locally.
+
+    Supports comma separated terms such as `type=nifti,modified>2023-01-01`
+    with the operators `=`, `!=`, `<`, `>`, `<=` and `>=` on dotted
+    attribute paths (e.g. `classification.Intent=Structural`).  Only `=` and
+    `!=` apply to lists, testing whether they contain the value.
+
+    Raises:
+        ValueError: If a term can't be parsed, its value can't be compared to
+            the attribute, or it orders a list.
+    """
+    for term, key, op, value in parse_filter(query):
+        current = obj
+        for part in key.split("."):
+            if isinstance(current, dict):
+                current = current.get(part)
+            else:
+                current = getattr(current, part, None)
+        if current is None:
+            if op == "!=":
+                continue
+            return False
+        if isinstance(current, list) and op in ORDERING_OPERATORS:
+            raise ValueError(
+                f"Operator '{op}' can't be used on list attribute '{key}' in "
+                f"filter term '{term}'"
+            )
+        value = _coerce_filter_value(term, value.strip(), current)
+        if isinstance(current, list):
+            matched = value in current if op == "=" else value not in current
+        else:
+            matched = {
+                "=": current == value,
+                "!=": current != value,
+                "<": current < value,
+                ">": current > value,
+                "<=": current <= value,
+                ">=": current >= value,
+            }[op]
+        if not matched:
+            return False
+    return True
+
+
+def iter_query_work(
+    client: flywheel.Client,
+    parent: datatypes.Container,
+    container_type: str,
+    query: t.Optional[str] = None,
+    file_query: t.Optional[str] = None,
+    page_size: int = 250,
+    exclude: t.Optional[t.Callable[[datatypes.Container], bool]] = None,
+) -> t.Iterator[t.Dict[str, str]]:
+    """Stream pickleable work entries for the containers matched by a query.
+
+    Containers are paged from the server with the finder for `container_type`
+    restricted to descendants of `parent`.  For `file` queries, `query` selects
+    the parent acquisitions and `file_query` is evaluated locally against each
+    of their files (see `match_filter`).
+
+    Args:
+        client: Flywheel client.
+        parent: Container the query is restricted to.
+        container_type: One of subject, session, acquisition or file.
+        query: Finder filter string, e.g. `label=~^anat,created>2023-01-01`.
+        file_query: Local filter for files, e.g. `type=nifti`.
+        page_size: Number of containers to request per page.
+        exclude: Called with each matched container, which is left out if it
+            returns True.
+
+    Returns:
+        iterator: Work entries as returned by `container_to_pickleable_dict`.
+
+    Raises:
+        ValueError: If the container type isn't valid or a term of
+            `file_query` can't be parsed, before any container is requested.
+    """
+    find_type = "acquisition" if container_type == "file" else container_type
+    if find_type not in ["subject", "session", "acquisition"]:
+        raise ValueError(
+            f"Expected query container type to be one of subject, session, "
+            f"acquisition or file, found {container_type}"
+        )
+    parse_filter(file_query)
+    return _iter_query_work(
+        client, parent, container_type, query, file_query, page_size, exclude
+    )
+
+
+def _iter_query_work(
+    client: flywheel.Client,
+    parent: datatypes.Container,
+    container_type: str,
+    query: t.Optional[str],
+    file_query: t.Optional[str],
+    page_size: int,
+    exclude: t.Optional[t.Callable[[datatypes.Container], bool]],
+) -> t.Iterator[t.Dict[str, str]]:
+    find_type = "acquisition" if container_type == "file" else container_type
+    filters = [f"parents.{parent.container_type}={parent.id}"]
+    if query:
+        filters.append(query)
+    finder = getattr(client, f"{find_type}s")
+    for container in finder.iter_find(",".join(filters), limit=page_size):
+        if container_type != "file":
+            if not (exclude and exclude(container)):
+                yield container_to_pickleable_dict(container)
+            continue
+        for file_ in container.files or []:
+            if not file_.parent_ref:
+                file_.parent_ref = {"type": "acquisition", "id": container.id}
+            if match_filter(file_, file_query) and not (exclude and exclude(file_)):
+                yield container_to_pickleable_dict(file_)
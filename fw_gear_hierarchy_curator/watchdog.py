@@ -0,0 +1,198 @@
+"""Watchdog for containers that take too long to validate and curate.
+
+With `config.slow_threshold` set to a number of seconds, each worker starts a
+watchdog thread.  When the validation and curation of one container take
+longer than the threshold, the watchdog logs the path of the container, the
+time spent so far and the current stack of the worker, which shows where it is
+stuck, e.g. in a hung HTTP request.  Slow containers are collected by the main
+process and written to `slow_containers.csv` next to the report when the run
+ends.
+"""
+import contextlib
+import csv
+import logging
+import sys
+import threading
+import time
+import traceback
+import typing as t
+from pathlib import Path
+
+from flywheel_gear_toolkit.utils import curator as c
+from flywheel_gear_toolkit.utils import datatypes
+
+from .tracing import container_path
+from .utils import get_config_option
+
+log = logging.getLogger(__name__)
+
+# Columns of the slow containers report.
+REPORT_FIELDS = ["container_type", "container_id", "path", "worker", "seconds", "stack"]
+
+# Watchdog of the current process, if enabled.
+_watchdog: t.Optional["Watchdog"] = None
+
+
+class Watchdog:
+    """Watch the container the calling thread is working on.
+
+    Args:
+        threshold: Seconds after which a container is slow.
+        worker_id: ID of the worker, added to the report rows.
+        shared: List to add a row to for each slow container.
+    """
+
+    def __init__(
+        self,
+        threshold: float,
+        worker_id: t.Any,
+        shared: t.Optional[t.MutableSequence] = None,
+    ) -> None:
+        self.threshold = threshold
+        self.worker_id = worker_id
+        self.shared = shared
+        # Check a few times per threshold, but not too often.
+        self.interval = min(max(threshold / 4, 0.05), 5)
+        self.thread_id = threading.get_ident()
+        self.container: t.Optional[datatypes.Container] = None
+        self.start = 0.0
+        self.stack: t.Optional[str] = None
+        self._lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            self.check()
+
+    def check(self) -> None:
+        """Log the stack of the watched thread if its container is slow."""
+        with self._lock:
+            if self.container is None or self.stack is not None:
+                return
+            elapsed = time.monotonic() - self.start
+            if elapsed < self.threshold:
+                return
+            frame = sys._current_frames().get(  # pylint: disable=protected-access
+                self.thread_id
+            )
+            self.stack = "".join(traceback.format_stack(frame)) if frame else ""
+            log.warning(
+                f"{self.container.container_type} {container_path(self.container)} "
+                f"has been curating for {elapsed:.1f}s, at:\n{self.stack}"
+            )
+
+    @contextlib.contextmanager
+    def watch(self, container: datatypes.Container):
+        """Watch a container while the block runs."""
+        with self._lock:
+            self.container = container
+            self.start = time.monotonic()
+            self.stack = None
+        try:
+            yield
+        finally:
+            with self._lock:
+                elapsed = time.monotonic() - self.start
+                stack, self.container = self.stack, None
+            if elapsed >= self.threshold:
+                self.record(container, elapsed, stack)
+
+    def record(
+        self, container: datatypes.Container, elapsed: float, stack: t.Optional[str]
+    ) -> None:
+        """Add a row for a slow container to the report."""
+        path = container_path(container)
+        if stack is None:
+            # Finished before the thread saw it
+            log.warning(
+                f"{container.container_type} {path} took {elapsed:.1f}s to curate"
+            )
+        if self.shared is not None:
+            self.shared.append(
+                {
+                    "container_type": container.container_type,
+                    "container_id": container.id,
+                    "path": path,
+                    "worker": self.worker_id,
+                    "seconds": round(elapsed, 3),
+                    "stack": stack or "",
+                }
+            )
+
+    def start_thread(self) -> None:
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self._thread.is_alive():
+            self._thread.join()
+
+
+def watch(container: datatypes.Container) -> t.ContextManager:
+    """Watch a container in the current process, if enabled."""
+    if _watchdog is None:
+        return contextlib.nullcontext()
+    return _watchdog.watch(container)
+
+
+def start_worker_watchdog(
+    local_curator: c.HierarchyCurator,
+    worker_id: t.Any,
+    shared: t.Optional[t.MutableSequence],
+) -> None:
+    """Start the watchdog thread of a worker if `config.slow_threshold` is set."""
+    global _watchdog  # pylint: disable=global-statement
+    _watchdog = None
+    threshold = get_config_option(local_curator, "slow_threshold")
+    if not threshold:
+        return
+    _watchdog = Watchdog(threshold, worker_id, shared)
+    _watchdog.start_thread()
+
+
+def stop_worker_watchdog() -> None:
+    """Stop the watchdog thread of a worker."""
+    global _watchdog  # pylint: disable=global-statement
+    if _watchdog is not None:
+        _watchdog.stop()
+        _watchdog = None
+
+
+def get_slow_report_path(curator: c.HierarchyCurator) -> Path:
+    """Path of the slow containers report, next to the report path."""
+    return Path(curator.config.path).parent / "slow_containers.csv"
+
+
+def start_watchdog(
+    curator: c.HierarchyCurator, manager: t.Any
+) -> t.Optional[t.MutableSequence]:
+    """Create the list workers add slow containers to if enabled."""
+    if not get_config_option(curator, "slow_threshold"):
+        return None
+    return manager.list()
+
+
+def write_slow_report(rows: t.Iterable[t.Dict[str, t.Any]], path: Path) -> int:
+    """Write slow containers, slowest first.
+
+    Returns:
+        int: Number of slow containers.
+    """
+    rows = sorted(rows, key=lambda row: -row["seconds"])
+    with open(path, "w", newline="", encoding="utf-8") as fp:
+        writer = csv.DictWriter(fp, fieldnames=REPORT_FIELDS)
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+
+def stop_watchdog(
+    curator: c.HierarchyCurator, shared: t.Optional[t.MutableSequence]
+) -> None:
+    """Write the slow containers found by the workers, if any."""
+    if shared is None or not len(shared):
+        return
+    path = get_slow_report_path(curator)
+    count = write_slow_report(list(shared), path)
+    log.warning(f"Found {count} slow containers, see {path}")
@@ -1,21 +1,45 @@
 #!/usr/bin/python3
 """Hierarchy Curator gear entrypoint."""
-import sys, os
+import os
+import sys
 
 from flywheel_gear_toolkit import GearToolkitContext
 
-from fw_gear_hierarchy_curator import curate, parser
+from fw_gear_hierarchy_curator import curate, feed, parser
 
-os.chdir('/flywheel/v0')
+os.chdir("/flywheel/v0")
 if __name__ == "__main__":  # pragma: no cover
     with GearToolkitContext() as gear_context:
         gear_context.init_logging()
         parent, curator_path, input_files = parser.parse_config(gear_context)
+        query = parser.parse_query(gear_context)
+        feed_config = parser.parse_feed(gear_context)
+        options = parser.parse_options(gear_context)
 
-        r_code = curate.main(
-            gear_context,
-            parent,
-            curator_path,
-            **input_files,
-        )
+        if feed_config:
+            r_code = feed.feed_main(
+                gear_context,
+                parent,
+                curator_path,
+                options=options,
+                **feed_config,
+                **input_files,
+            )
+        elif query:
+            r_code = curate.query_main(
+                gear_context,
+                parent,
+                curator_path,
+                options=options,
+                **query,
+                **input_files,
+            )
+        else:
+            r_code = curate.main(
+                gear_context,
+                parent,
+                curator_path,
+                options=options,
+                **input_files,
+            )
         sys.exit(r_code)
@@ -0,0 +1,7 @@
+import pandas as pd
+from flywheel_gear_toolkit.utils.curator import HierarchyCurator
+
+
+class Curator(HierarchyCurator):
+    def curate_session(self, session):
+        self.data["sessions"] = pd.DataFrame({"label": [session.label]})
@@ -0,0 +1,84 @@
+"""Compare the queue reporter with batched per-worker reports.
+
+Run with `python -m tests.benchmark_reporter [workers] [records per worker]`.
+"""
+import sys
+import tempfile
+import time
+from multiprocessing import Manager, Process
+from pathlib import Path
+
+from flywheel_gear_toolkit.utils.reporters import AggregatedReporter, LogRecord
+
+from fw_gear_hierarchy_curator.reports import (
+    BatchedReporter,
+    merge_reports,
+    worker_report_path,
+)
+
+
+def append_records(reporter, records):
+    for i in range(records):
+        reporter.append_log(
+            container_type="file",
+            container_id=str(i),
+            label=f"file-{i}.dcm",
+            err="",
+            msg="curated",
+            resolved=True,
+            search_key="",
+        )
+
+
+def queue_worker(reporter, records):
+    append_records(reporter, records)
+
+
+def batched_worker(path, worker_id, records):
+    reporter = BatchedReporter(worker_report_path(path, worker_id), format=LogRecord)
+    append_records(reporter, records)
+    reporter.close()
+
+
+def run_queue(path, workers, records):
+    manager = Manager()
+    reporter = AggregatedReporter(path, format=LogRecord, queue=manager.Queue())
+    writer = Process(target=reporter.worker)
+    writer.start()
+    procs = [
+        Process(target=queue_worker, args=(reporter, records)) for _ in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    reporter.write("END")
+    writer.join()
+
+
+def run_batched(path, workers, records):
+    procs = [
+        Process(target=batched_worker, args=(path, i, records)) for i in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+    paths = [worker_report_path(path, i) for i in range(workers)]
+    merge_reports(paths, path)
+
+
+def main(workers=4, records=20000):
+    for name, run in [("queue", run_queue), ("batched", run_batched)]:
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            start = time.perf_counter()
+            run(Path(tmp_dir) / "output.csv", workers, records)
+            elapsed = time.perf_counter() - start
+        print(
+            f"{name:>8}: {elapsed:.2f}s "
+            f"({workers * records / elapsed:,.0f} records/s)"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
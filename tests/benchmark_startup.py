@@ -0,0 +1,70 @@
+"""Compare the time workers take to start with each start method.
+
+Run with `python -m tests.benchmark_startup [workers]`.
+
+Each worker imports the modules a curator typically uses, already imported by
+the main process, and reports the time from its launch by the main process
+until it is ready.  With `forkserver` the modules are preloaded by the fork
+server, started before the timing.
+"""
+import multiprocessing
+import sys
+import time
+
+# Imported by the main process of a run too
+import flywheel  # pylint: disable=unused-import
+import pandas  # pylint: disable=unused-import
+from flywheel_gear_toolkit.utils.curator import HierarchyCurator
+
+from fw_gear_hierarchy_curator import startup
+
+
+class Curator(HierarchyCurator):
+    def curate_container(self, container):
+        pass
+
+
+def worker(launched, results):
+    # pylint: disable=import-outside-toplevel,unused-import,reimported
+    import flywheel
+    import pandas
+
+    results.put(time.time() - launched)
+
+
+def run(method, workers):
+    curator = Curator()
+    curator.config.start_method = method
+    startup.set_start_method(curator)
+    results = multiprocessing.Queue()
+    if method == "forkserver":
+        # Let the server finish importing, as it would while the main process
+        # curates the run container.
+        proc = multiprocessing.Process(target=worker, args=(time.time(), results))
+        proc.start()
+        results.get()
+        proc.join()
+    start = time.perf_counter()
+    procs = [
+        multiprocessing.Process(target=worker, args=(time.time(), results))
+        for _ in range(workers)
+    ]
+    for proc in procs:
+        proc.start()
+    ready = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    return time.perf_counter() - start, sum(ready) / workers, max(ready)
+
+
+def main(workers=4):
+    for method in startup.START_METHODS:
+        elapsed, mean, slowest = run(method, workers)
+        print(
+            f"{method:>10}: {elapsed:.3f}s total, ready after {mean * 1000:.0f}ms "
+            f"on average, {slowest * 1000:.0f}ms at most"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,89 @@
+"""Compare deep copying the curator data in each worker with sharing it.
+
+Run with `python -m tests.benchmark_state [workers] [rows]`.
+
+The curator data holds a DataFrame of `rows` rows.  Each worker reports the
+time it took to get its copy of the curator and its private memory.  `deepcopy`
+is what the workers used to do, `fork` shares the data copy-on-write.  Workers
+that are not forked either get the data `pickled` with the curator, as they
+used to, or `spawn` reads it from a `SharedData` file.
+"""
+import copy
+import multiprocessing
+import sys
+import time
+
+import numpy as np
+import pandas as pd
+from flywheel_gear_toolkit.utils.curator import HierarchyCurator
+
+from fw_gear_hierarchy_curator import state
+
+
+class Curator(HierarchyCurator):
+    def curate_container(self, container):
+        pass
+
+
+def worker(curator, shared, deep, results):
+    start = time.perf_counter()
+    if deep:
+        local_curator = copy.deepcopy(curator)
+    else:
+        local_curator = state.make_local_curator(curator, shared)
+    # Use the data like a curator would
+    local_curator.data["df"]["weight"].sum()
+    elapsed = time.perf_counter() - start
+    results.put((elapsed, state.memory_usage().get("private", 0)))
+
+
+def run(method, deep, workers, curator):
+    ctx = multiprocessing.get_context(method)
+    results = ctx.Queue()
+    shared = None
+    if method != "fork" and not deep:
+        shared = state.SharedData.write(curator.data)
+    start = time.perf_counter()
+    with state.detached_data(curator, shared):
+        procs = [
+            ctx.Process(target=worker, args=(curator, shared, deep, results))
+            for _ in range(workers)
+        ]
+        for proc in procs:
+            proc.start()
+    stats = [results.get() for _ in procs]
+    for proc in procs:
+        proc.join()
+    elapsed = time.perf_counter() - start
+    if shared:
+        shared.remove()
+    copy_time = max(stat[0] for stat in stats)
+    private = sum(stat[1] for stat in stats) / workers / 2**20
+    return elapsed, copy_time, private
+
+
+def main(workers=4, rows=2000000):
+    rng = np.random.default_rng(0)
+    curator = Curator()
+    curator.data["df"] = pd.DataFrame(
+        {
+            "weight": rng.uniform(40, 120, rows),
+            "age": rng.integers(18, 90, rows),
+            "height": rng.uniform(1.4, 2.1, rows),
+        }
+    )
+    for name, method, deep in [
+        ("deepcopy", "fork", True),
+        ("fork", "fork", False),
+        ("pickled", "spawn", True),
+        ("spawn", "spawn", False),
+    ]:
+        elapsed, copy_time, private = run(method, deep, workers, curator)
+        print(
+            f"{name:>8}: {elapsed:.2f}s total, {copy_time:.3f}s copying, "
+            f"{private:.1f}MB private per worker"
+        )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,81 @@
+"""Compare scanning a DataFrame in each worker with a shared lookup table.
+
+Run with `python -m tests.benchmark_tables [workers] [rows] [lookups per worker]`.
+
+`pandas` reads the CSV in each worker and selects the rows of each label with
+a boolean mask, like most curators do.  `table` parses the CSV once in the
+main process into a `LookupTable` shared with the forked workers.
+"""
+import sys
+import tempfile
+import time
+from multiprocessing import Process
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from fw_gear_hierarchy_curator.tables import LookupTable
+
+
+def write_csv(path, rows):
+    rng = np.random.default_rng(0)
+    pd.DataFrame(
+        {
+            "subject": [f"sub-{i // 4}" for i in range(rows)],
+            "session": [f"ses-{i}" for i in range(rows)],
+            "weight": rng.uniform(40, 120, rows),
+            "age": rng.integers(18, 90, rows),
+        }
+    ).to_csv(path, index=False)
+
+
+def labels(rows, lookups):
+    return [f"ses-{i}" for i in np.random.default_rng(1).integers(0, rows, lookups)]
+
+
+def pandas_worker(path, keys):
+    df = pd.read_csv(path)
+    for key in keys:
+        df[df["session"] == key].iloc[0]["weight"]
+
+
+def table_worker(table, keys):
+    for key in keys:
+        table[key]["weight"]
+
+
+def run_workers(target, arg, workers, keys):
+    procs = [Process(target=target, args=(arg, keys)) for _ in range(workers)]
+    for proc in procs:
+        proc.start()
+    for proc in procs:
+        proc.join()
+
+
+def run_pandas(path, workers, keys):
+    run_workers(pandas_worker, path, workers, keys)
+
+
+def run_table(path, workers, keys):
+    table = LookupTable.from_csv(path, key="session")
+    run_workers(table_worker, table, workers, keys)
+
+
+def main(workers=4, rows=100000, lookups=2000):
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = Path(tmp_dir) / "input.csv"
+        write_csv(path, rows)
+        keys = labels(rows, lookups)
+        for name, run in [("pandas", run_pandas), ("table", run_table)]:
+            start = time.perf_counter()
+            run(path, workers, keys)
+            elapsed = time.perf_counter() - start
+            print(
+                f"{name:>8}: {elapsed:.2f}s "
+                f"({workers * lookups / elapsed:,.0f} lookups/s)"
+            )
+
+
+if __name__ == "__main__":
+    main(*[int(arg) for arg in sys.argv[1:]])
@@ -0,0 +1,111 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from fw_gear_hierarchy_curator import accounting
+from fw_gear_hierarchy_curator.accounting import (
+    ENGINE,
+    Accounts,
+    format_table,
+    start_accounting,
+    start_worker_accounting,
+    stop_worker_accounting,
+)
+from fw_gear_hierarchy_curator.utils import Request
+
+
+@pytest.fixture(autouse=True)
+def reset_accounts():
+    yield
+    accounting._accounts = None
+
+
+def test_accounts_attribute():
+    accounts = Accounts()
+    accounts.record(Request("GET", "/sessions", 0, 0.5, received=100))
+    with accounts.attribute("curate_session"):
+        accounts.record(Request("PUT", "/sessions/{SessionId}", 0, 0.1, sent=10))
+        accounts.record(Request("PUT", "/sessions/{SessionId}", 0, 0.1, sent=10))
+    with accounts.attribute("curate_session"):
+        pass
+    assert accounts.method == ENGINE
+    assert accounts.requests[(ENGINE, "GET", "/sessions")] == [1, 0, 100, 0.5]
+    assert accounts.requests[
+        ("curate_session", "PUT", "/sessions/{SessionId}")
+    ] == pytest.approx([2, 20, 0, 0.2])
+    assert accounts.invocations == {"curate_session": 2}
+
+
+def test_attribute_disabled():
+    with accounting.attribute("curate_session"):
+        pass
+    assert accounting._accounts is None
+
+
+def test_format_table():
+    one, two = Accounts(), Accounts()
+    with one.attribute("curate_session"):
+        one.record(Request("GET", "/acquisitions", 0, 1, received=2048))
+        one.record(Request("GET", "/acquisitions", 0, 1, received=2048))
+    with two.attribute("curate_session"):
+        two.record(Request("GET", "/acquisitions", 0, 1, received=2048))
+    two.record(Request("GET", "/sessions", 0, 0.5))
+    lines = format_table([one.to_dict(), two.to_dict()]).splitlines()
+    assert lines[0].split() == [
+        "Method",
+        "Request",
+        "Calls",
+        "Per",
+        "call",
+        "Sent",
+        "Received",
+        "Time",
+    ]
+    assert lines[2].split() == [
+        "curate_session",
+        "GET",
+        "/acquisitions",
+        "3",
+        "1.5",
+        "0B",
+        "6KB",
+        "3.0s",
+    ]
+    assert lines[3].split() == [
+        ENGINE,
+        "GET",
+        "/sessions",
+        "1",
+        "-",
+        "0B",
+        "0B",
+        "0.5s",
+    ]
+
+
+def test_start_accounting():
+    curator = MagicMock()
+    curator.config.api_accounting = False
+    assert start_accounting(curator, MagicMock()) is None
+    curator.config.api_accounting = True
+    manager = MagicMock()
+    assert start_accounting(curator, manager) is manager.list.return_value
+
+
+def test_worker_accounting():
+    local_curator = MagicMock()
+    start_worker_accounting(local_curator, None)
+    assert accounting._accounts is None
+    shared = []
+    start_worker_accounting(local_curator, shared)
+    call_api = local_curator.context._client.api_client.call_api
+    call_api("/projects", "GET")
+    with accounting.attribute("validate_project"):
+        call_api("/projects/{ProjectId}", "PUT")
+    stop_worker_accounting(shared)
+    assert accounting._accounts is None
+    assert [row[:4] for row in shared[0]["requests"]] == [
+        [ENGINE, "GET", "/projects", 1],
+        ["validate_project", "PUT", "/projects/{ProjectId}", 1],
+    ]
+    assert shared[0]["invocations"] == {"validate_project": 1}
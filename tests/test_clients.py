@@ -0,0 +1,79 @@
+import pickle
+from unittest.mock import MagicMock
+
+import flywheel
+import pytest
+from flywheel_gear_toolkit.utils.curator import HierarchyCurator
+
+from fw_gear_hierarchy_curator.clients import (
+    ClientFactory,
+    get_worker_client,
+    make_client_factory,
+)
+
+
+class Curator(HierarchyCurator):
+    def curate_container(self, container):
+        pass
+
+
+@pytest.fixture
+def client():
+    client = flywheel.Client("example.com:8443:key")
+    client.enable_feature("Subject-Container")
+    return client
+
+
+def test_client_factory(client, mocker):
+    request = mocker.patch("requests.Session.request")
+    factory = pickle.loads(pickle.dumps(ClientFactory.from_client(client, 4)))
+    worker_client = factory()
+    request.assert_not_called()
+    config = worker_client.api_client.configuration
+    assert config.host == "https://example.com:8443/api"
+    assert config.api_key == {"Authorization": "key"}
+    assert "Subject-Container" in (
+        worker_client.api_client.default_headers["X-Accept-Feature"]
+    )
+    adapter = worker_client.api_client.rest_client.session.get_adapter("https://")
+    assert adapter._pool_maxsize == 4
+    assert adapter.max_retries.total == 5
+
+
+def test_client_factory_timeouts(client, mocker):
+    # The SDK locked doesn't have configurable timeouts
+    factory = ClientFactory.from_client(client)
+    assert factory.request_timeout is None
+    assert factory.connect_timeout is None
+    client.api_client.rest_client.request_timeout = 30
+    factory = ClientFactory.from_client(client)
+    assert factory.request_timeout == 30
+    client_cls = mocker.patch("flywheel.Client")
+    factory()
+    client_cls.assert_called_once_with("example.com:8443:key", request_timeout=30)
+
+
+def test_client_factory_insecure():
+    client = flywheel.Client("localhost:8080:__force_insecure:key")
+    config = ClientFactory.from_client(client)().api_client.configuration
+    assert config.host == "http://localhost:8080/api"
+
+
+def test_make_client_factory(client):
+    curator = Curator()
+    curator.context = MagicMock()
+    assert make_client_factory(curator) is None
+    curator.context._client = client
+    curator.config.client_threads = 2
+    factory = make_client_factory(curator)
+    assert factory.api_key == "example.com:8443:key"
+    assert factory.pool_size == 2
+
+
+def test_get_worker_client():
+    curator = Curator()
+    curator.context = MagicMock()
+    assert get_worker_client(curator, None) is curator.context.get_client.return_value
+    factory = MagicMock()
+    assert get_worker_client(curator, factory) is factory.return_value
+    curator.context.get_client.assert_called_once()
@@ -0,0 +1,190 @@
+import dataclasses
+import threading
+from unittest.mock import MagicMock
+
+import pytest
+from flywheel_gear_toolkit.utils.reporters import AggregatedReporter, BaseLogRecord
+
+from fw_gear_hierarchy_curator.coordinator import (
+    AUTHKEY_ENV,
+    Coordinator,
+    RemoteReporter,
+    get_authkey,
+    parse_address,
+    run_worker,
+    start_workers,
+)
+
+
+@dataclasses.dataclass
+class MyLogMsg(BaseLogRecord):
+    msg: str
+
+
+@pytest.mark.parametrize(
+    "address, exp",
+    [
+        ("localhost:8000", ("localhost", 8000)),
+        ("0.0.0.0:0", ("0.0.0.0", 0)),
+        (("127.0.0.1", 1), ("127.0.0.1", 1)),
+    ],
+)
+def test_parse_address(address, exp):
+    assert parse_address(address) == exp
+
+
+@pytest.mark.parametrize("address", ["localhost", ":8000", "localhost:port"])
+def test_parse_address_invalid(address):
+    with pytest.raises(ValueError):
+        parse_address(address)
+
+
+def test_get_authkey(monkeypatch):
+    monkeypatch.delenv(AUTHKEY_ENV, raising=False)
+    curator = MagicMock()
+    assert get_authkey(curator) is None
+    assert len(get_authkey(curator, generate=True)) == 32
+    monkeypatch.setenv(AUTHKEY_ENV, "from-env")
+    assert get_authkey(curator) == b"from-env"
+    curator.config.coordinator_authkey = "from-config"
+    assert get_authkey(curator) == b"from-config"
+
+
+def test_remote_reporter():
+    rows = []
+    reporter = RemoteReporter(MyLogMsg, rows.append)
+    reporter.append_log(msg="test")
+    reporter.append_log(record=MyLogMsg(msg="test1"))
+    assert rows == [{"msg": "test"}, {"msg": "test1"}]
+
+
+def test_coordinator_no_units():
+    coordinator = Coordinator([], authkey=b"key")
+    coordinator.serve()
+    assert coordinator.completed == 0
+
+
+def run_workers(curator, coordinator, n_workers):
+    threads = [
+        threading.Thread(
+            target=run_worker, args=(curator, coordinator.address, b"key", i)
+        )
+        for i in range(n_workers)
+    ]
+    for thread in threads:
+        thread.start()
+    coordinator.serve()
+    for thread in threads:
+        thread.join()
+
+
+def test_coordinator_serves_units(mocker, tmp_path):
+    handle_work = mocker.patch("fw_gear_hierarchy_curator.coordinator.handle_work")
+    local_curators = []
+
+    def make_local_curator(cur, shared=None):
+        local_curator = MagicMock()
+        local_curator.config.report = True
+        local_curator.config.format = MyLogMsg
+        local_curators.append(local_curator)
+        return local_curator
+
+    mocker.patch(
+        "fw_gear_hierarchy_curator.state.make_local_curator",
+        side_effect=make_local_curator,
+    )
+
+    def curate(units, local_curator, handle):
+        local_curator.reporter.append_log(msg=units[0]["id"])
+
+    handle_work.side_effect = curate
+    reporter = AggregatedReporter(tmp_path / "out.csv", format=MyLogMsg)
+    units = [{"container_type": "subject", "id": str(i)} for i in range(5)]
+    coordinator = Coordinator(units, {"project": "test"}, reporter, authkey=b"key")
+
+    run_workers(MagicMock(), coordinator, 2)
+
+    assert coordinator.completed == 5
+    assert not coordinator.failed
+    assert handle_work.call_count == 5
+    assert [cur.data for cur in local_curators] == [{"project": "test"}] * 2
+    lines = (tmp_path / "out.csv").read_text().splitlines()
+    assert lines[0] == "msg"
+    assert sorted(lines[1:]) == [str(i) for i in range(5)]
+
+
+def test_coordinator_stops_on_failure(mocker):
+    handle_work = mocker.patch("fw_gear_hierarchy_curator.coordinator.handle_work")
+    handle_work.side_effect = ValueError()
+    curator = MagicMock()
+    curator.config.report = False
+    units = [{"container_type": "subject", "id": str(i)} for i in range(5)]
+    coordinator = Coordinator(units, authkey=b"key")
+
+    run_workers(curator, coordinator, 1)
+
+    assert coordinator.failed == [units[0]]
+    assert len(coordinator.units) == 4
+
+
+def test_coordinator_stops_at_deadline(mocker, tmp_path):
+    mocker.patch("fw_gear_hierarchy_curator.coordinator.handle_work")
+    curator = MagicMock()
+    curator.config.report = False
+    deadline = MagicMock(**{"remaining.return_value": 5, "projected.return_value": 10})
+    deadline.should_stop.side_effect = [False, False, True]
+    units = [{"container_type": "subject", "id": str(i)} for i in range(5)]
+    coordinator = Coordinator(units, authkey=b"key", deadline=deadline)
+
+    run_workers(curator, coordinator, 1)
+
+    assert coordinator.completed == 2
+    assert coordinator.stopped
+    assert list(coordinator.units) == units[2:]
+    assert deadline.record.call_count == 2
+
+
+def test_run_worker_setup(mocker):
+    mocker.patch("fw_gear_hierarchy_curator.coordinator.handle_work")
+    setup = mocker.patch("fw_gear_hierarchy_curator.curate.setup_worker")
+    setup.return_value.config.report = False
+    teardown = mocker.patch("fw_gear_hierarchy_curator.curate.teardown_worker")
+    curator, factory, accounts = MagicMock(), MagicMock(), []
+    units = [{"container_type": "subject", "id": "1"}]
+    coordinator = Coordinator(units, authkey=b"key")
+    thread = threading.Thread(
+        target=run_worker,
+        args=(curator, coordinator.address, b"key", 0),
+        kwargs={"accounts": accounts, "client_factory": factory},
+    )
+    thread.start()
+    coordinator.serve()
+    thread.join()
+    assert coordinator.completed == 1
+    assert setup.call_args.args[:2] == (curator, 0)
+    assert setup.call_args.kwargs["client_factory"] is factory
+    teardown.assert_called_once_with(setup.return_value, accounts)
+
+
+def test_run_worker_setup_fails(mocker):
+    mocker.patch(
+        "fw_gear_hierarchy_curator.curate.setup_worker", side_effect=ValueError()
+    )
+    teardown = mocker.patch("fw_gear_hierarchy_curator.curate.teardown_worker")
+    units = [{"container_type": "subject", "id": "1"}]
+    coordinator = Coordinator(units, authkey=b"key")
+    threading.Thread(target=coordinator._accept, daemon=True).start()
+    assert run_worker(MagicMock(), coordinator.address, b"key", 0) == 1
+    coordinator.listener.close()
+    assert coordinator.outstanding == 0
+    teardown.assert_called_once_with(None, None)
+
+
+def test_run_worker_cant_connect():
+    assert run_worker(MagicMock(), ("127.0.0.1", 1), b"key", 0) == 1
+
+
+def test_start_workers_requires_authkey(monkeypatch):
+    monkeypatch.delenv(AUTHKEY_ENV, raising=False)
+    with pytest.raises(ValueError):
+        start_workers(MagicMock(), "localhost:8000")
@@ -1,39 +1,57 @@
+import copy
+import datetime
+import json
 from unittest.mock import MagicMock
 
 import flywheel
 import pytest
 from flywheel_gear_toolkit.utils.reporters import LogRecord
 
-from fw_gear_hierarchy_curator.curate import main, start_multiproc, worker
+from fw_gear_hierarchy_curator import recycling
+from fw_gear_hierarchy_curator.curate import (
+    check_report_batching,
+    close_worker_reporter,
+    main,
+    query_main,
+    query_worker,
+    start_multiproc,
+    start_query_multiproc,
+    start_reporter,
+    start_worker_reporter,
+    stop_reporter,
+    worker,
+)
+from fw_gear_hierarchy_curator.frontier import Entry
+from fw_gear_hierarchy_curator.reports import BatchedReporter
+from fw_gear_hierarchy_curator.utils import shard_of
 
 
 def test_worker(mocker):
     curator = MagicMock()
-    copy_mock = mocker.patch("fw_gear_hierarchy_curator.curate.copy")
-    copy_mock.deepcopy.return_value = curator
-    pickle_mock = mocker.patch(
-        "fw_gear_hierarchy_curator.utils.container_from_pickleable_dict"
+    make_local = mocker.patch(
+        "fw_gear_hierarchy_curator.curate.state.make_local_curator"
     )
+    make_local.return_value = curator
     walker_mock = mocker.patch("fw_gear_hierarchy_curator.curate.make_walker")
     walker_mock.return_value.walk.return_value = [flywheel.Acquisition(label="test")]
     work = [
         {"container_type": "test", "id": "test"},
         {"container_type": "test1", "id": "test1"},
     ]
+    entries = [Entry.from_dict(unit) for unit in work]
     # Depth First
     curator.config.depth_first = True
     lock_mock = MagicMock()
     event_mock = MagicMock()
     worker(curator, work, lock_mock, 0, event_mock)
-    assert [call[0] for call in pickle_mock.call_args_list] == [
-        (work[0], curator),
-        (work[1], curator),
+    # Containers are fetched by the walkers
+    assert [call[0] for call in walker_mock.call_args_list] == [
+        (entries[0], curator),
+        (entries[1], curator),
     ]
-    assert walker_mock.call_count == 2
     assert curator.context.get_client.call_count == 1
     assert curator.validate_container.call_count == 2
     assert curator.curate_container.call_count == 2
-    pickle_mock.reset_mock()
     walker_mock.reset_mock()
     curator.reset_mock()
     # Breadth First
@@ -41,15 +59,85 @@ def test_worker(mocker):
     worker(curator, work, lock_mock, 0, event_mock)
 
     assert curator.context.get_client.call_count == 1
-    assert [call[0] for call in pickle_mock.call_args_list] == [
-        (work[0], curator),
-        (work[1], curator),
-    ]
-    assert walker_mock.call_count == 1
+    walker_mock.assert_called_once_with(entries[0], curator)
+    walker_mock.return_value.add.assert_called_once_with(entries[1:])
     assert curator.validate_container.call_count == 1
     assert curator.curate_container.call_count == 1
 
 
+def test_worker_leaves(mocker):
+    curator = MagicMock()
+    mocker.patch(
+        "fw_gear_hierarchy_curator.curate.state.make_local_curator",
+        return_value=curator,
+    )
+    walker_mock = mocker.patch("fw_gear_hierarchy_curator.curate.make_walker")
+    client = curator.context.client
+    client.get_file.side_effect = [
+        flywheel.rest.ApiException(status=404),
+        flywheel.FileEntry(
+            id="b",
+            file_id="b",
+            name="b",
+            parent_ref=flywheel.ContainerReference(type="acquisition", id="c"),
+        ),
+    ]
+    curator.config.depth_first = True
+    work = [
+        {"container_type": "file", "id": "a", "parent_type": "acquisition"},
+        {"container_type": "file", "id": "b", "parent_type": "acquisition"},
+    ]
+    worker(curator, work, MagicMock(), 0, MagicMock())
+    walker_mock.assert_not_called()
+    assert [call.args for call in client.get_file.call_args_list] == [("a",), ("b",)]
+    assert curator.curate_container.call_count == 1
+
+
+def test_worker_deadline(mocker):
+    curator = MagicMock()
+    make_local = mocker.patch(
+        "fw_gear_hierarchy_curator.curate.state.make_local_curator"
+    )
+    make_local.return_value = curator
+    handle_work = mocker.patch(
+        "fw_gear_hierarchy_curator.curate.schedule.handle_work_until_deadline"
+    )
+    handle_work.return_value = [{"container_type": "test1", "id": "test1"}]
+    curator.config.deadline = 100
+    work = [
+        {"container_type": "test", "id": "test"},
+        {"container_type": "test1", "id": "test1"},
+    ]
+    remaining = []
+    worker(curator, work, MagicMock(), 0, MagicMock(), remaining)
+    handle_work.assert_called_once()
+    assert remaining == [{"container_type": "test1", "id": "test1"}]
+
+
+def test_worker_recycled(mocker):
+    curator = MagicMock()
+    mocker.patch(
+        "fw_gear_hierarchy_curator.curate.state.make_local_curator",
+        return_value=curator,
+    )
+    left = [{"container_type": "test1", "id": "test1"}]
+    handle_work = mocker.patch(
+        "fw_gear_hierarchy_curator.curate.schedule.handle_work_until_deadline",
+        return_value=left,
+    )
+    mocker.patch.object(recycling.Limits, "reached", return_value="Curated 1")
+    curator.config.max_containers_per_worker = 1
+    work = [{"container_type": "test", "id": "test"}, *left]
+    remaining = []
+    recycled = {}
+    with pytest.raises(SystemExit) as exc_info:
+        worker(curator, work, MagicMock(), 3, MagicMock(), remaining, recycled=recycled)
+    assert exc_info.value.code == recycling.EXIT_CODE
+    assert handle_work.call_args[0][3] is None
+    assert recycled == {3: left}
+    assert remaining == []
+
+
 def test_start_multiproc(mocker, tmp_path):
     mocker.patch("fw_gear_hierarchy_curator.curate.Process")
     mocker.patch("fw_gear_hierarchy_curator.curate.Manager")
@@ -73,6 +161,169 @@ def test_start_multiproc(mocker, tmp_path):
     assert pickle_mock.call_count == 2
 
 
+def test_start_multiproc_shard(mocker, tmp_path):
+    process = mocker.patch("fw_gear_hierarchy_curator.curate.Process")
+    process.return_value.is_alive.return_value = False
+    mocker.patch("fw_gear_hierarchy_curator.curate.Manager")
+    mocker.patch("fw_gear_hierarchy_curator.curate.Lock")
+    walker = MagicMock()
+    walker.deque = [flywheel.Subject(id=f"{i:024x}") for i in range(20)]
+    curator = MagicMock()
+    curator.config.format = LogRecord
+    curator.config.workers = 2
+    curator.config.report = False
+    curator.config.shard_count = 3
+    curator.config.shard_index = 1
+
+    start_multiproc(curator, walker)
+
+    assigned = [
+        entry["id"] for call in process.call_args_list for entry in call[1]["args"][1]
+    ]
+    exp = [f"{i:024x}" for i in range(20) if shard_of(f"{i:024x}", 3) == 1]
+    assert sorted(assigned) == sorted(exp)
+
+
+def test_start_multiproc_shard_report_path(mocker, tmp_path):
+    mocker.patch("fw_gear_hierarchy_curator.curate.Process")
+    mocker.patch("fw_gear_hierarchy_curator.curate.Manager")
+    mocker.patch("fw_gear_hierarchy_curator.curate.Lock")
+    walker = MagicMock()
+    walker.deque = []
+    curator = MagicMock()
+    curator.config.format = LogRecord
+    curator.config.workers = 1
+    curator.config.path = tmp_path / "out.csv"
+    curator.config.shard_count = 2
+    curator.config.shard_index = 1
+
+    start_multiproc(curator, walker)
+
+    assert curator.config.path == tmp_path / "out.shard-1-of-2.csv"
+
+
+def test_start_multiproc_priority(mocker):
+    process = mocker.patch("fw_gear_hierarchy_curator.curate.Process")
+    process.return_value.is_alive.return_value = False
+    mocker.patch("fw_gear_hierarchy_curator.curate.Manager")
+    mocker.patch("fw_gear_hierarchy_curator.curate.Lock")
+    walker = MagicMock()
+    walker.deque = [
+        flywheel.Subject(id=str(i), modified=datetime.datetime(2023, 1, i + 1))
+        for i in range(4)
+    ]
+    curator = MagicMock()
+    curator.config.workers = 2
+    curator.config.report = False
+    curator.config.priority = "modified_desc"
+
+    start_multiproc(curator, walker)
+
+    assigned = [
+        [entry["id"] for entry in call[1]["args"][1]] for call in process.call_args_list
+    ]
+    assert assigned == [["3", "1"], ["2", "0"]]
+
+
+def test_start_multiproc_journal(mocker, tmp_path):
+    process = mocker.patch("fw_gear_hierarchy_curator.curate.Process")
+    process.return_value.is_alive.return_value = False
+    manager = mocker.patch("fw_gear_hierarchy_curator.curate.Manager")
+    left = [{"container_type": "subject", "id": "left"}]
+    manager.return_value.list.return_value = left
+    mocker.patch("fw_gear_hierarchy_curator.curate.Lock")
+    resume = [{"container_type": "subject", "id": str(i)} for i in range(3)]
+    (tmp_path / "in.json").write_text(json.dumps({"units": resume}))
+    walker = MagicMock()
+    walker.deque = [flywheel.Subject(id="not-resumed")]
+    curator = MagicMock()
+    curator.config.workers = 1
+    curator.config.report = False
+    curator.config.path = tmp_path / "out.csv"
+    curator.config.resume_journal = tmp_path / "in.json"
+
+    start_multiproc(curator, walker)
+
+    assert process.call_args[1]["args"][1] == resume
+    assert json.loads((tmp_path / "resume_journal.json").read_text()) == {"units": left}
+
+
+def test_start_multiproc_recycles(mocker):
+    processes = []
+
+    def make_process(target, args, name):
+        process = MagicMock(exitcode=recycling.EXIT_CODE if name == "0" else 0)
+        process.name = name
+        process.is_alive.return_value = False
+        processes.append(process)
+        return process
+
+    process = mocker.patch(
+        "fw_gear_hierarchy_curator.curate.Process", side_effect=make_process
+    )
+    manager = mocker.patch("fw_gear_hierarchy_curator.curate.Manager")
+    manager.return_value.Event.return_value.is_set.return_value = False
+    left = [{"container_type": "subject", "id": "1"}]
+    manager.return_value.dict.return_value = {0: left}
+    mocker.patch("fw_gear_hierarchy_curator.curate.Lock")
+    walker = MagicMock()
+    walker.deque = [flywheel.Subject(id="0"), flywheel.Subject(id="1")]
+    curator = MagicMock()
+    curator.config.workers = 1
+    curator.config.report = False
+
+    start_multiproc(curator, walker)
+
+    assert [process.name for process in processes] == ["0", "1"]
+    # The replacement gets a new id and the units left
+    assert process.call_args[1]["args"][1] == left
+    assert process.call_args[1]["args"][3] == 1
+
+
+def test_start_multiproc_parallel_level(mocker):
+    process = mocker.patch("fw_gear_hierarchy_curator.curate.Process")
+    process.return_value.is_alive.return_value = False
+    mocker.patch("fw_gear_hierarchy_curator.curate.Manager")
+    mocker.patch("fw_gear_hierarchy_curator.curate.Lock")
+    mocker.patch(
+        "fw_gear_hierarchy_curator.fanout.multiprocessing.get_start_method",
+        return_value="fork",
+    )
+    units = [
+        {"container_type": "session", "id": str(i), "snapshot": 0} for i in range(3)
+    ]
+    fan_out = mocker.patch(
+        "fw_gear_hierarchy_curator.curate.fanout.fan_out",
+        return_value=(units, [{}]),
+    )
+    walker = MagicMock()
+    walker.deque = [flywheel.Subject(id="s1")]
+    curator = MagicMock()
+    curator.config.workers = 2
+    curator.config.report = False
+    curator.config.depth_first = True
+    curator.config.parallel_level = "session"
+
+    start_multiproc(curator, walker)
+
+    fan_out.assert_called_once()
+    assert fan_out.call_args[0][1:3] == (
+        [{"container_type": "subject", "id": "s1"}],
+        "session",
+    )
+    args = [call[1]["args"] for call in process.call_args_list]
+    assert [arg[1] for arg in args] == [[units[0], units[2]], [units[1]]]
+    assert args[0][-1] == [{}]
+
+
+def test_start_multiproc_bad_shard(mocker):
+    curator = MagicMock()
+    curator.config.shard_count = 2
+    curator.config.shard_index = 2
+    with pytest.raises(ValueError):
+        start_multiproc(curator, MagicMock())
+
+
 def test_main(mocker):
     start_multiproc = mocker.patch("fw_gear_hierarchy_curator.curate.start_multiproc")
     get_curator = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
@@ -83,14 +334,179 @@ def test_main(mocker):
     curator_mock.config.stop_level = "session"
     curator_mock.config.multi = False
     get_curator.return_value = curator_mock
-    walker = mocker.patch("fw_gear_hierarchy_curator.curate.walker.Walker")
+    walker = mocker.patch("fw_gear_hierarchy_curator.curate.make_walker")
     ctx = MagicMock()
     parent = MagicMock()
     curator_path = ""
     main(ctx, parent, curator_path)
 
     get_curator.assert_called_once()
-    walker.assert_called_once_with(
-        parent, depth_first=True, reload=True, stop_level="session"
-    )
+    walker.assert_called_once_with(parent, curator_mock, compact=True)
     start_multiproc.assert_called_once_with(curator_mock, walker.return_value)
+    walker.reset_mock()
+    curator_mock.config.priority = "modified_desc"
+    main(ctx, parent, curator_path)
+    # Priorities need the metadata of the children
+    walker.assert_called_once_with(parent, curator_mock, compact=False)
+
+
+def test_query_worker(mocker):
+    curator = MagicMock()
+    make_local = mocker.patch(
+        "fw_gear_hierarchy_curator.curate.state.make_local_curator"
+    )
+    make_local.return_value = curator
+    walker_mock = mocker.patch("fw_gear_hierarchy_curator.curate.make_walker")
+    queue = MagicMock()
+    work = [
+        {"container_type": "session", "id": "test"},
+        {"container_type": "session", "id": "test1"},
+    ]
+    queue.get.side_effect = [*work, None]
+    event_mock = MagicMock()
+    query_worker(curator, queue, MagicMock(), 0, event_mock)
+    get_session = curator.context.client.get_session
+    assert [call.args for call in get_session.call_args_list] == [
+        ("test",),
+        ("test1",),
+    ]
+    walker_mock.assert_not_called()
+    assert curator.validate_container.call_count == 2
+    assert curator.curate_container.call_count == 2
+    event_mock.set.assert_not_called()
+
+
+def test_query_worker_records_curated(mocker):
+    curator = MagicMock()
+    make_local = mocker.patch(
+        "fw_gear_hierarchy_curator.curate.state.make_local_curator"
+    )
+    make_local.return_value = curator
+    before = datetime.datetime(2023, 6, 1, 12, tzinfo=datetime.timezone.utc)
+    after = before + datetime.timedelta(seconds=1)
+    curator.context.client.get_session.side_effect = [
+        flywheel.Session(id="test", modified=before),
+        # Fetched again once curated
+        flywheel.Session(id="test", modified=after),
+    ]
+    queue = MagicMock()
+    queue.get.side_effect = [{"container_type": "session", "id": "test"}, None]
+    curated = {}
+    query_worker(curator, queue, MagicMock(), 0, MagicMock(), curated=curated)
+    assert curated == {"test": after}
+
+
+def test_start_query_multiproc(mocker):
+    process = mocker.patch("fw_gear_hierarchy_curator.curate.Process")
+    process.return_value.is_alive.return_value = False
+    manager = mocker.patch("fw_gear_hierarchy_curator.curate.Manager")
+    manager.return_value.Event.return_value.is_set.return_value = False
+    mocker.patch("fw_gear_hierarchy_curator.curate.Lock")
+    curator = MagicMock()
+    curator.config.workers = 2
+    curator.config.report = False
+    work = [{"container_type": "session", "id": str(i)} for i in range(3)]
+
+    r_code = start_query_multiproc(curator, iter(work))
+
+    assert r_code == 0
+    queue = manager.return_value.Queue.return_value
+    assert [call[0][0] for call in queue.put.call_args_list] == [
+        *work,
+        None,
+        None,
+    ]
+    assert process.call_count == 2
+
+
+def test_start_query_multiproc_query_error(mocker):
+    process = mocker.patch("fw_gear_hierarchy_curator.curate.Process")
+    process.return_value.is_alive.return_value = False
+    process.return_value.exitcode = 0
+    manager = mocker.patch("fw_gear_hierarchy_curator.curate.Manager")
+    manager.return_value.Event.return_value.is_set.return_value = False
+    mocker.patch("fw_gear_hierarchy_curator.curate.Lock")
+    curator = MagicMock()
+    curator.config.workers = 2
+    curator.config.report = False
+    entry = {"container_type": "session", "id": "0"}
+
+    def work():
+        yield entry
+        raise flywheel.rest.ApiException(status=500)
+
+    assert start_query_multiproc(curator, work()) == 1
+    # The workers still get their sentinels
+    queue = manager.return_value.Queue.return_value
+    assert [call[0][0] for call in queue.put.call_args_list] == [entry, None, None]
+    process.return_value.join.assert_called()
+
+
+def test_query_main(mocker):
+    start = mocker.patch("fw_gear_hierarchy_curator.curate.start_query_multiproc")
+    get_curator = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    iter_work = mocker.patch("fw_gear_hierarchy_curator.curate.iter_query_work")
+    ctx = MagicMock()
+    parent = MagicMock()
+    query_main(ctx, parent, "", "file", query="label=test", file_query="type=nifti")
+    iter_work.assert_called_once_with(
+        ctx.client, parent, "file", query="label=test", file_query="type=nifti"
+    )
+    start.assert_called_once_with(get_curator.return_value, iter_work.return_value)
+
+
+def test_batched_reporter_merged(tmp_path):
+    curator = MagicMock()
+    curator.config.report = True
+    curator.config.format = LogRecord
+    curator.config.path = tmp_path / "output.csv"
+    curator.config.workers = 2
+    curator.config.report_batch_size = 10
+    manager = MagicMock()
+
+    assert start_reporter(curator, manager) is None
+    manager.Queue.assert_not_called()
+    curator.reporter.append_log(msg="root")
+    # Workers 0 and 1, as set up in each worker process
+    for i in range(2):
+        local_curator = MagicMock()
+        # Forked workers get a copy of the reporter, with the rows buffered
+        local_curator.reporter = copy.copy(curator.reporter)
+        local_curator.config = curator.config
+        start_worker_reporter(local_curator, i)
+        local_curator.reporter.append_log(msg=f"worker {i}")
+        close_worker_reporter(local_curator)
+    stop_reporter(curator, None)
+
+    with open(curator.config.path) as fp:
+        rows = fp.read().splitlines()
+    assert [row.split(",")[4] for row in rows[1:]] == ["root", "worker 0", "worker 1"]
+    assert list(tmp_path.iterdir()) == [curator.config.path]
+
+
+def test_worker_reporter_drops_inherited_rows(tmp_path):
+    reporter = BatchedReporter(tmp_path / "output.worker-main.csv", format=LogRecord)
+    reporter.append_log(msg="root")
+    local_curator = MagicMock()
+    local_curator.config.path = tmp_path / "output.csv"
+    local_curator.config.format = LogRecord
+    local_curator.reporter = inherited = copy.copy(reporter)
+    start_worker_reporter(local_curator, 0)
+    # Closed when the worker exits, without writing the rows of the main process
+    inherited.close()
+    reporter.close()
+    with open(reporter.output_path) as fp:
+        assert len(fp.read().splitlines()) == 2
+
+
+@pytest.mark.parametrize("name", ["output.csv.gz", "output.parquet"])
+def test_check_report_batching(name):
+    curator = MagicMock()
+    curator.config.report = True
+    curator.config.path = name
+    check_report_batching(curator)
+    curator.config.report_batch_size = 10
+    with pytest.raises(ValueError, match="report_batch_size only applies"):
+        check_report_batching(curator)
+    curator.config.path = "output.csv"
+    check_report_batching(curator)
@@ -0,0 +1,121 @@
+from unittest.mock import MagicMock
+
+import flywheel
+import pytest
+
+from fw_gear_hierarchy_curator import state
+from fw_gear_hierarchy_curator.fanout import (
+    fan_out,
+    get_parallel_level,
+    read_snapshots,
+    share_snapshots,
+    with_snapshots,
+)
+from fw_gear_hierarchy_curator.frontier import Entry
+
+
+def test_get_parallel_level():
+    curator = MagicMock()
+    curator.config.depth_first = True
+    assert get_parallel_level(curator) is None
+    curator.config.parallel_level = "session"
+    assert get_parallel_level(curator) == "session"
+    curator.config.depth_first = False
+    assert get_parallel_level(curator) is None
+    curator.config.parallel_level = "group"
+    with pytest.raises(ValueError):
+        get_parallel_level(curator)
+    curator.config.parallel_level = "session"
+    curator.config.resume_journal = "journal.json"
+    with pytest.raises(ValueError, match="resume_journal"):
+        get_parallel_level(curator)
+    # Units left at the deadline would be journaled without their snapshots
+    curator.config.resume_journal = None
+    for option in ["deadline", "time_budget"]:
+        setattr(curator.config, option, 3600)
+        with pytest.raises(ValueError, match=option):
+            get_parallel_level(curator)
+        setattr(curator.config, option, None)
+
+
+def test_fan_out(mocker):
+    make_walker = mocker.patch("fw_gear_hierarchy_curator.fanout.make_walker")
+    make_walker.return_value.walk_to.side_effect = [
+        [flywheel.Subject(id="s1"), Entry("session", "a"), Entry("session", "b")],
+        [flywheel.Subject(id="s2"), Entry("session", "c")],
+    ]
+    curator = MagicMock()
+    curator.data = {"project": "p", "seen": []}
+
+    def curate(container):
+        curator.data["subject"] = container.id
+        # Changed in place
+        curator.data["seen"].append(container.id)
+
+    file_ = {"container_type": "file", "id": "f", "parent_type": "project"}
+    units = [
+        {"container_type": "subject", "id": "s1"},
+        {"container_type": "subject", "id": "s2"},
+        file_,
+    ]
+
+    fanned, snapshots = fan_out(curator, units, "session", curate)
+
+    assert [call.args[0] for call in make_walker.call_args_list] == [
+        Entry("subject", "s1"),
+        Entry("subject", "s2"),
+    ]
+    assert fanned == [
+        {"container_type": "session", "id": "a", "snapshot": 1},
+        {"container_type": "session", "id": "b", "snapshot": 1},
+        {"container_type": "session", "id": "c", "snapshot": 2},
+        {**file_, "snapshot": 0},
+    ]
+    assert snapshots == [
+        {"project": "p", "seen": []},
+        {"project": "p", "seen": ["s1"], "subject": "s1"},
+        {"project": "p", "seen": ["s1", "s2"], "subject": "s2"},
+    ]
+
+
+def test_share_snapshots(mocker):
+    snapshots = [{"a": 1}, {"a": 2}]
+    start_method = mocker.patch(
+        "fw_gear_hierarchy_curator.fanout.multiprocessing.get_start_method"
+    )
+    start_method.return_value = "fork"
+    assert share_snapshots(snapshots) is snapshots
+    assert read_snapshots(snapshots) is snapshots
+    start_method.return_value = "spawn"
+    shared = share_snapshots(snapshots)
+    try:
+        assert isinstance(shared, state.SharedData)
+        assert read_snapshots(shared) == snapshots
+    finally:
+        shared.remove()
+    assert read_snapshots(None) is None
+
+
+def test_with_snapshots():
+    work = [
+        {"container_type": "session", "id": "a", "snapshot": 1},
+        {"container_type": "session", "id": "b", "snapshot": 0},
+    ]
+    snapshots = [{"subject": None}, {"subject": "s1"}]
+    seen = []
+
+    def handle(local_curator, entries):
+        seen.append((entries, local_curator.data))
+        local_curator.data["session"] = entries[0].id
+
+    curator = MagicMock()
+    with_snapshots(handle, work, snapshots)(
+        curator, [Entry.from_dict(unit) for unit in work]
+    )
+
+    assert seen == [
+        ([Entry("session", "a")], {"subject": "s1", "session": "a"}),
+        ([Entry("session", "b")], {"subject": None, "session": "b"}),
+    ]
+    # Units curate copies of the snapshots
+    assert snapshots == [{"subject": None}, {"subject": "s1"}]
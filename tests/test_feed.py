@@ -0,0 +1,217 @@
+import datetime
+import threading
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import flywheel
+import pytest
+
+from fw_gear_hierarchy_curator.feed import (
+    MARK_FORMAT,
+    feed_main,
+    get_state_path,
+    modified_since,
+    own_writes,
+    poll,
+    read_curated,
+    read_mark,
+    report_path,
+    run_feed,
+    write_mark,
+)
+
+MARK = datetime.datetime(2023, 6, 1, 12, tzinfo=datetime.timezone.utc)
+
+
+def make_curator(tmp_path, **options):
+    curator = MagicMock()
+    curator.config.path = tmp_path / "output.csv"
+    curator.config.report = False
+    for key, value in options.items():
+        setattr(curator.config, key, value)
+    return curator
+
+
+def test_get_state_path(tmp_path):
+    curator = make_curator(tmp_path)
+    assert get_state_path(curator) == tmp_path / "feed_state.json"
+    curator.config.feed_state = "/data/state.json"
+    assert get_state_path(curator) == Path("/data/state.json")
+
+
+def test_read_write_mark(tmp_path):
+    path = tmp_path / "state.json"
+    assert read_mark(path) is None
+    assert read_curated(path) == {}
+    write_mark(path, MARK)
+    assert read_mark(path) == MARK
+    assert read_curated(path) == {}
+    curated = {"b": MARK + datetime.timedelta(seconds=1.5), "a": MARK}
+    write_mark(path, MARK, curated)
+    assert read_mark(path) == MARK
+    assert read_curated(path) == curated
+
+
+def test_own_writes():
+    listed = {}
+    is_own_write = own_writes({"ses": MARK}, listed)
+    assert is_own_write(flywheel.Session(id="ses", modified=MARK))
+    # Modified by someone else, even before the curation was recorded
+    earlier = MARK - datetime.timedelta(microseconds=1)
+    assert not is_own_write(flywheel.Session(id="ses", modified=earlier))
+    assert not is_own_write(flywheel.Session(id="other", modified=MARK))
+    file_ = flywheel.FileEntry(
+        id="version", file_id="file", modified=MARK, parent_ref={"type": "a"}
+    )
+    assert not is_own_write(file_)
+    assert listed == {"ses": earlier, "other": MARK, "file": MARK}
+
+
+@pytest.mark.parametrize(
+    "query, mark, exp",
+    [
+        (None, None, None),
+        ("label=test", None, "label=test"),
+        (None, MARK, "modified>2023-06-01T12:00:00"),
+        ("label=test", MARK, "label=test,modified>2023-06-01T12:00:00"),
+    ],
+)
+def test_modified_since(query, mark, exp):
+    assert modified_since(query, mark) == exp
+
+
+def test_report_path():
+    assert report_path("/out/output.csv", MARK) == Path(
+        "/out/output.20230601T120000.csv"
+    )
+
+
+@pytest.mark.parametrize("r_code, advanced", [(0, True), (1, False)])
+def test_poll(mocker, tmp_path, r_code, advanced):
+    later = MARK + datetime.timedelta(hours=1)
+
+    def iter_work(*args, exclude, **kwargs):
+        exclude(flywheel.Session(id="ses", modified=later))
+        return iter([{"container_type": "session", "id": "ses"}])
+
+    iter_work = mocker.patch(
+        "fw_gear_hierarchy_curator.feed.iter_query_work", side_effect=iter_work
+    )
+    start = mocker.patch(
+        "fw_gear_hierarchy_curator.feed.curate.start_query_multiproc",
+        return_value=r_code,
+    )
+    curator = make_curator(tmp_path)
+    write_mark(tmp_path / "feed_state.json", MARK)
+    client, parent = MagicMock(), MagicMock()
+
+    assert poll(curator, client, parent, "file", file_query="type=nifti") == r_code
+
+    iter_work.assert_called_once_with(
+        client,
+        parent,
+        "file",
+        query="modified>2023-06-01T12:00:00",
+        file_query="type=nifti,modified>2023-06-01T12:00:00",
+        exclude=mocker.ANY,
+    )
+    start.assert_called_once()
+    # Advanced to the modified time set by the server
+    exp = later if advanced else MARK
+    assert read_mark(tmp_path / "feed_state.json") == exp
+
+
+def test_poll_nothing_modified(mocker, tmp_path):
+    mocker.patch(
+        "fw_gear_hierarchy_curator.feed.iter_query_work", return_value=iter([])
+    )
+    mocker.patch(
+        "fw_gear_hierarchy_curator.feed.curate.start_query_multiproc",
+        return_value=0,
+    )
+    curator = make_curator(tmp_path)
+    write_mark(tmp_path / "feed_state.json", MARK)
+    assert poll(curator, MagicMock(), MagicMock(), "session") == 0
+    assert read_mark(tmp_path / "feed_state.json") == MARK
+
+
+def test_poll_skips_own_writes(mocker, tmp_path):
+    session = flywheel.Session(id="ses", modified=MARK)
+
+    def iter_find(filters, **kwargs):
+        for term in filters.split(","):
+            if term.startswith("modified>"):
+                since = datetime.datetime.strptime(term[9:], MARK_FORMAT)
+                if session.modified <= since.replace(tzinfo=datetime.timezone.utc):
+                    return iter([])
+        return iter([session])
+
+    client = MagicMock()
+    client.sessions.iter_find.side_effect = iter_find
+    curated = []
+
+    def curate(curator, work, modified):
+        for entry in work:
+            curated.append(entry["id"])
+            # The curator updates the container it curates
+            session.modified += datetime.timedelta(seconds=1.5)
+            modified[entry["id"]] = session.modified
+        return 0
+
+    mocker.patch(
+        "fw_gear_hierarchy_curator.feed.curate.start_query_multiproc",
+        side_effect=curate,
+    )
+    curator = make_curator(tmp_path)
+    parent = flywheel.Project(id="proj")
+    for _ in range(3):
+        poll(curator, client, parent, "session")
+    assert curated == ["ses"]
+    # Modified by someone else since, within the same second
+    session.modified += datetime.timedelta(microseconds=1)
+    poll(curator, client, parent, "session")
+    assert curated == ["ses", "ses"]
+
+
+def test_poll_report_path(mocker, tmp_path):
+    mocker.patch("fw_gear_hierarchy_curator.feed.iter_query_work")
+    mocker.patch(
+        "fw_gear_hierarchy_curator.feed.curate.start_query_multiproc",
+        return_value=0,
+    )
+    curator = make_curator(tmp_path)
+    poll(curator, MagicMock(), MagicMock(), "session", report_base="/out/output.csv")
+    assert curator.config.path.parent == Path("/out")
+    assert curator.config.path.name.startswith("output.")
+    assert curator.config.path.name != "output.csv"
+
+
+def test_run_feed(mocker, tmp_path):
+    stop = threading.Event()
+    codes = iter([1, 0])
+
+    def poll_once(*args, **kwargs):
+        r_code = next(codes)
+        if r_code == 0:
+            stop.set()
+        return r_code
+
+    poll_mock = mocker.patch(
+        "fw_gear_hierarchy_curator.feed.poll", side_effect=poll_once
+    )
+    curator = make_curator(tmp_path)
+    curator.config.report = True
+
+    assert run_feed(curator, None, None, "session", 0, stop=stop) == 0
+    assert poll_mock.call_count == 2
+    assert poll_mock.call_args.kwargs["report_base"] == tmp_path / "output.csv"
+
+
+def test_feed_main(mocker):
+    run = mocker.patch("fw_gear_hierarchy_curator.feed.run_feed")
+    get_curator = mocker.patch("fw_gear_hierarchy_curator.feed.c.get_curator")
+    ctx, parent = MagicMock(), MagicMock()
+    feed_main(ctx, parent, "", 60, "session", options={"feed_state": "state.json"})
+    curator = get_curator.return_value
+    assert curator.config.feed_state == "state.json"
+    run.assert_called_once_with(curator, ctx.client, parent, "session", 60, None, None)
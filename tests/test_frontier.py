@@ -0,0 +1,182 @@
+import tempfile
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import flywheel
+import pytest
+
+from fw_gear_hierarchy_curator.frontier import (
+    Entry,
+    Frontier,
+    SpillingQueue,
+    hydrate,
+)
+
+
+def make_container(container_type, id, files=None, children=None):
+    container = MagicMock(container_type=container_type, id=id)
+    container.files = files or []
+    container.analyses = []
+    finder = {"project": "subjects", "subject": "sessions", "session": "acquisitions"}
+    if container_type in finder:
+        getattr(container, finder[container_type]).iter_find.return_value = (
+            children or []
+        )
+    return container
+
+
+@pytest.fixture
+def client():
+    """Client getting a project with two subjects, one with a file."""
+    file_ = flywheel.FileEntry(id="f1", file_id="f1", name="a.txt")
+    containers = {
+        "p": make_container(
+            "project",
+            "p",
+            children=[flywheel.Subject(id="s1"), flywheel.Subject(id="s2")],
+        ),
+        "s1": make_container("subject", "s1", files=[file_]),
+        "s2": make_container("subject", "s2"),
+        "f1": flywheel.FileEntry(
+            id="f1",
+            file_id="f1",
+            name="a.txt",
+            parent_ref=flywheel.ContainerReference(type="subject", id="s1"),
+        ),
+    }
+    client = MagicMock()
+    for name in ["project", "subject", "file"]:
+        getattr(client, f"get_{name}").side_effect = containers.__getitem__
+    return client
+
+
+def test_entry_from_container():
+    assert Entry.from_container(flywheel.Session(id="s")) == Entry("session", "s")
+    file_ = flywheel.FileEntry(
+        file_id="f", parent_ref={"type": "acquisition", "id": "a"}
+    )
+    assert Entry.from_container(file_) == Entry("file", "f", "acquisition", "a")
+    # Files listed on a container have no parent reference
+    listed = flywheel.FileEntry(file_id="f")
+    parent = flywheel.Session(id="s")
+    assert Entry.from_container(listed, parent) == Entry("file", "f", "session", "s")
+    entry = Entry("session", "s")
+    assert Entry.from_container(entry) is entry
+
+
+def test_entry_dict():
+    file_ = {"container_type": "file", "id": "f", "parent_type": "s", "parent_id": "a"}
+    assert Entry.from_dict(file_).to_dict() == file_
+    session = {"container_type": "session", "id": "s"}
+    assert Entry.from_dict(session).to_dict() == session
+
+
+def test_entry_is_compact():
+    entry = Entry("session", "s")
+    with pytest.raises(AttributeError):
+        entry.label = "ses-1"
+    assert not hasattr(entry, "__dict__")
+    assert entry.container_type is Entry("session", "s2").container_type
+
+
+def test_hydrate(caplog):
+    client = MagicMock()
+    assert hydrate(Entry("session", "s"), client) is client.get_session.return_value
+    client.get_session.assert_called_once_with("s")
+    client.get_session.side_effect = flywheel.rest.ApiException(status=404)
+    assert hydrate(Entry("session", "s"), client) is None
+    assert caplog.record_tuples[0][2].startswith("Could not get container")
+
+
+def test_frontier_depth_first(client):
+    w = Frontier(Entry("project", "p"), client, depth_first=True, reload=True)
+    walked = [cont.id for cont in w.walk()]
+    assert walked == ["p", "s2", "s1", "f1"]
+
+
+def test_frontier_breadth_first(client):
+    w = Frontier(Entry("project", "p"), client, depth_first=False, reload=True)
+    assert w.next().id == "p"
+    # Only entries are queued
+    assert list(w.deque) == [Entry("subject", "s1"), Entry("subject", "s2")]
+    assert [cont.id for cont in w.walk()] == ["s1", "s2", "f1"]
+    assert [call.args for call in client.get_file.call_args_list] == [("f1",)]
+
+
+def test_frontier_reloads_root(client):
+    w = Frontier(flywheel.Project(id="p"), client, reload=True)
+    assert w.deque[0] == Entry("project", "p")
+
+
+def test_frontier_not_compact(client):
+    project = client.get_project("p")
+    w = Frontier(project, client, reload=False)
+    assert w.next() is project
+    assert [sub.id for sub in w.deque] == ["s1", "s2"]
+    client.get_subject.assert_not_called()
+
+
+def test_frontier_skips_missing(client, caplog):
+    client.get_subject.side_effect = flywheel.rest.ApiException(status=404)
+    w = Frontier(Entry("project", "p"), client, depth_first=False, reload=True)
+    assert [cont.id for cont in w.walk()] == ["p"]
+    w.add([Entry("subject", "s1"), Entry("project", "p")])
+    assert w.next().id == "p"
+
+
+def test_frontier_callback(client):
+    w = Frontier(Entry("project", "p"), client, reload=True)
+    assert [cont.id for cont in w.walk(callback=lambda _: False)] == ["p"]
+
+
+def test_spilling_queue(tmp_path):
+    entries = [Entry("session", str(i)) for i in range(10)]
+    queue = SpillingQueue(3, entries[:5], directory=str(tmp_path))
+    assert len(queue.memory) == 3
+    assert queue.spilled == 2
+    assert len(list(tmp_path.iterdir())) == 1
+    assert queue.popleft() == entries[0]
+    # Entries are spilled until the database is drained, to keep the order
+    queue.extend(entries[5:])
+    assert len(queue) == 9
+    assert list(queue) == entries[1:]
+    assert [queue.popleft() for _ in range(9)] == entries[1:]
+    with pytest.raises(IndexError):
+        queue.popleft()
+    queue.append(entries[0])
+    assert queue.spilled == 0
+    path = queue.path
+    del queue
+    assert not Path(path).exists()
+
+
+def test_spilling_queue_size():
+    with pytest.raises(ValueError):
+        SpillingQueue(0)
+
+
+def test_frontier_spills(client, tmp_path, monkeypatch):
+    monkeypatch.setattr(tempfile, "tempdir", str(tmp_path))
+    project = client.get_project("p")
+    w = Frontier(project, client, depth_first=False, size=1)
+    assert isinstance(w.deque, SpillingQueue)
+    assert [cont.id for cont in w.walk()] == ["p", "s1", "s2", "f1"]
+    # Children are queued as entries, fetched when popped
+    assert [call.args for call in client.get_subject.call_args_list] == [
+        ("s1",),
+        ("s2",),
+    ]
+    # The file spilled with its parent and is fetched by file ID
+    client.get_file.assert_called_once_with("f1")
+    # Depth-first frontiers aren't bounded
+    w = Frontier(project, client, depth_first=True, size=1)
+    assert not isinstance(w.deque, SpillingQueue)
+
+
+def test_frontier_walk_to(client):
+    w = Frontier(Entry("project", "p"), client, reload=True)
+    walked = list(w.walk_to("subject"))
+    assert walked[0].id == "p"
+    # Containers at the level are returned as queued
+    assert walked[1:] == [Entry("subject", "s2"), Entry("subject", "s1")]
+    client.get_subject.assert_not_called()
@@ -0,0 +1,54 @@
+"""Modules imported by the gear startup.
+
+Each test imports in a new interpreter, as the gear does when it starts.
+"""
+import subprocess
+import sys
+import textwrap
+from pathlib import Path
+
+ROOT = Path(__file__).parents[1]
+ASSETS_DIR = Path(__file__).parent / "assets"
+
+# Modules imported by `run.py`.
+STARTUP = (
+    "from flywheel_gear_toolkit import GearToolkitContext; "
+    "from fw_gear_hierarchy_curator import curate, feed, parser"
+)
+# Not needed until a curator uses them.
+HEAVY_MODULES = ["pandas", "matplotlib", "nibabel", "pydicom", "lxml", "PIL"]
+
+
+def imported_modules(code):
+    """Names of the modules imported once `code` has run."""
+    code += "\nimport sys\nprint('\\n'.join(sys.modules))"
+    out = subprocess.run(
+        [sys.executable, "-c", code],
+        cwd=ROOT,
+        capture_output=True,
+        text=True,
+        check=True,
+    )
+    return set(out.stdout.splitlines())
+
+
+def test_startup_imports():
+    modules = imported_modules(STARTUP)
+    assert "fw_gear_hierarchy_curator.curate" in modules
+    assert not [name for name in modules if name.split(".")[0] in HEAVY_MODULES]
+
+
+def test_load_curator_lazy_imports():
+    code = textwrap.dedent(
+        f"""
+        import sys
+        from unittest.mock import MagicMock
+        from fw_gear_hierarchy_curator.curate import load_curator
+
+        curator = load_curator(MagicMock(), {str(ASSETS_DIR / "pandas_curator.py")!r})
+        assert "pandas.core.frame" not in sys.modules
+        curator.curate_session(MagicMock(label="ses-1"))
+        assert curator.data["sessions"]["label"][0] == "ses-1"
+        """
+    )
+    assert "pandas" in imported_modules(code)
@@ -0,0 +1,90 @@
+import io
+from unittest.mock import MagicMock
+
+import pandas as pd
+import pytest
+from flywheel_gear_toolkit.utils.curator import HierarchyCurator
+
+from fw_gear_hierarchy_curator import inputs
+from fw_gear_hierarchy_curator.inputs import (
+    BufferReader,
+    SharedInput,
+    attach_inputs,
+    get_buffer,
+    open_buffer,
+    publish_inputs,
+)
+
+
+class Curator(HierarchyCurator):
+    def curate_container(self, container):
+        pass
+
+
+@pytest.fixture(autouse=True)
+def reset_maps():
+    yield
+    inputs._maps.clear()
+
+
+@pytest.fixture
+def csv_input(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text("label,value\nsub-1,1\nsub-2,2\n")
+    return path
+
+
+def test_publish_inputs(tmp_path, csv_input):
+    (tmp_path / "empty.csv").touch()
+    curator = Curator(
+        additional_input_one=str(csv_input),
+        additional_input_two=tmp_path / "empty.csv",
+        additional_input_three=tmp_path / "missing.csv",
+    )
+    assert publish_inputs(curator) == {
+        str(csv_input): SharedInput(str(csv_input), csv_input.stat().st_size)
+    }
+    assert publish_inputs(Curator()) == {}
+
+
+def test_buffer_reader():
+    reader = io.BufferedReader(BufferReader(memoryview(b"abcdef")))
+    assert reader.read(2) == b"ab"
+    assert reader.seek(-1, io.SEEK_END) == 5
+    assert reader.read() == b"f"
+    reader.seek(1)
+    assert reader.read() == b"bcdef"
+
+
+def test_open_buffer(csv_input):
+    buffer = get_buffer(SharedInput(str(csv_input), csv_input.stat().st_size))
+    assert bytes(buffer) == csv_input.read_bytes()
+    with open_buffer(buffer) as fp:
+        assert fp.readlines() == ["label,value\n", "sub-1,1\n", "sub-2,2\n"]
+    with open_buffer(buffer, "rb") as fp:
+        assert fp.read() == csv_input.read_bytes()
+    with open_buffer(buffer) as fp:
+        assert list(pd.read_csv(fp)["label"]) == ["sub-1", "sub-2"]
+
+
+def test_attach_inputs(tmp_path, csv_input):
+    curator = Curator(additional_input_one=csv_input)
+    curator.lock = MagicMock()
+    attach_inputs(curator, publish_inputs(curator))
+    with curator.open_input(curator.additional_input_one) as fp:
+        assert fp.readline() == "label,value\n"
+    curator.lock.acquire.assert_not_called()
+    # Other files and writes take the lock.
+    with curator.open_input(tmp_path / "out.txt", "w") as fp:
+        fp.write("out")
+    with curator.open_input(csv_input, "a") as fp:
+        fp.write("sub-3,3\n")
+    assert curator.lock.acquire.call_count == 2
+    assert curator.lock.release.call_count == 2
+
+
+def test_attach_inputs_none(csv_input):
+    curator = Curator(additional_input_one=csv_input)
+    open_input = curator.open_input
+    attach_inputs(curator, {})
+    assert curator.open_input == open_input
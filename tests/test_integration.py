@@ -1,17 +1,15 @@
-import copy
 import dataclasses
+import json
 import logging
 import multiprocessing
 import pickle
+import pstats
 import sys
-from contextlib import contextmanager, nullcontext
-from logging import handlers
-from multiprocessing import Queue
 from pathlib import Path
 from unittest.mock import MagicMock, Mock
 
-import _pytest
 import dill
+import flywheel
 import pandas as pd
 import pytest
 from flywheel_gear_toolkit.utils.curator import HierarchyCurator
@@ -32,57 +30,6 @@ def reset_log():
     log = logging.getLogger()
 
 
-@pytest.fixture()
-def caplog_multithreaded():
-    """Logs from multiple processes don't get propagated back  to the
-    pytest caplog fixture correctly.
-
-    In this context manager, we remove the pytest caplog handlers,
-    and add a QueueHandler (which uses a multiprocessing.Queue so can
-    handle sharing between processes).  Whenever a log message is
-    written in the context manager, it goes to the Queue instead.
-
-    Then when we finish the context manager, we pull everything off
-    the queue and re-emit the log to the proper logger in the
-    MainProcess.
-    """
-
-    @contextmanager
-    def ctx():
-        logger_queue = Queue()
-        logger = logging.getLogger()
-        # Save copy of original handlers to restore
-        orig_handlers = copy.copy(logger.handlers)
-        # Set level to 0 to capture every log.
-        logger.setLevel(0)
-        # Add QueueHandler
-        logger.addHandler(handlers.QueueHandler(logger_queue))
-        # Remove pytest LogCaptureHandlers
-        logger.handlers = [
-            handler
-            for handler in logger.handlers
-            if not isinstance(handler, _pytest.logging.LogCaptureHandler)
-        ]
-        yield
-        # Restore original handlers
-        logger = logging.getLogger()
-        logger.handlers = orig_handlers
-        # Re-emit logs.
-        while True:
-            log_record: logging.LogRecord = logger_queue.get_nowait()
-            if log_record.message == "END":
-                break
-            logger = logging.getLogger(log_record.name)
-            logger._log(
-                level=log_record.levelno,
-                msg=log_record.message,
-                args=log_record.args,
-                exc_info=log_record.exc_info,
-            )
-
-    return ctx
-
-
 log = logging.getLogger("test")
 
 
@@ -145,6 +92,30 @@ class reporter(HierarchyCurator):
         self.reporter.append_log(msg=path)
 
 
+class input_reporter(reporter):
+    def open_input(self, path, mode="r"):
+        raise AssertionError("Input opened with the lock")
+
+    def curate_subject(self, sub):
+        with self.open_input(self.additional_input_one) as fp:
+            labels = fp.read().split()
+        self.reporter.append_log(msg=f"{sub.label} {sub.label in labels}")
+
+
+class FileGetter:
+    """`get_file` of the mocked hierarchy, finding files by file ID."""
+
+    def __init__(self, containers):
+        self.containers = containers
+
+    def __call__(self, file_id):
+        for container in self.containers.containers.values():
+            for file_ in container.files or []:
+                if file_.file_id == file_id:
+                    return file_
+        raise flywheel.rest.ApiException(status=404, reason="Not Found")
+
+
 @pytest.fixture
 def oneoff_curator(tmp_path, containers):
     def _gen(multi=True):
@@ -155,6 +126,7 @@ def oneoff_curator(tmp_path, containers):
             client_kwargs[f"get_{c_type}"] = PickleableMock(
                 side_effect=containers.get_container
             )
+        client_kwargs["get_file"] = PickleableMock(side_effect=FileGetter(containers))
         client_mock = PickleableMock(**client_kwargs)
         context_mock = PickleableMock(client=client_mock)
         my_reporter.context = context_mock
@@ -219,6 +191,22 @@ def test_curate_errors(fw_project, oneoff_curator, mocker, containers):
     assert all([val in records for val in exp])
 
 
+def test_curate_errors_logged(fw_project, oneoff_curator, mocker, containers, caplog):
+    project = fw_project(n_subs=2)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    project.subjects()[0].label = None
+    get_curator_patch.return_value = oneoff_curator(multi=True)
+    get_curator_patch.return_value.curate_subject = curate_subject
+    context_mock = MagicMock()
+    assert main(context_mock, project, curator_path) == 1
+    errors = [record for record in caplog.records if record.levelno == logging.CRITICAL]
+    assert errors[0].getMessage() == "Could not finish curation, worker errored early."
+    assert errors[0].processName in {"0", "1"}
+    assert "Traceback" in errors[0].exc_text
+
+
 def test_curate_main_depth_first(fw_project, oneoff_curator, mocker, containers):
     project = fw_project(n_subs=2)
     curator_path = ASSETS_DIR / "dummy_curator.py"
@@ -249,6 +237,265 @@ def test_curate_main_depth_first(fw_project, oneoff_curator, mocker, containers)
     assert all([val in records for val in exp])
 
 
+def test_curate_main_worker_logs(
+    fw_project, oneoff_curator, mocker, containers, caplog
+):
+    project = fw_project(n_subs=2)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+    for subject in project.subjects():
+        for session in subject.sessions():
+            for acq in session.acquisitions():
+                for file_ in acq.files:
+                    file_.reload = lambda: file_
+
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    get_curator_patch.return_value = oneoff_curator(multi=True)
+    context_mock = MagicMock()
+
+    with caplog.at_level(logging.INFO):
+        assert main(context_mock, project, curator_path) == 0
+
+    # Records of the workers are handled by the main process.
+    paths = {
+        record.getMessage(): record.processName
+        for record in caplog.records
+        if record.name == "test"
+    }
+    assert paths["test"] == "MainProcess"
+    assert paths["test/sub-0/ses-0-sub-0/acq-0-ses-0-sub-0"] in {"0", "1"}
+    assert len(paths) == 7
+
+
+@pytest.fixture
+def start_method():
+    yield
+    multiprocessing.set_start_method("fork", force=True)
+
+
+@pytest.mark.parametrize("method", ["forkserver", "spawn"])
+def test_curate_main_start_method(
+    fw_project, oneoff_curator, mocker, containers, caplog, start_method, method
+):
+    # The containers are pickled with the client mock, drop earlier tests' ones.
+    containers.reset()
+    project = fw_project(n_subs=2)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    curator = oneoff_curator(multi=True)
+    # Files can't be reloaded by the workers without the client
+    curator.config.reload = False
+    get_curator_patch.return_value = curator
+    context_mock = MagicMock()
+
+    options = {"start_method": method}
+    with caplog.at_level(logging.INFO):
+        assert main(context_mock, project, curator_path, options=options) == 0
+    assert multiprocessing.get_start_method() == method
+    records = list(pd.read_csv(curator.config.path)["msg"].values)
+    assert "test/sub-0/ses-0-sub-0/acq-0-ses-0-sub-0" in records
+    assert "test/sub-1/ses-0-sub-1/acq-0-ses-0-sub-1" in records
+    messages = [record.getMessage() for record in caplog.records]
+    assert sum(msg.startswith("Started in ") for msg in messages) == 2
+    assert sum(msg.startswith("Curated first container ") for msg in messages) == 2
+
+
+def test_curate_main_batched_report(fw_project, oneoff_curator, mocker, containers):
+    project = fw_project(n_subs=3)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+    for subject in project.subjects():
+        for session in subject.sessions():
+            for acq in session.acquisitions():
+                for file_ in acq.files:
+                    file_.reload = lambda: file_
+
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    get_curator_patch.return_value = oneoff_curator(multi=True)
+    context_mock = MagicMock()
+
+    r_code = main(context_mock, project, curator_path, options={"report_batch_size": 2})
+
+    assert r_code == 0
+    path = get_curator_patch.return_value.config.path
+    records = list(pd.read_csv(path)["msg"].values)
+    assert len(records) == 10
+    assert records[0] == "test"
+    assert "test/sub-2/ses-0-sub-2/acq-0-ses-0-sub-2" in records
+    assert list(path.parent.glob("output.worker-*")) == []
+
+
+def test_curate_main_compressed_report(
+    fw_project, oneoff_curator, mocker, containers, tmp_path
+):
+    project = fw_project(n_subs=2)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+    for subject in project.subjects():
+        for session in subject.sessions():
+            for acq in session.acquisitions():
+                for file_ in acq.files:
+                    file_.reload = lambda: file_
+
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    get_curator_patch.return_value = oneoff_curator(multi=True)
+    get_curator_patch.return_value.config.path = tmp_path / "output.csv.gz"
+    context_mock = MagicMock()
+
+    assert main(context_mock, project, curator_path) == 0
+    records = list(pd.read_csv(tmp_path / "output.csv.gz")["msg"].values)
+    assert len(records) == 7
+    assert "test/sub-1/ses-0-sub-1/acq-0-ses-0-sub-1" in records
+
+
+def test_curate_main_metrics(fw_project, oneoff_curator, mocker, containers, tmp_path):
+    project = fw_project(n_subs=2)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+    for subject in project.subjects():
+        for session in subject.sessions():
+            for acq in session.acquisitions():
+                for file_ in acq.files:
+                    file_.reload = lambda: file_
+
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    get_curator_patch.return_value = oneoff_curator(multi=True)
+    context_mock = MagicMock()
+
+    r_code = main(context_mock, project, curator_path, options={"metrics_interval": 60})
+
+    assert r_code == 0
+    with open(tmp_path / "metrics.json") as fp:
+        out = json.load(fp)
+    assert out["curated"]["project"] == 1
+    assert out["curated"]["subject"] == 2
+    assert out["curated"]["acquisition"] == 2
+    assert set(out["queue_depth"]) == {"main", "0", "1"}
+
+
+def test_curate_main_trace(fw_project, oneoff_curator, mocker, containers, tmp_path):
+    project = fw_project(n_subs=2)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+    for subject in project.subjects():
+        for session in subject.sessions():
+            for acq in session.acquisitions():
+                for file_ in acq.files:
+                    file_.reload = lambda: file_
+
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    get_curator_patch.return_value = oneoff_curator(multi=True)
+    context_mock = MagicMock()
+
+    assert main(context_mock, project, curator_path, options={"trace": True}) == 0
+    with open(tmp_path / "trace.json") as fp:
+        events = json.load(fp)["traceEvents"]
+    spans = [event for event in events if event["ph"] == "X"]
+    curated = [span for span in spans if span["name"].startswith("curate ")]
+    assert {span["args"]["worker"] for span in curated} == {"main", 0, 1}
+    assert sum(span["name"] == "curate subject" for span in curated) == 2
+    # Containers are fetched when popped from the frontier, from the root to the
+    # files of both subjects
+    hydrated = [span["args"]["path"] for span in spans if span["name"] == "hydrate"]
+    assert len(hydrated) == 9
+    assert sum(path.startswith("subject/") for path in hydrated) == 2
+    assert list(tmp_path.glob("trace.worker-*")) == []
+
+
+def test_curate_main_api_accounting(
+    fw_project, oneoff_curator, mocker, containers, caplog
+):
+    project = fw_project(n_subs=2)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+    for subject in project.subjects():
+        for session in subject.sessions():
+            for acq in session.acquisitions():
+                for file_ in acq.files:
+                    file_.reload = lambda: file_
+
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    get_curator_patch.return_value = oneoff_curator(multi=True)
+    context_mock = MagicMock()
+
+    with caplog.at_level(logging.INFO):
+        r_code = main(
+            context_mock, project, curator_path, options={"api_accounting": True}
+        )
+
+    assert r_code == 0
+    assert "SDK requests per curator method:" in caplog.text
+
+
+def test_curate_main_profile(fw_project, oneoff_curator, mocker, containers, tmp_path):
+    project = fw_project(n_subs=2)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+    for subject in project.subjects():
+        for session in subject.sessions():
+            for acq in session.acquisitions():
+                for file_ in acq.files:
+                    file_.reload = lambda: file_
+
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    get_curator_patch.return_value = oneoff_curator(multi=True)
+    context_mock = MagicMock()
+
+    assert main(context_mock, project, curator_path, options={"profile": True}) == 0
+    stats = pstats.Stats(str(tmp_path / "profile.prof"))
+    assert any(func[2] == "curate_one" for func in stats.stats)
+    assert "curate_one" in (tmp_path / "profile.collapsed").read_text()
+    assert list(tmp_path.glob("profile.worker-*")) == []
+
+
+def test_curate_main_slow_threshold(
+    fw_project, oneoff_curator, mocker, containers, tmp_path
+):
+    project = fw_project(n_subs=2)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+    for subject in project.subjects():
+        for session in subject.sessions():
+            for acq in session.acquisitions():
+                for file_ in acq.files:
+                    file_.reload = lambda: file_
+
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    get_curator_patch.return_value = oneoff_curator(multi=True)
+    context_mock = MagicMock()
+
+    # Every container in the workers is slow.
+    options = {"slow_threshold": 1e-9}
+    assert main(context_mock, project, curator_path, options=options) == 0
+    slow = pd.read_csv(tmp_path / "slow_containers.csv")
+    assert slow["container_type"].value_counts().to_dict() == {
+        "subject": 2,
+        "session": 2,
+        "acquisition": 2,
+        "file": 2,
+    }
+    assert set(slow["worker"]) == {0, 1}
+
+
+def test_curate_main_shared_inputs(
+    fw_project, oneoff_curator, mocker, containers, tmp_path
+):
+    project = fw_project(n_subs=2)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+    for subject in project.subjects():
+        for session in subject.sessions():
+            for acq in session.acquisitions():
+                for file_ in acq.files:
+                    file_.reload = lambda: file_
+    input_path = tmp_path / "input.csv"
+    input_path.write_text("label\nsub-0\n")
+
+    curator = oneoff_curator(multi=True)
+    curator.__class__ = input_reporter
+    curator.additional_input_one = str(input_path)
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    get_curator_patch.return_value = curator
+    context_mock = MagicMock()
+
+    assert main(context_mock, project, curator_path) == 0
+    records = list(pd.read_csv(curator.config.path)["msg"].values)
+    assert "sub-0 True" in records
+    assert "sub-1 False" in records
+
+
 """
     Note: multiprocessing cannot be fully breadth_first.
 
@@ -312,3 +559,39 @@ def test_curate_main_breadth_first(
         "test/sub-1/ses-0-sub-1/acq-0-ses-0-sub-1",
     ]
     assert all([val in records for val in exp])
+
+
+def test_curate_main_coordinator(fw_project, oneoff_curator, mocker, containers):
+    project = fw_project(n_subs=3)
+    curator_path = ASSETS_DIR / "dummy_curator.py"
+    for subject in project.subjects():
+        for session in subject.sessions():
+            for acq in session.acquisitions():
+                for file_ in acq.files:
+                    file_.reload = lambda: file_
+    get_curator_patch = mocker.patch("fw_gear_hierarchy_curator.curate.c.get_curator")
+    get_curator_patch.return_value = oneoff_curator(multi=True)
+    context_mock = MagicMock()
+
+    r_code = main(
+        context_mock,
+        project,
+        curator_path,
+        options={"coordinator_address": "127.0.0.1:0"},
+    )
+
+    assert r_code == 0
+    records = list(
+        pd.read_csv(get_curator_patch.return_value.config.path)["msg"].values
+    )
+    exp = [
+        "test",
+        "test/sub-0",
+        "test/sub-0/ses-0-sub-0",
+        "test/sub-0/ses-0-sub-0/acq-0-ses-0-sub-0",
+        "test/sub-1",
+        "test/sub-1/ses-0-sub-1",
+        "test/sub-2/ses-0-sub-2/acq-0-ses-0-sub-2",
+    ]
+    assert all([val in records for val in exp])
+    assert len(records) == 10
@@ -0,0 +1,46 @@
+import sys
+
+import pytest
+
+from fw_gear_hierarchy_curator.lazy import lazy_import, lazy_imports
+
+
+@pytest.fixture
+def target(tmp_path, mocker):
+    """A module recording when it is executed."""
+    (tmp_path / "lazy_target.py").write_text(
+        "import sys\nsys.lazy_target_loaded = True\nVALUE = 1\n"
+    )
+    mocker.patch.object(sys, "path", [str(tmp_path), *sys.path])
+    yield "lazy_target"
+    sys.modules.pop("lazy_target", None)
+    vars(sys).pop("lazy_target_loaded", None)
+
+
+def test_lazy_import(target):
+    module = lazy_import(target)
+    assert not hasattr(sys, "lazy_target_loaded")
+    assert module.VALUE == 1
+    assert sys.lazy_target_loaded
+    assert lazy_import(target) is module
+
+
+def test_lazy_import_missing():
+    with pytest.raises(ModuleNotFoundError):
+        lazy_import("missing_module")
+
+
+def test_lazy_imports(target):
+    meta_path = list(sys.meta_path)
+    with lazy_imports(["other"]):
+        import lazy_target  # pylint: disable=import-outside-toplevel
+
+    assert sys.lazy_target_loaded
+    del sys.modules[target], sys.lazy_target_loaded
+    with lazy_imports([target]):
+        import lazy_target  # pylint: disable=import-outside-toplevel
+
+        assert not hasattr(sys, "lazy_target_loaded")
+    assert sys.meta_path == meta_path
+    assert lazy_target.VALUE == 1
+    assert sys.lazy_target_loaded
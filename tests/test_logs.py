@@ -0,0 +1,138 @@
+import logging
+import multiprocessing
+import os
+import queue
+import signal
+from unittest.mock import MagicMock
+
+import pytest
+
+from fw_gear_hierarchy_curator import logs
+from fw_gear_hierarchy_curator.logs import (
+    BatchingHandler,
+    LogListener,
+    RateLimiter,
+    start_logging,
+    start_worker_logging,
+    stop_worker_logging,
+)
+
+
+@pytest.fixture
+def root_handlers():
+    root = logging.getLogger()
+    handlers, level = root.handlers, root.level
+    yield
+    root.handlers = handlers
+    root.setLevel(level)
+    logs._handler = None
+
+
+def make_record(msg, level=logging.INFO, args=None, exc_info=None):
+    return logging.LogRecord("test", level, __file__, 1, msg, args, exc_info)
+
+
+def test_rate_limiter(mocker):
+    monotonic = mocker.patch("fw_gear_hierarchy_curator.logs.time.monotonic")
+    monotonic.return_value = 0
+    limiter = RateLimiter(2)
+    assert [limiter.allow() for _ in range(3)] == [True, True, False]
+    monotonic.return_value = 0.5
+    assert [limiter.allow() for _ in range(2)] == [True, False]
+    assert limiter.dropped == 2
+
+
+def test_batching_handler():
+    log_queue = queue.Queue()
+    handler = BatchingHandler(log_queue, batch_size=2, flush_interval=60)
+    handler.emit(make_record("a %s", args=("b",)))
+    assert log_queue.empty()
+    handler.emit(make_record("c"))
+    batch = log_queue.get_nowait()
+    assert [record.msg for record in batch] == ["a b", "c"]
+    assert batch[0].args is None
+    # Warnings are sent immediately
+    handler.emit(make_record("d", logging.WARNING))
+    assert [record.msg for record in log_queue.get_nowait()] == ["d"]
+    handler.emit(make_record("e"))
+    handler.close()
+    assert [record.msg for record in log_queue.get_nowait()] == ["e"]
+
+
+def test_batching_handler_exc_info():
+    log_queue = queue.Queue()
+    handler = BatchingHandler(log_queue)
+    try:
+        raise ValueError("bad")
+    except ValueError as exc:
+        record = make_record("failed", logging.ERROR, exc_info=(ValueError, exc, None))
+    handler.emit(record)
+    (record,) = log_queue.get_nowait()
+    assert record.exc_info is None
+    assert "ValueError: bad" in record.exc_text
+
+
+def test_batching_handler_rate_limit():
+    log_queue = queue.Queue()
+    handler = BatchingHandler(log_queue, flush_interval=60, rate_limit=2)
+    for i in range(5):
+        handler.emit(make_record(str(i), logging.DEBUG))
+    handler.emit(make_record("info"))
+    handler.flush()
+    msgs = [record.msg for record in log_queue.get_nowait()]
+    assert msgs[:3] == ["0", "1", "info"]
+    assert msgs[3].startswith("Dropped 3 debug records")
+
+
+def test_log_listener(caplog):
+    log_queue = queue.Queue()
+    listener = LogListener(log_queue)
+    listener.start()
+    log_queue.put([make_record("one"), make_record("two", logging.DEBUG)])
+    with caplog.at_level(logging.INFO):
+        listener.stop()
+    assert [record.msg for record in caplog.records] == ["one"]
+
+
+def test_worker_logging(root_handlers):
+    log_queue = queue.Queue()
+    curator = MagicMock()
+    curator.config.log_rate_limit = 0
+    start_worker_logging(curator, None)
+    assert logs._handler is None
+    start_worker_logging(curator, log_queue)
+    assert logging.getLogger().handlers == [logs._handler]
+    assert logs._handler.limiter is None
+    logging.getLogger("test").warning("worker")
+    stop_worker_logging()
+    assert [record.msg for record in log_queue.get_nowait()] == ["worker"]
+
+
+def test_worker_logging_level(root_handlers):
+    curator = MagicMock()
+    logging.getLogger().setLevel(logging.DEBUG)
+    log_queue, listener = start_logging(curator)
+    listener.stop()
+    assert curator.config.log_level == logging.DEBUG
+    # As in a spawned worker
+    logging.getLogger().setLevel(logging.WARNING)
+    start_worker_logging(curator, log_queue)
+    assert logging.getLogger().level == logging.DEBUG
+
+
+def log_and_die(log_queue):
+    start_worker_logging(MagicMock(), log_queue)
+    logging.getLogger("test").info("worker")
+    stop_worker_logging(wait=True)
+    assert logging.getLogger().handlers == []
+    # Killed right away, like workers once a worker has failed
+    os.kill(os.getpid(), signal.SIGKILL)
+
+
+def test_stop_worker_logging_wait():
+    log_queue = multiprocessing.Queue()
+    proc = multiprocessing.Process(target=log_and_die, args=(log_queue,))
+    proc.start()
+    proc.join()
+    assert proc.exitcode == -signal.SIGKILL
+    assert [record.msg for record in log_queue.get(timeout=5)] == ["worker"]
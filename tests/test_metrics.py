@@ -0,0 +1,190 @@
+import json
+import logging
+from unittest.mock import MagicMock
+
+import pytest
+
+from fw_gear_hierarchy_curator import metrics
+from fw_gear_hierarchy_curator.metrics import (
+    Histogram,
+    Metrics,
+    MetricsWriter,
+    aggregate,
+    get_metrics_path,
+    instrument_client,
+    start_metrics,
+    start_worker_metrics,
+    stop_metrics,
+    summarize,
+    to_prometheus,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_metrics():
+    yield
+    metrics.set_metrics(None)
+
+
+def test_histogram():
+    hist = Histogram([0.1, 1])
+    for value in [0.05, 0.1, 0.5, 2]:
+        hist.observe(value)
+    assert hist.counts == [2, 1, 1]
+    assert hist.count == 4
+    other = Histogram.from_dict(hist.to_dict())
+    hist.merge(other)
+    assert hist.counts == [4, 2, 2]
+    assert hist.sum == pytest.approx(5.3)
+
+
+def test_metrics_publish():
+    shared = {}
+    m = Metrics(0, shared, publish_interval=0)
+    m.record_container("session", True, 3)
+    m.record_container("session", False, 2)
+    m.record_api("GET /sessions/{SessionId}", 0.2)
+    m.publish()
+    assert shared[0]["curated"] == {"session": 1}
+    assert shared[0]["rejected"] == {"session": 1}
+    assert shared[0]["queue_depth"] == 2
+    assert shared[0]["api"]["GET /sessions/{SessionId}"]["count"] == 1
+
+
+def test_metrics_publish_interval():
+    shared = {}
+    m = Metrics(0, shared, publish_interval=60)
+    m.record_container("session", True, 0)
+    assert shared == {}
+
+
+def test_record_container_disabled():
+    metrics.record_container("session", True)
+    m = Metrics()
+    metrics.set_metrics(m)
+    metrics.record_container("session", True)
+    assert m.curated == {"session": 1}
+
+
+def test_instrument_client():
+    client = MagicMock()
+    call_api = client.api_client.call_api
+    call_api.return_value = "response"
+    m = Metrics()
+    instrument_client(client, m)
+    out = client.api_client.call_api("/sessions/{SessionId}", "GET", {"id": 1})
+    assert out == "response"
+    call_api.assert_called_once_with("/sessions/{SessionId}", "GET", {"id": 1})
+    assert m.api["GET /sessions/{SessionId}"].count == 1
+
+
+def test_instrument_client_error():
+    client = MagicMock()
+    client.api_client.call_api.side_effect = ValueError()
+    m = Metrics()
+    instrument_client(client, m)
+    with pytest.raises(ValueError):
+        client.api_client.call_api("/sessions", "GET")
+    assert m.api["GET /sessions"].count == 1
+
+
+def make_snapshots():
+    one, two = Metrics(0), Metrics(1)
+    one.record_container("session", True, 4)
+    one.record_api("GET /sessions", 0.02)
+    two.record_container("session", True, 1)
+    two.record_container("acquisition", False, 0)
+    two.record_api("GET /sessions", 3)
+    return [(0, one.snapshot()), (1, two.snapshot())]
+
+
+def test_aggregate():
+    totals = aggregate(make_snapshots())
+    assert totals["curated"] == {"session": 2}
+    assert totals["rejected"] == {"acquisition": 1}
+    assert totals["api"]["GET /sessions"].count == 2
+    assert totals["queue_depth"] == {"0": 4, "1": 0}
+
+
+def test_to_prometheus():
+    text = to_prometheus(aggregate(make_snapshots()), 10)
+    lines = text.splitlines()
+    assert 'curator_containers_curated_total{level="session"} 2' in lines
+    assert 'curator_containers_rejected_total{level="acquisition"} 1' in lines
+    assert (
+        'curator_api_request_duration_seconds_bucket{endpoint="GET /sessions",le="0.025"} 1'
+        in lines
+    )
+    assert (
+        'curator_api_request_duration_seconds_bucket{endpoint="GET /sessions",le="+Inf"} 2'
+        in lines
+    )
+    assert 'curator_worker_queue_depth{worker="0"} 4' in lines
+
+
+def test_summarize():
+    totals = aggregate(make_snapshots())
+    line = summarize(totals, {"curated": {"session": 1}}, 20, 10)
+    assert line == (
+        "20s: curated session 2 (0.1/s); rejected 1; "
+        "2 API calls (mean 1510ms); 4 queued"
+    )
+
+
+@pytest.mark.parametrize("name", ["metrics.json", "metrics.prom"])
+def test_metrics_writer(tmp_path, caplog, name):
+    shared = dict(make_snapshots())
+    writer = MetricsWriter(shared, tmp_path / name, 10)
+    with caplog.at_level(logging.INFO):
+        writer.write()
+        writer.write()
+    text = (tmp_path / name).read_text()
+    if name.endswith(".json"):
+        assert json.loads(text)["curated"] == {"session": 2}
+    else:
+        assert 'curator_containers_curated_total{level="session"} 2' in text
+    assert "No containers curated in the last 10s" in caplog.text
+    assert [path.name for path in tmp_path.iterdir()] == [name]
+
+
+def test_get_metrics_path(tmp_path):
+    curator = MagicMock()
+    curator.config.path = tmp_path / "output.csv"
+    assert get_metrics_path(curator) == tmp_path / "metrics.json"
+    curator.config.metrics_path = "/out/metrics.prom"
+    assert str(get_metrics_path(curator)) == "/out/metrics.prom"
+
+
+def test_start_stop_metrics(tmp_path):
+    curator = MagicMock()
+    curator.config.path = tmp_path / "output.csv"
+    manager = MagicMock()
+    manager.dict.return_value = {}
+    assert start_metrics(curator, manager) is None
+    assert metrics.get_metrics() is None
+
+    curator.config.metrics_interval = 60
+    writer = start_metrics(curator, manager)
+    metrics.record_container("project", True)
+    # Published by a worker
+    writer.shared[0] = Metrics(0).snapshot()
+    stop_metrics(writer)
+
+    out = json.loads((tmp_path / "metrics.json").read_text())
+    assert out["curated"] == {"project": 1}
+    assert out["queue_depth"] == {"main": 0, "0": 0}
+    assert metrics.get_metrics() is None
+
+
+def test_start_worker_metrics():
+    local_curator = MagicMock()
+    local_curator.config.metrics_interval = 60
+    start_worker_metrics(local_curator, 0, None)
+    assert metrics.get_metrics() is None
+    shared = {}
+    start_worker_metrics(local_curator, 0, shared)
+    local_curator.context._client.api_client.call_api("/projects", "GET")
+    metrics.record_container("subject", True)
+    metrics.stop_worker_metrics()
+    assert shared[0]["curated"] == {"subject": 1}
+    assert shared[0]["api"]["GET /projects"]["count"] == 1
@@ -0,0 +1,94 @@
+import subprocess
+from pathlib import Path
+
+import pytest
+from flywheel_gear_toolkit.utils import curator as c
+
+from fw_gear_hierarchy_curator import packages
+from fw_gear_hierarchy_curator.packages import (
+    cache_key,
+    cached_installs,
+    install_extra_packages,
+    is_satisfied,
+)
+
+
+@pytest.fixture
+def run_pip(mocker):
+    def _run_pip(*args):
+        if args[0] == "wheel":
+            (Path(args[2]) / "pkg-1.0-py3-none-any.whl").touch()
+
+    return mocker.patch.object(packages, "run_pip", side_effect=_run_pip)
+
+
+def test_cache_key():
+    assert cache_key(["a", "b"]) == cache_key(["a", "b"])
+    assert cache_key(["a", "b"]) != cache_key(["a"])
+
+
+def test_is_satisfied():
+    assert is_satisfied(["pytest", "pandas>=1"])
+    assert is_satisfied(["missing-package; python_version < '3'"])
+    assert not is_satisfied(["pytest<1"])
+    assert not is_satisfied(["missing-package"])
+    assert not is_satisfied(["git+https://example.com/pkg.git"])
+
+
+def test_install_satisfied(run_pip, caplog):
+    with caplog.at_level("INFO"):
+        install_extra_packages(["pytest"], "cache")
+    run_pip.assert_not_called()
+    assert "already installed" in caplog.text
+
+
+def test_install_without_cache(run_pip):
+    install_extra_packages(["missing-a==1", "missing-b"])
+    assert [call.args for call in run_pip.call_args_list] == [
+        ("install", "missing-a==1"),
+        ("install", "missing-b"),
+    ]
+
+
+def test_install_with_cache(run_pip, tmp_path, caplog):
+    with caplog.at_level("INFO"):
+        install_extra_packages(["missing-a==1"], tmp_path)
+    directory = tmp_path / cache_key(["missing-a==1"])
+    assert [path.name for path in tmp_path.iterdir()] == [directory.name]
+    assert [path.name for path in directory.iterdir()] == ["pkg-1.0-py3-none-any.whl"]
+    install_args = ("install", "--no-index", "--find-links", str(directory))
+    assert run_pip.call_args.args == install_args + ("missing-a==1",)
+    assert "caching wheels in" in caplog.text
+    # Cached
+    run_pip.reset_mock()
+    caplog.clear()
+    with caplog.at_level("INFO"):
+        install_extra_packages(["missing-a==1"], tmp_path)
+    run_pip.assert_called_once_with(*install_args, "missing-a==1")
+    assert "from the wheels cached in" in caplog.text
+
+
+def test_install_with_cache_failed(mocker, tmp_path):
+    error = subprocess.CalledProcessError(1, "pip")
+    mocker.patch.object(packages, "run_pip", side_effect=error)
+    with pytest.raises(subprocess.CalledProcessError):
+        install_extra_packages(["missing-a==1"], tmp_path)
+    # Nothing is cached
+    assert not list(tmp_path.iterdir())
+
+
+def test_cached_installs(mocker, tmp_path):
+    install = mocker.patch.object(packages, "install_extra_packages")
+    original = c.Curator._install_extra_package
+
+    class Curator(c.HierarchyCurator):
+        def curate_container(self, container):
+            pass
+
+    with cached_installs({"package_cache": str(tmp_path)}):
+        Curator(extra_packages=["missing-a"])
+        install.assert_called_once_with(["missing-a"], str(tmp_path))
+        install.side_effect = subprocess.CalledProcessError(1, "pip")
+        with pytest.raises(SystemExit):
+            Curator(extra_packages=["missing-a"])
+    assert c.Curator._install_extra_package is original
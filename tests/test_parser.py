@@ -1,9 +1,16 @@
 from unittest.mock import MagicMock
 
 import flywheel
+import pytest
 from flywheel_gear_toolkit import GearToolkitContext
 
-from fw_gear_hierarchy_curator.parser import parse_config
+from fw_gear_hierarchy_curator.parser import (
+    parse_config,
+    parse_feed,
+    parse_options,
+    parse_query,
+)
+from fw_gear_hierarchy_curator.utils import set_config_options
 
 
 def test_parse_config():
@@ -18,3 +25,70 @@ def test_parse_config():
     gear_context.client.get_analysis.assert_called_once_with("test")
     gear_context.client.get_subject.assert_called_once_with("test12")
     gear_context.get_input_path.called_count == 5
+
+
+def test_parse_query():
+    gear_context = MagicMock(spec=GearToolkitContext)
+    gear_context.config = {"debug": False}
+    assert parse_query(gear_context) is None
+    gear_context.config = {
+        "query": "label=test",
+        "query_type": "file",
+        "file_query": "type=nifti",
+    }
+    assert parse_query(gear_context) == {
+        "container_type": "file",
+        "query": "label=test",
+        "file_query": "type=nifti",
+    }
+
+
+def test_parse_feed():
+    gear_context = MagicMock(spec=GearToolkitContext)
+    gear_context.config = {"debug": False, "query": "label=test"}
+    assert parse_feed(gear_context) is None
+    gear_context.config = {"feed_interval": 300, "query": "label=test"}
+    assert parse_feed(gear_context) == {
+        "interval": 300,
+        "container_type": "acquisition",
+        "query": "label=test",
+        "file_query": None,
+    }
+
+
+def test_parse_options():
+    gear_context = MagicMock(spec=GearToolkitContext)
+    gear_context.config = {"debug": False, "shard_index": 0, "shard_count": 2}
+    gear_context.get_input_path.return_value = None
+    assert parse_options(gear_context) == {"shard_index": 0, "shard_count": 2}
+    gear_context.config = {"debug": False}
+    assert parse_options(gear_context) == {}
+    gear_context.get_input_path.return_value = "/flywheel/v0/input/journal.json"
+    assert parse_options(gear_context) == {
+        "resume_journal": "/flywheel/v0/input/journal.json"
+    }
+    gear_context.get_input_path.assert_called_with("resume-journal")
+    gear_context.get_input_path.return_value = None
+    gear_context.config = {"trace": True}
+    assert parse_options(gear_context) == {"trace": True}
+    gear_context.get_input_path.return_value = "/flywheel/v0/input/journal.json"
+    gear_context.config = {"parallel_level": "session"}
+    with pytest.raises(ValueError, match="resume-journal"):
+        parse_options(gear_context)
+
+
+def test_parse_options_flags_dont_override_curator():
+    gear_context = MagicMock(spec=GearToolkitContext)
+    # As filled in from defaults
+    gear_context.config = {"trace": False, "api_accounting": False, "profile": False}
+    gear_context.get_input_path.return_value = None
+    options = parse_options(gear_context)
+    assert options == {}
+    curator = MagicMock()
+    curator.config.trace = True
+    curator.config.api_accounting = True
+    curator.config.profile = True
+    set_config_options(curator, options)
+    assert curator.config.trace is True
+    assert curator.config.api_accounting is True
+    assert curator.config.profile is True
@@ -0,0 +1,95 @@
+import cProfile
+import pstats
+import time
+from unittest.mock import MagicMock
+
+import pytest
+
+from fw_gear_hierarchy_curator import profiling
+from fw_gear_hierarchy_curator.profiling import (
+    collapse_stacks,
+    frame_name,
+    merge_profiles,
+    start_profiling,
+    start_worker_profiling,
+    stop_profiling,
+    stop_worker_profiling,
+    worker_profile_path,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_profiler():
+    yield
+    if profiling._profiler is not None:
+        profiling._profiler[0].disable()
+        profiling._profiler = None
+
+
+def inner():
+    time.sleep(0.01)
+
+
+def outer():
+    inner()
+    time.sleep(0.01)
+
+
+def profile(func):
+    profiler = cProfile.Profile()
+    profiler.runcall(func)
+    return pstats.Stats(profiler)
+
+
+def test_frame_name():
+    assert frame_name(("/a/curator.py", 10, "curate")) == "curate_(curator.py:10)"
+    assert frame_name(("~", 0, "<built-in method time.sleep>")) == (
+        "<built-in_method_time.sleep>"
+    )
+
+
+def test_collapse_stacks():
+    stacks = collapse_stacks(profile(outer))
+    names = {
+        tuple(frame.split("_(")[0] for frame in stack.split(";")): seconds
+        for stack, seconds in stacks.items()
+    }
+    sleep = "<built-in_method_time.sleep>"
+    assert names[("outer", "inner", sleep)] == pytest.approx(0.01, abs=0.005)
+    assert names[("outer", sleep)] == pytest.approx(0.01, abs=0.005)
+
+
+def test_merge_profiles(tmp_path):
+    paths = []
+    for i in range(2):
+        paths.append(tmp_path / f"{i}.prof")
+        profile(outer).dump_stats(paths[-1])
+    assert merge_profiles([], tmp_path) is None
+    stats = merge_profiles(paths, tmp_path)
+    assert stats.total_calls == 2 * pstats.Stats(str(paths[0])).total_calls
+    lines = (tmp_path / "profile.collapsed").read_text().splitlines()
+    assert any(line.startswith("outer_(test_profiling.py") for line in lines)
+    assert all(int(line.rsplit(" ", 1)[1]) > 0 for line in lines)
+    pstats.Stats(str(tmp_path / "profile.prof"))
+
+
+def test_profiling(tmp_path):
+    curator = MagicMock()
+    curator.config.path = tmp_path / "output.csv"
+    assert start_profiling(curator) is None
+    stop_profiling(None, 1)
+    start_worker_profiling(curator, 0)
+    assert profiling._profiler is None
+
+    curator.config.profile = True
+    directory = start_profiling(curator)
+    assert directory == tmp_path
+    start_worker_profiling(curator, 0)
+    outer()
+    stop_worker_profiling()
+    assert worker_profile_path(tmp_path, 0).exists()
+    stop_profiling(directory, 2)
+    assert sorted(p.name for p in tmp_path.iterdir()) == [
+        "profile.collapsed",
+        "profile.prof",
+    ]
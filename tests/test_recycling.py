@@ -0,0 +1,50 @@
+from unittest.mock import MagicMock
+
+import pytest
+
+from fw_gear_hierarchy_curator import recycling
+from fw_gear_hierarchy_curator.recycling import Limits, curated, record_container
+
+
+@pytest.fixture(autouse=True)
+def reset_count(monkeypatch):
+    monkeypatch.setattr(recycling, "_curated", 0)
+
+
+def test_record_container():
+    record_container()
+    record_container()
+    assert curated() == 2
+
+
+def test_limits_from_curator():
+    curator = MagicMock()
+    assert Limits.from_curator(curator) is None
+    curator.config.max_containers_per_worker = 10
+    curator.config.max_worker_rss = 1.5
+    limits = Limits.from_curator(curator)
+    assert limits.max_containers == 10
+    assert limits.max_rss == 3 * 2**19
+
+
+def test_limits_containers():
+    limits = Limits(max_containers=2)
+    record_container()
+    assert limits.reached() is None
+    record_container()
+    assert limits.reached() == "Curated 2 containers"
+
+
+def test_limits_rss(mocker):
+    mocker.patch(
+        "fw_gear_hierarchy_curator.recycling.memory_usage",
+        return_value={"peak_rss": 2**31, "rss": 2**30},
+    )
+    assert Limits(max_rss=2**31).reached() is None
+    assert Limits(max_rss=2**30).reached() == "Using 1024.0MB"
+    mocker.patch(
+        "fw_gear_hierarchy_curator.recycling.memory_usage",
+        return_value={"peak_rss": 2**31},
+    )
+    # Peak memory when the resident memory isn't available
+    assert Limits(max_rss=2**31).reached() == "Using 2048.0MB"
@@ -0,0 +1,259 @@
+import dataclasses
+import json
+import queue
+
+import pandas as pd
+import pytest
+from flywheel_gear_toolkit.utils.reporters import (
+    AggregatedReporter,
+    BaseLogRecord,
+    LogRecord,
+)
+
+from fw_gear_hierarchy_curator.reports import (
+    BatchedReporter,
+    StreamingReporter,
+    arrow_schema,
+    main,
+    make_reporter,
+    merge_reports,
+    report_type,
+    shard_report_path,
+    worker_report_path,
+)
+
+
+@dataclasses.dataclass
+class CountRecord(BaseLogRecord):
+    label: str = ""
+    count: int = 0
+    size: float = 0.0
+    ok: bool = False
+
+
+def test_shard_report_path(tmp_path):
+    out = shard_report_path(tmp_path / "output.csv", 1, 4)
+    assert out == tmp_path / "output.shard-1-of-4.csv"
+
+
+def test_worker_report_path(tmp_path):
+    out = worker_report_path(tmp_path / "output.csv", "main")
+    assert out == tmp_path / "output.worker-main.csv"
+    out = worker_report_path(tmp_path / "output.csv.gz", 0)
+    assert out == tmp_path / "output.worker-0.csv.gz"
+
+
+@pytest.mark.parametrize(
+    "path, exp",
+    [
+        ("output.csv", "csv"),
+        ("output.json", "json"),
+        ("out.put.csv.gz", "csv.gz"),
+        ("output.csv.zst", "csv.zst"),
+        ("output.parquet", "parquet"),
+        ("output.txt", "txt"),
+    ],
+)
+def test_report_type(path, exp):
+    assert report_type(path) == exp
+
+
+def test_make_reporter(tmp_path):
+    assert type(make_reporter(tmp_path / "output.csv")) is AggregatedReporter
+    assert isinstance(make_reporter(tmp_path / "output.csv.gz"), StreamingReporter)
+
+
+def test_streaming_reporter_gzip(tmp_path):
+    path = tmp_path / "output.csv.gz"
+    reporter = StreamingReporter(path, format=CountRecord, row_group_size=2)
+    for i in range(5):
+        reporter.append_log(label=f"acq-{i}", count=i, size=0.5, ok=True)
+    # Two batches written, one buffered
+    assert len(reporter.rows) == 1
+    reporter.close()
+    df = pd.read_csv(path)
+    assert list(df.columns) == ["label", "count", "size", "ok"]
+    assert list(df["count"].values) == list(range(5))
+
+
+def test_streaming_reporter_empty(tmp_path):
+    path = tmp_path / "output.csv.gz"
+    reporter = StreamingReporter(path, format=CountRecord)
+    del reporter
+    assert path.read_bytes()
+    assert list(pd.read_csv(path).columns) == ["label", "count", "size", "ok"]
+
+
+def test_streaming_reporter_zstd(tmp_path):
+    zstandard = pytest.importorskip("zstandard")
+    path = tmp_path / "output.csv.zst"
+    reporter = StreamingReporter(path, format=CountRecord)
+    reporter.append_log(label="acq", count=1, size=0.5, ok=True)
+    reporter.close()
+    with zstandard.open(path, "rt") as fp:
+        assert fp.read().splitlines() == ["label,count,size,ok", "acq,1,0.5,True"]
+
+
+def test_streaming_reporter_parquet(tmp_path):
+    pa = pytest.importorskip("pyarrow")
+    parquet = pytest.importorskip("pyarrow.parquet")
+    path = tmp_path / "output.parquet"
+    reporter = StreamingReporter(path, format=CountRecord, row_group_size=2)
+    for i in range(3):
+        reporter.append_log(label=f"acq-{i}", count=i, size=0.5, ok=i % 2 == 0)
+    reporter.close()
+    parquet_file = parquet.ParquetFile(path)
+    assert parquet_file.num_row_groups == 2
+    assert parquet_file.schema_arrow == arrow_schema(CountRecord)
+    assert parquet_file.schema_arrow.field("count").type == pa.int64()
+    table = parquet_file.read()
+    assert table.column("ok").to_pylist() == [True, False, True]
+
+
+def test_streaming_reporter_queue(tmp_path):
+    path = tmp_path / "output.csv.gz"
+    q = queue.Queue()
+    reporter = StreamingReporter(path, format=CountRecord, queue=q)
+    reporter.append_log(label="acq", count=1, size=0.5, ok=True)
+    reporter.write("END")
+    # Not written by the process sending records
+    del reporter
+    assert not path.exists()
+    writer = StreamingReporter(path, format=CountRecord, queue=q)
+    writer.worker()
+    assert list(pd.read_csv(path)["label"].values) == ["acq"]
+
+
+@pytest.mark.parametrize("name", ["output.csv.gz", "output.txt"])
+def test_streaming_reporter_invalid(tmp_path, name):
+    path = tmp_path / name
+    path.write_text("")
+    with pytest.raises(ValueError):
+        StreamingReporter(path, format=CountRecord)
+    assert path.read_text() == ""
+
+
+def test_batched_reporter_csv(tmp_path):
+    path = tmp_path / "output.csv"
+    reporter = BatchedReporter(path, format=LogRecord, batch_size=2)
+    reporter.append_log(msg="first")
+    # Header and first record written
+    assert len(path.read_text().splitlines()) == 2
+    reporter.append_log(msg="second")
+    assert len(path.read_text().splitlines()) == 2
+    reporter.append_log(msg="third")
+    assert len(path.read_text().splitlines()) == 4
+    reporter.close()
+    df = pd.read_csv(path)
+    assert list(df["msg"].values) == ["first", "second", "third"]
+
+
+def test_batched_reporter_json(tmp_path):
+    path = tmp_path / "output.json"
+    reporter = BatchedReporter(path, format=LogRecord, batch_size=10)
+    reporter.append_log(msg="first")
+    reporter.append_log(msg="second")
+    assert not path.exists()
+    reporter.close()
+    reporter.close()
+    records = json.loads(path.read_text())
+    assert [rec["msg"] for rec in records] == ["first", "second"]
+
+
+def test_batched_reporter_existing(tmp_path):
+    path = tmp_path / "output.json"
+    path.write_text("[]")
+    with pytest.raises(ValueError):
+        BatchedReporter(path, format=LogRecord)
+    assert path.read_text() == "[]"
+
+
+def test_merge_reports_csv(tmp_path):
+    (tmp_path / "a.csv").write_text("msg,err\nfirst,\nsecond,bad\n")
+    (tmp_path / "b.csv").write_text("msg,err\nthird,\n")
+    (tmp_path / "c.csv").write_text("")
+    count = merge_reports(
+        [tmp_path / "a.csv", tmp_path / "b.csv", tmp_path / "c.csv"],
+        tmp_path / "out.csv",
+    )
+    assert count == 3
+    df = pd.read_csv(tmp_path / "out.csv")
+    assert list(df["msg"].values) == ["first", "second", "third"]
+
+
+def test_merge_reports_csv_header_mismatch(tmp_path):
+    (tmp_path / "a.csv").write_text("msg,err\nfirst,\n")
+    (tmp_path / "b.csv").write_text("msg\nthird\n")
+    with pytest.raises(ValueError):
+        merge_reports([tmp_path / "a.csv", tmp_path / "b.csv"], tmp_path / "out.csv")
+
+
+def test_merge_reports_json(tmp_path):
+    (tmp_path / "a.json").write_text('[\n{"msg": "first"}]')
+    # Unterminated, as left by a killed job.
+    (tmp_path / "b.json").write_text('[\n{"msg": "second"},\n{"msg": "third"}')
+    count = merge_reports(
+        [tmp_path / "a.json", tmp_path / "b.json"], tmp_path / "out.json"
+    )
+    assert count == 3
+    assert json.loads((tmp_path / "out.json").read_text()) == [
+        {"msg": "first"},
+        {"msg": "second"},
+        {"msg": "third"},
+    ]
+
+
+@pytest.mark.parametrize("type_", ["csv.gz", "csv.zst", "parquet"])
+def test_merge_reports_streaming(tmp_path, type_):
+    if type_ == "csv.zst":
+        pytest.importorskip("zstandard")
+    if type_ == "parquet":
+        pytest.importorskip("pyarrow.parquet")
+    paths = [shard_report_path(tmp_path / f"out.{type_}", i, 2) for i in range(2)]
+    for i, path in enumerate(paths):
+        reporter = StreamingReporter(path, format=CountRecord, row_group_size=1)
+        for j in range(i + 1):
+            reporter.append_log(label=f"acq-{i}-{j}", count=j, size=0.5, ok=True)
+        reporter.close()
+
+    assert merge_reports(paths, tmp_path / f"out.{type_}") == 3
+
+    if type_ == "parquet":
+        df = pd.read_parquet(tmp_path / f"out.{type_}")
+    else:
+        compression = "zstd" if type_ == "csv.zst" else "gzip"
+        df = pd.read_csv(tmp_path / f"out.{type_}", compression=compression)
+    assert list(df["label"].values) == ["acq-0-0", "acq-1-0", "acq-1-1"]
+
+
+def test_merge_reports_parquet_schema_mismatch(tmp_path):
+    pytest.importorskip("pyarrow.parquet")
+    StreamingReporter(tmp_path / "a.parquet", format=CountRecord).close()
+    StreamingReporter(tmp_path / "b.parquet", format=LogRecord).close()
+    with pytest.raises(ValueError, match="Schema"):
+        merge_reports(
+            [tmp_path / "a.parquet", tmp_path / "b.parquet"],
+            tmp_path / "out.parquet",
+        )
+
+
+@pytest.mark.parametrize(
+    "inputs, output",
+    [
+        (["a.csv"], "out.json"),
+        (["a.csv"], "out.txt"),
+        (["a.csv"], "a.csv"),
+        (["a.csv"], "out.csv.gz"),
+    ],
+)
+def test_merge_reports_errors(tmp_path, inputs, output):
+    (tmp_path / "a.csv").write_text("msg\nfirst\n")
+    with pytest.raises(ValueError):
+        merge_reports([tmp_path / path for path in inputs], tmp_path / output)
+
+
+def test_main(tmp_path):
+    (tmp_path / "a.csv").write_text("msg\nfirst\n")
+    (tmp_path / "b.csv").write_text("msg\nsecond\n")
+    main([str(tmp_path / "out.csv"), str(tmp_path / "a.csv"), str(tmp_path / "b.csv")])
+    assert (tmp_path / "out.csv").read_text().splitlines() == ["msg", "first", "second"]
@@ -0,0 +1,154 @@
+import datetime
+import time
+from pathlib import Path
+from unittest.mock import MagicMock
+
+import flywheel
+import pytest
+
+from fw_gear_hierarchy_curator.schedule import (
+    Deadline,
+    get_journal_path,
+    handle_work_until_deadline,
+    order_by_priority,
+    read_journal,
+    resolve_deadline,
+    write_journal,
+)
+
+
+def make_sessions():
+    return [
+        flywheel.Session(
+            id="old", modified=datetime.datetime(2020, 1, 1), files=[{}, {}]
+        ),
+        flywheel.Session(id="unknown"),
+        flywheel.Session(id="new", modified=datetime.datetime(2023, 1, 1), files=[]),
+        flywheel.Session(
+            id="newest", modified=datetime.datetime(2023, 6, 1), files=[{}]
+        ),
+    ]
+
+
+@pytest.mark.parametrize(
+    "priority, exp",
+    [
+        (None, ["old", "unknown", "new", "newest"]),
+        ("modified_desc", ["newest", "new", "old", "unknown"]),
+        ("file_count_desc", ["old", "newest", "new", "unknown"]),
+        (lambda ses: ses.id, ["new", "newest", "old", "unknown"]),
+    ],
+)
+def test_order_by_priority(priority, exp):
+    curator = MagicMock()
+    curator.config.priority = priority
+    out = order_by_priority(curator, make_sessions())
+    assert [ses.id for ses in out] == exp
+
+
+def test_order_by_priority_unknown():
+    curator = MagicMock()
+    curator.config.priority = "largest"
+    with pytest.raises(ValueError):
+        order_by_priority(curator, make_sessions())
+
+
+def test_deadline_projected():
+    deadline = Deadline(time.time() + 100, margin=0)
+    assert deadline.projected() == 0
+    deadline.record(10)
+    deadline.record(20)
+    assert deadline.projected() == 15
+
+
+@pytest.mark.parametrize(
+    "left, margin, durations, exp",
+    [
+        (100, 0, [], False),
+        (100, 0, [10, 20], False),
+        (100, 90, [10, 20], True),
+        (100, 0, [150], True),
+        (-1, 0, [], True),
+    ],
+)
+def test_deadline_should_stop(left, margin, durations, exp):
+    deadline = Deadline(time.time() + left, margin=margin)
+    for duration in durations:
+        deadline.record(duration)
+    assert deadline.should_stop() == exp
+
+
+def test_deadline_from_curator():
+    curator = MagicMock()
+    assert Deadline.from_curator(curator) is None
+    curator.config.deadline = 100.0
+    deadline = Deadline.from_curator(curator)
+    assert deadline.deadline == 100.0
+    assert deadline.margin == 60
+    curator.config.deadline = datetime.datetime.fromtimestamp(200)
+    curator.config.deadline_margin = 5
+    deadline = Deadline.from_curator(curator)
+    assert deadline.deadline == 200.0
+    assert deadline.margin == 5
+
+
+def test_resolve_deadline():
+    curator = MagicMock()
+    resolve_deadline(curator, 100)
+    assert "deadline" not in vars(curator.config)
+    curator.config.time_budget = 3600
+    resolve_deadline(curator, 100)
+    assert curator.config.deadline == 3700
+    # Explicit deadline takes precedence
+    curator.config.deadline = 50
+    resolve_deadline(curator, 100)
+    assert curator.config.deadline == 50
+
+
+def test_handle_work_until_deadline(mocker):
+    handle_work = mocker.patch("fw_gear_hierarchy_curator.schedule.handle_work")
+    deadline = MagicMock(**{"remaining.return_value": 5, "projected.return_value": 10})
+    deadline.should_stop.side_effect = [False, False, True]
+    work = [{"id": str(i), "container_type": "subject"} for i in range(4)]
+    curator = MagicMock()
+    handle = MagicMock()
+
+    left = handle_work_until_deadline(work, curator, handle, deadline)
+
+    assert left == work[2:]
+    assert [call[0] for call in handle_work.call_args_list] == [
+        ([work[0]], curator, handle),
+        ([work[1]], curator, handle),
+    ]
+    assert deadline.record.call_count == 2
+
+
+def test_handle_work_until_deadline_finishes(mocker):
+    mocker.patch("fw_gear_hierarchy_curator.schedule.handle_work")
+    deadline = Deadline(time.time() + 100, margin=0)
+    work = [{"id": str(i), "container_type": "subject"} for i in range(2)]
+    assert handle_work_until_deadline(work, MagicMock(), MagicMock(), deadline) == []
+    assert len(deadline.durations) == 2
+
+
+def test_handle_work_until_stopped(mocker):
+    handle_work = mocker.patch("fw_gear_hierarchy_curator.schedule.handle_work")
+    work = [{"id": str(i), "container_type": "subject"} for i in range(4)]
+    # Checked after the first unit, so that at least one is handled
+    stop = MagicMock(side_effect=[False, True])
+    assert handle_work_until_deadline(work, MagicMock(), MagicMock(), None, stop) == (
+        work[2:]
+    )
+    assert handle_work.call_count == 2
+
+
+def test_journal(tmp_path):
+    curator = MagicMock()
+    curator.config.path = tmp_path / "output.csv"
+    assert get_journal_path(curator) == tmp_path / "resume_journal.json"
+    curator.config.journal_path = str(tmp_path / "journal.json")
+    path = get_journal_path(curator)
+    assert path == tmp_path / "journal.json"
+    units = [{"id": "test", "container_type": "subject"}]
+    write_journal(path, units)
+    assert read_journal(path) == units
@@ -0,0 +1,92 @@
+import logging
+import sys
+from unittest.mock import MagicMock
+
+import pytest
+from flywheel_gear_toolkit.utils.curator import HierarchyCurator
+
+from fw_gear_hierarchy_curator import startup
+from fw_gear_hierarchy_curator.startup import (
+    curator_module,
+    detached_client,
+    record_first_container,
+    set_start_method,
+    since_launch,
+    start_worker_clock,
+)
+
+
+class Curator(HierarchyCurator):
+    def curate_container(self, container):
+        pass
+
+
+@pytest.fixture
+def start_method(mocker):
+    set_method = mocker.patch.object(startup.multiprocessing, "set_start_method")
+    mocker.patch.object(startup.multiprocessing, "set_forkserver_preload")
+    mocker.patch.object(startup.multiprocessing.forkserver, "ensure_running")
+    return set_method
+
+
+@pytest.fixture
+def clock():
+    yield
+    startup._launched = None
+
+
+def test_curator_module(mocker):
+    mocker.patch.object(sys, "path", list(sys.path))
+    assert curator_module(Curator()) == __name__
+    curator = Curator()
+    curator.__class__ = type("Curator", (Curator,), {"__module__": "__main__"})
+    assert curator_module(curator) is None
+
+
+def test_set_start_method(start_method):
+    curator = Curator()
+    assert set_start_method(curator) == "fork"
+    start_method.assert_called_once_with("fork", force=True)
+    startup.multiprocessing.set_forkserver_preload.assert_not_called()
+    curator.config.start_method = "forkserver"
+    assert set_start_method(curator) == "forkserver"
+    preload = startup.multiprocessing.set_forkserver_preload.call_args[0][0]
+    assert preload[: len(startup.PRELOAD_MODULES)] == startup.PRELOAD_MODULES
+    assert preload[-1] == __name__
+    startup.multiprocessing.forkserver.ensure_running.assert_called_once()
+    curator.config.start_method = "thread"
+    with pytest.raises(ValueError, match="start_method"):
+        set_start_method(curator)
+
+
+def test_detached_client(mocker):
+    get_start_method = mocker.patch.object(
+        startup.multiprocessing, "get_start_method", return_value="fork"
+    )
+    curator = Curator()
+    curator.context = MagicMock()
+    client = curator.context._client
+    with detached_client(curator):
+        assert curator.context._client is client
+    get_start_method.return_value = "forkserver"
+    with detached_client(curator):
+        assert curator.context._client is None
+    assert curator.context._client is client
+
+
+def test_worker_clock(mocker, clock, caplog):
+    time_mock = mocker.patch.object(startup.time, "time", return_value=10.5)
+    assert since_launch() == 0
+    record_first_container(logging.getLogger("test"))
+    assert not caplog.records
+    start_worker_clock(10)
+    assert since_launch() == 0.5
+    with caplog.at_level(logging.INFO):
+        record_first_container(logging.getLogger("test"))
+        time_mock.return_value = 12
+        record_first_container(logging.getLogger("test"))
+    assert [record.msg for record in caplog.records] == [
+        "Curated first container 0.500s after launch"
+    ]
+    start_worker_clock(None)
+    assert since_launch() == 0
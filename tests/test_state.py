@@ -0,0 +1,106 @@
+import logging
+import pickle
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+import pytest
+from flywheel_gear_toolkit.utils.curator import HierarchyCurator
+
+from fw_gear_hierarchy_curator import state
+from fw_gear_hierarchy_curator.state import (
+    SharedData,
+    detached_data,
+    log_worker_ready,
+    make_local_curator,
+    memory_usage,
+    share_data,
+)
+
+
+class Curator(HierarchyCurator):
+    def curate_container(self, container):
+        pass
+
+
+@pytest.fixture
+def shared():
+    shared = SharedData.write(
+        {
+            "array": np.arange(1000),
+            "df": pd.DataFrame({"a": np.arange(10), "b": np.linspace(0, 1, 10)}),
+            "labels": ["a", "b"],
+        }
+    )
+    yield shared
+    shared.remove()
+
+
+def test_shared_data(shared):
+    data = shared.read()
+    np.testing.assert_array_equal(data["array"], np.arange(1000))
+    assert data["df"]["b"].iloc[-1] == 1
+    assert data["labels"] == ["a", "b"]
+    # Backed by the read-only map
+    assert not data["array"].flags.writeable
+    with pytest.raises(ValueError):
+        data["array"][0] = 1
+    shared.remove()
+    assert not Path(shared.path).exists()
+
+
+def test_shared_data_pickle(shared):
+    # Only the path is sent to the workers
+    assert len(pickle.dumps(shared)) < 200
+
+
+def test_share_data(mocker):
+    get_start_method = mocker.patch.object(
+        state.multiprocessing, "get_start_method", return_value="fork"
+    )
+    curator = Curator()
+    curator.data = {"a": 1}
+    assert share_data(curator) is None
+    get_start_method.return_value = "spawn"
+    shared = share_data(curator)
+    try:
+        assert shared.read() == {"a": 1}
+    finally:
+        shared.remove()
+    curator.data = {}
+    assert share_data(curator) is None
+
+
+def test_detached_data(shared):
+    curator = Curator()
+    data = {"a": 1}
+    curator.data = data
+    with detached_data(curator, None):
+        assert curator.data is data
+    with detached_data(curator, shared):
+        assert curator.data == {}
+    assert curator.data is data
+
+
+def test_make_local_curator(shared):
+    curator = Curator()
+    curator.data = {"a": 1}
+    local_curator = make_local_curator(curator)
+    assert local_curator is not curator
+    assert local_curator.data is curator.data
+    local_curator = make_local_curator(curator, shared)
+    assert local_curator.data["labels"] == ["a", "b"]
+    assert curator.data == {"a": 1}
+
+
+def test_memory_usage():
+    usage = memory_usage()
+    assert usage["peak_rss"] > 0
+    if Path("/proc/self/smaps_rollup").exists():
+        assert 0 < usage["private"] <= usage["rss"]
+
+
+def test_log_worker_ready(caplog):
+    with caplog.at_level(logging.INFO):
+        log_worker_ready(logging.getLogger("test"), 0.5)
+    assert caplog.records[0].msg.startswith("Started in 0.500s (peak_rss ")
@@ -0,0 +1,91 @@
+import math
+import pickle
+
+import numpy as np
+import pandas as pd
+import pytest
+from flywheel_gear_toolkit.utils.curator import HierarchyCurator
+
+from fw_gear_hierarchy_curator.tables import LookupTable, load_input_table
+
+
+class Curator(HierarchyCurator):
+    def curate_container(self, container):
+        pass
+
+
+@pytest.fixture
+def table():
+    df = pd.DataFrame(
+        {
+            "subject": ["sub-1", "sub-2", "sub-1"],
+            "weight": [60.5, 70.0, None],
+            "age": [30, 40, 50],
+            "note": ["a", None, "c"],
+        }
+    )
+    return LookupTable.from_frame(df, "subject")
+
+
+def test_lookup_table(table):
+    assert len(table) == 3
+    assert table.columns["age"].dtype == np.int64
+    assert table.columns["note"].dtype.kind == "U"
+    assert "sub-1" in table
+    assert "sub-3" not in table
+    assert table["sub-2"] == {
+        "subject": "sub-2",
+        "weight": 70.0,
+        "age": 40,
+        "note": "",
+    }
+    assert [row["age"] for row in table.get_all("sub-1")] == [30, 50]
+    assert math.isnan(table.get_all("sub-1")[1]["weight"])
+    assert table.get("sub-3") is None
+    assert table.get_all("sub-3") == []
+    with pytest.raises(KeyError):
+        table["sub-3"]
+
+
+def test_lookup_table_invalid():
+    with pytest.raises(ValueError, match="Key column"):
+        LookupTable({"a": np.arange(2)}, "b")
+    with pytest.raises(ValueError, match="different lengths"):
+        LookupTable({"a": np.arange(2), "b": np.arange(3)}, "a")
+
+
+def test_save_open(table, tmp_path):
+    table.save(tmp_path / "table")
+    opened = LookupTable.open(tmp_path / "table")
+    assert isinstance(opened.columns["age"], np.memmap)
+    assert not opened.columns["age"].flags.writeable
+    assert opened["sub-2"] == table["sub-2"]
+
+
+def test_pickle(table):
+    copy = pickle.loads(pickle.dumps(table))
+    # Saved once
+    directory = table.directory
+    assert pickle.loads(pickle.dumps(table)).directory == directory
+    assert copy.directory == directory
+    assert copy["sub-2"] == table["sub-2"]
+
+
+def test_pickle_cleanup():
+    table = LookupTable({"a": np.arange(2)}, "a")
+    pickle.dumps(table)
+    directory = table.directory
+    assert directory.exists()
+    del table
+    assert not directory.exists()
+
+
+def test_load_input_table(tmp_path):
+    path = tmp_path / "input.csv"
+    path.write_text("session,subject\n001,sub-1\n002,sub-1\n")
+    curator = Curator(additional_input_one=str(path))
+    table = load_input_table(curator, "additional_input_one", "session", dtype=str)
+    assert table["001"]["subject"] == "sub-1"
+    table = load_input_table(curator, str(path), "subject")
+    assert [row["session"] for row in table.get_all("sub-1")] == [1, 2]
+    assert load_input_table(curator, "additional_input_two", "session") is None
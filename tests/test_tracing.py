@@ -0,0 +1,132 @@
+import json
+from unittest.mock import MagicMock
+
+import flywheel
+import pytest
+
+from fw_gear_hierarchy_curator import tracing
+from fw_gear_hierarchy_curator.tracing import (
+    Tracer,
+    container_path,
+    get_trace_path,
+    merge_traces,
+    start_tracing,
+    start_worker_tracing,
+    stop_tracing,
+    stop_worker_tracing,
+    worker_trace_path,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_tracer():
+    yield
+    tracing.set_tracer(None)
+
+
+def read_events(path):
+    with open(path) as fp:
+        return [json.loads(line) for line in fp]
+
+
+def test_container_path():
+    session = flywheel.Session(
+        label="ses-1", parents={"group": "grp", "project": "p1", "subject": "s1"}
+    )
+    assert container_path(session) == "grp/p1/s1/ses-1"
+    assert container_path(flywheel.Subject(id="s1")) == "s1"
+
+
+def test_get_trace_path(tmp_path):
+    curator = MagicMock()
+    curator.config.path = tmp_path / "output.csv"
+    assert get_trace_path(curator) == tmp_path / "trace.json"
+    curator.config.trace_path = tmp_path / "out.json"
+    assert get_trace_path(curator) == tmp_path / "out.json"
+    assert worker_trace_path(tmp_path / "trace.json", 1) == (
+        tmp_path / "trace.worker-1.jsonl"
+    )
+
+
+def test_tracer(tmp_path):
+    path = tmp_path / "spans.jsonl"
+    tracer = Tracer(path, 3, batch_size=2)
+    with tracer.span("curate session", path="p1/ses-1"):
+        pass
+    # Process name and span written
+    events = read_events(path)
+    assert events[0]["ph"] == "M"
+    assert events[1]["name"] == "curate session"
+    assert events[1]["ph"] == "X"
+    assert events[1]["args"] == {"worker": 3, "path": "p1/ses-1"}
+    assert events[1]["dur"] >= 0
+    tracer.add_span("GET /sessions", "api", 1, 0.5, {})
+    tracer.flush()
+    events = read_events(path)
+    assert events[2]["ts"] == 1e6
+    assert events[2]["dur"] == 5e5
+
+
+def test_span_disabled():
+    with tracing.span("curate", flywheel.Session(label="test")):
+        pass
+    assert tracing.get_tracer() is None
+
+
+def test_span(tmp_path):
+    tracer = Tracer(tmp_path / "spans.jsonl", 0)
+    tracing.set_tracer(tracer)
+    with pytest.raises(ValueError):
+        with tracing.span("curate", flywheel.Session(label="ses-1")):
+            raise ValueError()
+    with tracing.span("hydrate", path="session/1"):
+        pass
+    assert [(e["name"], e["args"]["path"]) for e in tracer.events[1:]] == [
+        ("curate session", "ses-1"),
+        ("hydrate", "session/1"),
+    ]
+
+
+def test_merge_traces(tmp_path):
+    one = tmp_path / "one.jsonl"
+    two = tmp_path / "two.jsonl"
+    one.write_text('{"name": "a"}\n{"name": "b"}\n')
+    two.write_text('\n{"name": "c"}\n')
+    assert merge_traces([one, two], tmp_path / "trace.json") == 3
+    with open(tmp_path / "trace.json") as fp:
+        trace = json.load(fp)
+    assert [event["name"] for event in trace["traceEvents"]] == ["a", "b", "c"]
+
+
+def test_tracing(tmp_path):
+    curator = MagicMock()
+    curator.config.path = tmp_path / "output.csv"
+    assert start_tracing(curator) is None
+    stop_tracing(None, 1)
+
+    curator.config.trace = True
+    path = start_tracing(curator)
+    with tracing.span("curate", flywheel.Project(label="test")):
+        pass
+    # Worker
+    local_curator = MagicMock()
+    local_curator.config.path = curator.config.path
+    local_curator.config.trace = True
+    main_tracer = tracing.get_tracer()
+    start_worker_tracing(local_curator, 0)
+    local_curator.context._client.api_client.call_api("/projects", "GET")
+    with tracing.span("curate", flywheel.Subject(label="sub")):
+        pass
+    stop_worker_tracing()
+    tracing.set_tracer(main_tracer)
+    stop_tracing(path, 2)
+
+    with open(path) as fp:
+        events = json.load(fp)["traceEvents"]
+    spans = [(e["args"]["worker"], e["name"]) for e in events if e["ph"] == "X"]
+    assert spans == [
+        ("main", "curate project"),
+        (0, "GET /projects"),
+        (0, "curate subject"),
+    ]
+    assert [p.name for p in tmp_path.iterdir()] == ["trace.json"]
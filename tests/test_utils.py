@@ -1,13 +1,22 @@
+import datetime
+import re
 from unittest.mock import MagicMock, patch
 
 import flywheel
 import pytest
 
+from fw_gear_hierarchy_curator.frontier import Entry
 from fw_gear_hierarchy_curator.utils import (
+    add_request_hook,
     container_from_pickleable_dict,
     container_to_pickleable_dict,
+    get_config_option,
     handle_work,
+    iter_query_work,
     make_walker,
+    match_filter,
+    set_config_options,
+    shard_of,
 )
 
 
@@ -34,33 +43,28 @@ def test_container_from_pickleable_dict(mocker):
     curator_mock.context.client.get_subject.assert_called_once_with("test")
 
 
-def test_handle_work(mocker):
-    pickleable_mock = mocker.patch(
-        "fw_gear_hierarchy_curator.utils.container_from_pickleable_dict"
-    )
+def test_handle_work():
     func = MagicMock()
     curator = MagicMock()
-    children = [MagicMock()]
+    children = [
+        {"container_type": "session", "id": "a"},
+        {
+            "container_type": "file",
+            "id": "b",
+            "parent_type": "session",
+            "parent_id": "a",
+        },
+    ]
     handle_work(children, curator, func)
-    pickleable_mock.assert_called_once_with(children[0], curator)
-    func.assert_called_once_with(curator, [pickleable_mock.return_value])
-
-
-def test_handle_container_api_exception_doesnt_validate(mocker, caplog):
-    pickleable_mock = mocker.patch(
-        "fw_gear_hierarchy_curator.utils.container_from_pickleable_dict"
+    # Containers are only fetched when walked or curated
+    curator.context.client.get_session.assert_not_called()
+    func.assert_called_once_with(
+        curator, [Entry("session", "a"), Entry("file", "b", "session", "a")]
     )
-    pickleable_mock.side_effect = flywheel.rest.ApiException
-    func = MagicMock()
-    curator = MagicMock()
-    children = [MagicMock()]
-    handle_work(children, curator, func)
-    func.assert_called_once_with(curator, [])
-    assert caplog.record_tuples[0][2].startswith("Could not get container")
 
 
 def test_make_walker(mocker):
-    w_patch = mocker.patch("fw_gear_hierarchy_curator.utils.walker.Walker")
+    w_patch = mocker.patch("fw_gear_hierarchy_curator.utils.frontier.Frontier")
     curator = MagicMock()
     curator.config.depth_first = True
     curator.config.reload = True
@@ -68,5 +72,179 @@ def test_make_walker(mocker):
     container = MagicMock()
     _ = make_walker(container, curator)
     w_patch.assert_called_once_with(
-        container, depth_first=True, reload=True, stop_level="project"
+        container,
+        curator.context.client,
+        depth_first=True,
+        reload=True,
+        stop_level="project",
+        compact=None,
+        size=None,
+    )
+
+
+@pytest.mark.parametrize(
+    "query, exp",
+    [
+        (None, True),
+        ("type=nifti", True),
+        ("type!=nifti", False),
+        ("type=nifti,size>10", True),
+        ("size<=10", False),
+        ("modified>2023-01-01", True),
+        ("modified<2023-01-01T00:00:00", False),
+        ("classification.Intent=Structural", True),
+        ("tags=curated", True),
+        ("info.missing=value", False),
+        ("info.missing!=value", True),
+        ("name=T1<T2.nii", True),
+        ("name!=T1<T2.nii", False),
+        ("size>=99.5", True),
+        ("size=100.0", True),
+    ],
+)
+def test_match_filter(query, exp):
+    file_ = flywheel.FileEntry(
+        name="T1<T2.nii",
+        type="nifti",
+        size=100,
+        modified=datetime.datetime(2023, 6, 1, tzinfo=datetime.timezone.utc),
+        classification={"Intent": ["Structural"]},
+        tags=["curated"],
+        info={},
+    )
+    assert match_filter(file_, query) == exp
+
+
+@pytest.mark.parametrize(
+    "query, message",
+    [
+        ("type", "Could not parse filter term 'type'"),
+        ("=nifti", "Could not parse filter term '=nifti'"),
+        ("size>large", "Could not parse 'large' as int in filter term 'size>large'"),
+        ("modified>June", "Could not parse 'June' as datetime"),
+        ("tags>curated", "Operator '>' can't be used on list attribute 'tags'"),
+    ],
+)
+def test_match_filter_bad_term(query, message):
+    file_ = flywheel.FileEntry(
+        size=100,
+        modified=datetime.datetime(2023, 6, 1, tzinfo=datetime.timezone.utc),
+        tags=["curated"],
+    )
+    with pytest.raises(ValueError, match=re.escape(message)):
+        match_filter(file_, query)
+
+
+def test_iter_query_work():
+    client = MagicMock()
+    parent = flywheel.Project(id="proj")
+    client.sessions.iter_find.return_value = [
+        flywheel.Session(id="ses-1"),
+        flywheel.Session(id="ses-2"),
+    ]
+    out = list(iter_query_work(client, parent, "session", query="label=test"))
+    client.sessions.iter_find.assert_called_once_with(
+        "parents.project=proj,label=test", limit=250
+    )
+    assert out == [
+        {"id": "ses-1", "container_type": "session"},
+        {"id": "ses-2", "container_type": "session"},
+    ]
+
+
+def test_iter_query_work_files():
+    client = MagicMock()
+    parent = flywheel.Subject(id="sub")
+    acq = flywheel.Acquisition(id="acq")
+    acq.files = [
+        flywheel.FileEntry(file_id="f1", type="nifti"),
+        flywheel.FileEntry(file_id="f2", type="dicom"),
+    ]
+    client.acquisitions.iter_find.return_value = [acq]
+    out = list(iter_query_work(client, parent, "file", file_query="type=nifti"))
+    client.acquisitions.iter_find.assert_called_once_with(
+        "parents.subject=sub", limit=250
     )
+    assert out == [
+        {
+            "id": "f1",
+            "container_type": "file",
+            "parent_type": "acquisition",
+            "parent_id": "acq",
+        }
+    ]
+
+
+def test_iter_query_work_bad_type():
+    with pytest.raises(ValueError):
+        list(iter_query_work(MagicMock(), flywheel.Project(id="proj"), "project"))
+
+
+def test_iter_query_work_bad_file_query():
+    client = MagicMock()
+    with pytest.raises(ValueError, match="Could not parse"):
+        # Raised before the generator is started
+        iter_query_work(client, flywheel.Project(id="proj"), "file", file_query="x")
+    client.acquisitions.iter_find.assert_not_called()
+
+
+def test_get_config_option():
+    curator = MagicMock()
+    assert get_config_option(curator, "shard_count", 1) == 1
+    curator.config.shard_count = 4
+    assert get_config_option(curator, "shard_count", 1) == 4
+
+
+def test_set_config_options():
+    curator = MagicMock()
+    curator.config.shard_count = 4
+    set_config_options(curator, {"shard_index": 2, "shard_count": None})
+    assert curator.config.shard_index == 2
+    assert curator.config.shard_count == 4
+    set_config_options(curator, None)
+
+
+def test_shard_of():
+    ids = [f"{i:024x}" for i in range(400)]
+    shards = [shard_of(_id, 4) for _id in ids]
+    # Stable across calls and spread over every shard
+    assert shards == [shard_of(_id, 4) for _id in ids]
+    assert shard_of("5f2b9c3a1e4d8f0012345678", 4) == 3
+    assert all(shards.count(i) > 50 for i in range(4))
+
+
+def test_add_request_hook():
+    client = MagicMock()
+    call_api = client.api_client.call_api
+    call_api.return_value = "response"
+    hook = MagicMock()
+    add_request_hook(client, hook)
+    out = client.api_client.call_api("/sessions/{SessionId}", "GET", {"id": 1})
+    assert out == "response"
+    call_api.assert_called_once_with("/sessions/{SessionId}", "GET", {"id": 1})
+    request = hook.call_args[0][0]
+    assert request.endpoint == "GET /sessions/{SessionId}"
+    assert request.start > 0
+    assert request.duration >= 0
+
+
+def test_add_request_hook_sizes():
+    client = MagicMock()
+    client.api_client.last_response.data = b"[1, 2]"
+    client.api_client.sanitize_for_serialization.side_effect = lambda body: body
+    hook = MagicMock()
+    add_request_hook(client, hook)
+    client.api_client.call_api("/sessions", "POST", body={"label": "test"})
+    request = hook.call_args[0][0]
+    assert request.sent == len('{"label": "test"}')
+    assert request.received == 6
+
+
+def test_add_request_hook_error():
+    client = MagicMock()
+    client.api_client.call_api.side_effect = ValueError()
+    hook = MagicMock()
+    add_request_hook(client, hook)
+    with pytest.raises(ValueError):
+        client.api_client.call_api("/sessions", "GET")
+    assert hook.call_args[0][0].received == 0
@@ -0,0 +1,113 @@
+import csv
+import logging
+import time
+from unittest.mock import MagicMock
+
+import flywheel
+import pytest
+
+from fw_gear_hierarchy_curator import watchdog
+from fw_gear_hierarchy_curator.watchdog import (
+    Watchdog,
+    start_watchdog,
+    start_worker_watchdog,
+    stop_watchdog,
+    stop_worker_watchdog,
+    write_slow_report,
+)
+
+
+@pytest.fixture(autouse=True)
+def reset_watchdog():
+    yield
+    stop_worker_watchdog()
+
+
+def slow_function(dog):
+    dog.check()
+
+
+def test_watchdog_check(caplog):
+    shared = []
+    dog = Watchdog(0.01, 1, shared)
+    session = flywheel.Session(id="s1", label="ses-1", parents={"project": "p1"})
+    with caplog.at_level(logging.WARNING):
+        with dog.watch(session):
+            time.sleep(0.02)
+            slow_function(dog)
+            # Only logged once
+            dog.check()
+    assert len(caplog.records) == 1
+    assert "session p1/ses-1 has been curating for" in caplog.text
+    assert "slow_function" in caplog.text
+    (row,) = shared
+    assert row["container_id"] == "s1"
+    assert row["path"] == "p1/ses-1"
+    assert row["worker"] == 1
+    assert row["seconds"] >= 0.02
+    assert "slow_function" in row["stack"]
+
+
+def test_watchdog_fast():
+    shared = []
+    dog = Watchdog(60, 0, shared)
+    with dog.watch(flywheel.Session(id="s1")):
+        dog.check()
+    assert shared == []
+    assert dog.container is None
+
+
+def test_watchdog_finished_before_check(caplog):
+    shared = []
+    dog = Watchdog(0.01, 0, shared)
+    with caplog.at_level(logging.WARNING):
+        with pytest.raises(ValueError):
+            with dog.watch(flywheel.Acquisition(id="a1", label="acq")):
+                time.sleep(0.02)
+                raise ValueError()
+    assert "acquisition acq took" in caplog.text
+    assert shared[0]["stack"] == ""
+
+
+def test_watchdog_thread():
+    shared = []
+    start_worker_watchdog(MagicMock(config=MagicMock(slow_threshold=0.05)), 0, shared)
+    with watchdog.watch(flywheel.Subject(id="sub", label="sub-1")):
+        time.sleep(0.2)
+    stop_worker_watchdog()
+    assert watchdog._watchdog is None
+    assert "test_watchdog_thread" in shared[0]["stack"]
+
+
+def test_watch_disabled():
+    start_worker_watchdog(MagicMock(), 0, [])
+    assert watchdog._watchdog is None
+    with watchdog.watch(flywheel.Subject(id="sub")):
+        pass
+
+
+def test_slow_report(tmp_path, caplog):
+    curator = MagicMock()
+    curator.config.path = tmp_path / "output.csv"
+    assert start_watchdog(curator, MagicMock()) is None
+    stop_watchdog(curator, None)
+    stop_watchdog(curator, [])
+    assert not (tmp_path / "slow_containers.csv").exists()
+
+    curator.config.slow_threshold = 10
+    manager = MagicMock()
+    manager.list.return_value = []
+    shared = start_watchdog(curator, manager)
+    row = {
+        "container_type": "file",
+        "container_id": "f1",
+        "path": "p1/a.dcm",
+        "worker": 0,
+        "stack": "",
+    }
+    shared.extend([{**row, "seconds": 11}, {**row, "seconds": 30}])
+    stop_watchdog(curator, shared)
+    with open(tmp_path / "slow_containers.csv") as fp:
+        rows = list(csv.DictReader(fp))
+    assert [row["seconds"] for row in rows] == ["30", "11"]
+    assert "Found 2 slow containers" in caplog.text